@@ -0,0 +1,14 @@
+# use unicode literals
+from __future__ import unicode_literals
+
+# conditions MTG card images for proxies. the entry points:
+#   config = Config("~/proxies")
+#   card = resolve_card("Sol Ring", config)
+#   img, path, sha1 = fetch_image(card, config)
+#   fix_card(card, img, config).save("sol_ring.png")
+#   for message in process_decklist(open("deck.txt"), config): print message
+# importing the package does not touch the disk; the card index is opened
+# and opencv is imported the first time they are needed
+from pymrox.config import Config
+from pymrox.pipeline import resolve_card, fetch_image, process_cards, process_decklist
+from pymrox.conditioning import fix_card
@@ -0,0 +1,183 @@
+# use unicode literals
+from __future__ import unicode_literals
+
+# `PyMrox.py batch`: many deck lists in one run. every printing is resolved,
+# downloaded and conditioned once for all of the decks it is in, then linked
+# into the output directory of each deck next to a manifest of the deck
+import os
+import io
+import glob
+import json
+import shutil
+import hashlib
+
+from pymrox.cache import fs_path, write_shared
+from pymrox.carddb import normalize_card_name
+from pymrox.download import getCardSetCode, getCardId
+from pymrox.pipeline import parse_decklist, resolve_entry, getOutputFileName, condition_cards, recording, conditioning_pool
+
+# the file in each deck's output directory that lists the deck
+BATCH_MANIFEST = "manifest.json"
+
+# what counts as a deck list in a directory of them
+BATCH_DECK_PATTERN = "*.txt"
+
+# (deck list, output directory) for each deck. a directory stands for the deck lists
+# in it. each deck goes to a directory of its own in output_root named after the
+# deck list, or is given one as "deck.txt=directory" (for a directory of deck
+# lists that is where their directories go instead)
+def find_decks(specs, output_root):
+	decks = []
+	for spec in specs:
+		path, _, out = spec.partition("=")
+		path = os.path.expanduser(path)
+		if os.path.isdir(path):
+			for deck in sorted(glob.glob(os.path.join(path, BATCH_DECK_PATTERN))):
+				decks.append((deck, os.path.expanduser(out or output_root), None))
+		else:
+			decks.append((path, None, os.path.expanduser(out) if out else None))
+
+	# named after the deck list, with a number added when two of them share a name
+	used = set(os.path.abspath(out) for deck, root, out in decks if out)
+	found = []
+	for deck, root, out in decks:
+		if not out:
+			stem = os.path.splitext(os.path.basename(deck))[0]
+			out = os.path.join(root or output_root, stem)
+			suffix = 2
+			while os.path.abspath(out) in used:
+				out = os.path.join(root or output_root, "{:s}-{:d}".format(stem, suffix))
+				suffix += 1
+			used.add(os.path.abspath(out))
+		found.append((deck, out))
+	return found
+
+# where the cards rendered with the render parameters of the config go, so a run with
+# other parameters renders them again instead of reusing these
+def render_dir(config):
+	params = json.dumps(config.render_params(), sort_keys = True)
+	return config.output_dir + "/.renders/" + hashlib.sha1(params.encode("utf-8")).hexdigest()[:12]
+
+# puts the rendered card in a deck's directory as a hard link, or as a copy when
+# the two are on different file systems. returns "link" or "copy"
+def link_card(source, target):
+	source, target = fs_path(source), fs_path(target)
+	if os.path.exists(target) and os.path.samefile(source, target):
+		return "link"
+	tmp_path = target + ".tmp-batch"
+	if os.path.exists(tmp_path):
+		os.remove(tmp_path)
+	try:
+		os.link(source, tmp_path)
+		how = "link"
+	except OSError:
+		shutil.copy2(source, tmp_path)
+		how = "copy"
+	os.rename(tmp_path, target)
+	return how
+
+# the files of the deck's last manifest, if it has one
+def manifest_files(out):
+	try:
+		with open(out + "/" + BATCH_MANIFEST, "r") as f:
+			return set(entry["file"] for entry in json.load(f)["cards"] if entry.get("file"))
+	except (IOError, ValueError, KeyError):
+		return set()
+
+# conditions the cards of every deck once and fills in each deck's directory.
+# yields the line to log for each card that was conditioned and then one for each
+# deck. clear forgets the cached images of the cards first so they are downloaded again
+def process_batch(decks, config, clear = False):
+	config.prepare()
+	render_config = config.copy()
+	render_config.output_dir = render_dir(config)
+	if not os.path.exists(render_config.output_dir):
+		os.makedirs(render_config.output_dir)
+
+	with recording(config):
+		# read every deck and resolve each name once for all of them
+		lists = []
+		found = {}
+		cards = []
+		printings = {}
+		for deck, out in decks:
+			with io.open(deck, "r", encoding = "utf-8") as f:
+				entries = [(card_name, quantity) for card_name, quantity in parse_decklist(f) if card_name.strip()]
+			lists.append((deck, out, entries))
+			for card_name, quantity in entries:
+				key = normalize_card_name(card_name)
+				if key in found:
+					continue
+				card, messages = resolve_entry(card_name, config)
+				found[key] = card
+				for message in messages:
+					yield message
+				if not card:
+					continue
+				if getOutputFileName(card, render_config) not in printings:
+					printings[getOutputFileName(card, render_config)] = len(cards)
+					cards.append(card)
+
+		# forget the cached images so they are downloaded again
+		if clear:
+			for card in cards:
+				config.image_cache.forget(getCardSetCode(card), getCardId(card))
+
+		# every printing once
+		messages = []
+		with conditioning_pool(render_config, len(cards)) as pool:
+			for message in condition_cards(cards, render_config, pool):
+				messages.append(message)
+				yield message
+
+		for deck, out, entries in lists:
+			yield fill_deck(deck, out, entries, found, printings, messages, render_config)
+
+# links the rendered cards into the deck's directory and writes its manifest.
+# returns the line to log for the deck
+def fill_deck(deck, out, entries, found, printings, messages, render_config):
+	if not os.path.exists(out):
+		os.makedirs(out)
+
+	# quantities of the same printing add up, however its name was written
+	cards = []
+	by_output = {}
+	missing = []
+	for card_name, quantity in entries:
+		card = found[normalize_card_name(card_name)]
+		if not card:
+			missing.append({"name": card_name, "quantity": quantity})
+			continue
+		source = getOutputFileName(card, render_config)
+		if source in by_output:
+			by_output[source]["quantity"] += quantity
+			continue
+		message = messages[printings[source]]
+		entry = {"name": card.name, "quantity": quantity, "set": getCardSetCode(card), "number": getCardId(card), "file": None}
+		if message.startswith("[ERROR]"):
+			entry["error"] = message
+		else:
+			entry["file"] = card.name + ".png"
+			entry["stored"] = link_card(source, out + "/" + entry["file"])
+		by_output[source] = entry
+		cards.append(entry)
+
+	# cards that were dropped from the deck since the last run
+	for stale in manifest_files(out) - set(entry["file"] for entry in cards if entry["file"]):
+		if os.path.isfile(fs_path(out + "/" + stale)):
+			os.remove(fs_path(out + "/" + stale))
+
+	manifest = {
+		"deck": os.path.abspath(deck),
+		"params": render_config.render_params(),
+		"cards": cards,
+		"missing": missing,
+		"quantity": sum(entry["quantity"] for entry in cards),
+	}
+	write_shared(out + "/" + BATCH_MANIFEST, json.dumps(manifest, indent = 2, sort_keys = True).encode("utf-8"))
+
+	failed = len([entry for entry in cards if not entry["file"]])
+	message = "Deck {:s} - {:d} cards ({:d} different) @ {:s}".format(deck, manifest["quantity"], len(cards), out)
+	if missing or failed:
+		message = "[ERROR] " + message + " ({:d} not found, {:d} failed)".format(len(missing), failed)
+	return message
@@ -0,0 +1,278 @@
+# use unicode literals
+from __future__ import unicode_literals
+
+# `PyMrox.py bench`: times the conditioning of synthetic cards, one for each
+# region handler, step by step and then a whole deck of them, without touching
+# the network. the results are written as json so that two revisions can be
+# compared, and the run fails when it is slower than a baseline
+import os
+import io
+import json
+import time
+import random
+import shutil
+import zipfile
+import tempfile
+import platform
+from PIL import Image, ImageDraw
+
+from pymrox import timing
+from pymrox.config import Config
+from pymrox.conditioning import fix_card, select_frame
+from pymrox.pipeline import process_cards
+
+# bump when the fixtures or what is measured change, results of different
+# versions are not compared
+BENCH_VERSION = "1"
+
+# where the fixture images are filed in the benchmark's image cache
+BENCH_URL_PATTERN = "bench:{:s}/{:s}.png"
+
+# size of the fixture images, the same as the scryfall pngs
+BENCH_CARD_SIZE = 745, 1040
+
+# the sets select_frame looks at and the sets of the fixtures
+BENCH_SETS = {
+	"4ED": "1995-04-01",
+	"WTH": "1997-06-09",
+	"APC": "2001-06-04",
+	"8ED": "2003-07-28",
+	"FUT": "2007-05-04",
+	"MED": "2007-09-10",
+	"VMA": "2014-06-16",
+	"M15": "2014-07-18",
+	"BFZ": "2015-10-02",
+}
+
+# one fixture for each region handler: the handler select_frame has to pick for it,
+# the set and card data that make it pick it and the boxes the text is drawn in
+# (in cropped card coordinates, the split layout reads sideways)
+BENCH_FIXTURES = [
+	("left", "fix_cards_with_left_illustrator", "WTH", {}, [(50, 925, 555, 970)]),
+	("centered", "fix_cards_with_centered_illustrator", "MED", {}, [(100, 925, 575, 979)]),
+	("paintbrush", "fix_cards_with_paintbrush_illustrator", "8ED", {}, [(35, 940, 540, 990)]),
+	("black_background", "fix_cards_with_illustrator_on_black_background", "VMA", {}, [(20, 956, 300, 1015), (425, 981, 700, 1015)]),
+	("planeswalker", "fix_planeswalker", "M15", {"loyalty": "3"}, [(150, 950, 575, 1015)]),
+	("futuresight_creature", "fix_futuresight_creature_card", "FUT", {"power": "2", "toughness": "2"}, [(75, 930, 555, 985)]),
+	("split", "fix_cards_with_split_layout", "APC", {"layout": "split"}, [(665, 110, 697, 480), (665, 610, 697, 980)]),
+]
+
+# the steps that are timed, in the order they happen
+BENCH_STAGES = ["crop", "autocontrast", "mask", "contours", "inpaint", "enhance", "expand", "resize", "encode"]
+
+# differences smaller than this are noise however large they are relatively
+BENCH_NOISE = 0.002
+
+# line of text like the illustrator and copyright lines at the bottom of a card
+BENCH_TEXT = "Illus. Some Artist  TM & (c) Wizards of the Coast  123/264 R"
+
+# name and number of the nth card of the deck, the first card of each handler
+# is the one that gets timed step by step
+def fixture_card(n):
+	label, handler, code, fields, boxes = BENCH_FIXTURES[n % len(BENCH_FIXTURES)]
+	name = "Bench {:s} {:d}".format(label.replace("_", " ").title(), n + 1)
+	return label, handler, code, fields, boxes, name, str(n + 1)
+
+# mtgjson style card data for a deck of fixture cards
+def fixture_sets(cards):
+	all_sets = dict((code, {"name": code, "code": code, "releaseDate": date, "border": "black", "cards": []}) for code, date in BENCH_SETS.items())
+	for n in range(cards):
+		label, handler, code, fields, boxes, name, number = fixture_card(n)
+		card = {"name": name, "number": number, "layout": "normal", "colorIdentity": []}
+		card.update(fields)
+		all_sets[code]["cards"].append(card)
+	return all_sets
+
+# a card with some artwork and text in the boxes of its handler, seeded so every
+# run draws the same card
+def fixture_image(n):
+	label, handler, code, fields, boxes, name, number = fixture_card(n)
+	rand = random.Random(n)
+	img = Image.new("RGBA", BENCH_CARD_SIZE, (20, 20, 20, 255))
+	draw = ImageDraw.Draw(img)
+	draw.rectangle([30, 30, BENCH_CARD_SIZE[0] - 30, BENCH_CARD_SIZE[1] - 30], fill = (rand.randint(100, 200), rand.randint(80, 180), rand.randint(60, 160)))
+	for _ in range(400):
+		x, y = rand.randint(40, BENCH_CARD_SIZE[0] - 45), rand.randint(100, 600)
+		draw.ellipse([x, y, x + rand.randint(5, 40), y + rand.randint(5, 40)], fill = (rand.randint(0, 255), rand.randint(0, 255), rand.randint(0, 255)))
+
+	# the text is drawn at twice the size of the default font, on a dark band
+	for x1, y1, x2, y2 in boxes:
+		x1, y1, x2, y2 = x1 + 10, y1 + 10, x2 + 10, y2 + 10
+		sideways = "split" == fields.get("layout")
+		width, height = (y2 - y1, x2 - x1) if sideways else (x2 - x1, y2 - y1)
+		text = Image.new("L", (width // 2, height // 2), 0)
+		text_draw = ImageDraw.Draw(text)
+		for row in range(1, height // 2 - 10, 14):
+			text_draw.text((rand.randint(0, 10), row), BENCH_TEXT, fill = 240)
+		text = text.resize((width, height), Image.NEAREST)
+		if sideways:
+			text = text.rotate(90, expand = True)
+		draw.rectangle([x1, y1, x2, y2], fill = (15, 15, 15))
+		img.paste((240, 240, 240, 255), (x1, y1), text)
+
+	out = io.BytesIO()
+	img.save(out, "PNG")
+	return out.getvalue()
+
+# a config in workdir for a deck of fixture cards, with the card data and the
+# images in place so that nothing is downloaded
+def prepare_fixtures(workdir, cards, jobs):
+	config = Config(workdir, overwrite = True, stage_cache = False, cache_dir = workdir + "/images", cache_size = 1 << 20, image_urls = [BENCH_URL_PATTERN], jobs = jobs)
+	config.prepare()
+	zip_path = config.json_dir + "/AllSets.json.zip"
+	data = json.dumps(fixture_sets(cards), sort_keys = True)
+	if not os.path.isfile(zip_path) or zipfile.ZipFile(zip_path).read("AllSets.json") != data:
+		with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zip_ref:
+			zip_ref.writestr("AllSets.json", data)
+
+	for n in range(cards):
+		label, handler, code, fields, boxes, name, number = fixture_card(n)
+		url = BENCH_URL_PATTERN.format(code.lower(), number)
+		if not config.image_cache.get(url, code.lower(), number):
+			config.image_cache.put(url, code.lower(), number, fixture_image(n))
+	return config
+
+# (seconds, stage times) of the fastest of repeat runs of conditioning and
+# encoding one card
+def time_card(card, img, config, repeat):
+	best = None
+	for _ in range(repeat):
+		times = timing.StageTimes()
+		previous = timing.record(times)
+		try:
+			start = time.time()
+			output_image = fix_card(card, img, config)
+			with timing.stage("encode"):
+				output_image.save(io.BytesIO(), "PNG")
+			seconds = time.time() - start
+		finally:
+			timing.record(previous)
+		if not best or seconds < best[0]:
+			best = (seconds, times)
+	return best
+
+# runs the benchmark and returns the results. every handler is timed on its
+# first fixture card, then the whole deck goes through the pipeline
+def run_benchmark(workdir, cards = 100, repeat = 3, jobs = 1):
+	import cv2
+	import numpy as np
+	import PIL
+
+	config = prepare_fixtures(workdir, max(cards, len(BENCH_FIXTURES)), jobs)
+	results = {
+		"benchmark": BENCH_VERSION,
+		"created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+		"platform": platform.platform(),
+		"python": platform.python_version(),
+		"opencv": cv2.__version__,
+		"numpy": np.__version__,
+		"pillow": PIL.__version__,
+		"repeat": repeat,
+		"handlers": {},
+	}
+
+	for n in range(len(BENCH_FIXTURES)):
+		label, handler, code, fields, boxes, name, number = fixture_card(n)
+		card = config.db.find_printings(name)[0]
+		if select_frame(card, config)[0].__name__ != handler:
+			raise ValueError("{:s} is conditioned by {:s} instead of {:s}".format(name, select_frame(card, config)[0].__name__, handler))
+		img = Image.open(io.BytesIO(fixture_image(n)))
+		img.load()
+		seconds, times = time_card(card, img, config, repeat)
+		results["handlers"][label] = {
+			"card": name,
+			"handler": handler,
+			"seconds": round(seconds, 6),
+			"stages": dict((stage, round(times.seconds.get(stage, 0.0), 6)) for stage in BENCH_STAGES),
+		}
+
+	if cards:
+		names = [fixture_card(n)[5] for n in range(cards)]
+		start = time.time()
+		errors = [message for message in process_cards(names, config) if message.startswith("[ERROR]")]
+		seconds = time.time() - start
+		if errors:
+			raise ValueError("the deck did not go through cleanly: " + errors[0])
+		results["deck"] = {"cards": cards, "jobs": config.jobs_count, "seconds": round(seconds, 6), "per_card": round(seconds / cards, 6)}
+
+	config.close()
+	return results
+
+# the timings of the results as one flat dict, keyed like "handlers.split.seconds".
+# the steps of a handler are only there with stages, they are too short to be
+# held to a threshold on their own but show where a slower handler lost its time
+def flatten_results(results, stages = False):
+	metrics = {}
+	for label, handler in results.get("handlers", {}).items():
+		metrics["handlers.{:s}.seconds".format(label)] = handler["seconds"]
+		if stages:
+			for stage, seconds in handler["stages"].items():
+				metrics["handlers.{:s}.stages.{:s}".format(label, stage)] = seconds
+	if "deck" in results:
+		metrics["deck.seconds"] = results["deck"]["seconds"]
+	return metrics
+
+# (metric, baseline seconds, seconds) for every handler or deck timing that got
+# slower than the baseline by more than threshold (a fraction) and by more than
+# BENCH_NOISE
+def find_regressions(results, baseline, threshold):
+	if baseline.get("benchmark") != results.get("benchmark"):
+		raise ValueError("the baseline is from benchmark version {:s}, this is version {:s}".format(baseline.get("benchmark"), results.get("benchmark")))
+	if "deck" in baseline and "deck" in results and baseline["deck"]["cards"] != results["deck"]["cards"]:
+		raise ValueError("the baseline deck has {:d} cards, this one has {:d}".format(baseline["deck"]["cards"], results["deck"]["cards"]))
+	regressions = []
+	old, new = flatten_results(baseline), flatten_results(results)
+	for metric in sorted(set(old) & set(new)):
+		if new[metric] - old[metric] > max(old[metric] * threshold, BENCH_NOISE):
+			regressions.append((metric, old[metric], new[metric]))
+	return regressions
+
+# the steps of a handler next to the baseline, (stage, baseline seconds, seconds)
+def compare_stages(results, baseline, label):
+	old, new = flatten_results(baseline, True), flatten_results(results, True)
+	compared = []
+	for stage in BENCH_STAGES:
+		metric = "handlers.{:s}.stages.{:s}".format(label, stage)
+		if metric in old and metric in new:
+			compared.append((stage, old[metric], new[metric]))
+	return compared
+
+# the results as lines of text, in milliseconds
+def format_results(results):
+	lines = []
+	lines.append("{:22s} {:>9s}  ".format("handler", "total") + " ".join("{:>8s}".format(stage[:8]) for stage in BENCH_STAGES))
+	for label, handler in sorted(results["handlers"].items()):
+		lines.append("{:22s} {:9.1f}  ".format(label, handler["seconds"] * 1000) + " ".join("{:8.1f}".format(handler["stages"][stage] * 1000) for stage in BENCH_STAGES))
+	if "deck" in results:
+		deck = results["deck"]
+		lines.append("deck of {:d} cards with {:d} jobs: {:.2f} s ({:.1f} ms per card)".format(deck["cards"], deck["jobs"], deck["seconds"], deck["per_card"] * 1000))
+	return lines
+
+# runs the benchmark in workdir (or a temporary directory that is removed after),
+# writes the results to output and compares them with the baseline. returns the
+# results, the baseline results and the regressions
+def benchmark(workdir = None, cards = 100, repeat = 3, jobs = 1, output = None, baseline = None, threshold = 0.15):
+	# read the baseline first so a bad one fails before all of the work
+	baseline_results = None
+	if baseline:
+		with open(baseline, "r") as f:
+			baseline_results = json.load(f)
+
+	temporary = not workdir
+	if temporary:
+		workdir = tempfile.mkdtemp(prefix = "pymrox-bench-")
+	try:
+		results = run_benchmark(workdir, cards, repeat, jobs)
+	finally:
+		if temporary:
+			shutil.rmtree(workdir, ignore_errors = True)
+
+	if output:
+		with open(output, "w") as f:
+			json.dump(results, f, indent = 2, sort_keys = True)
+			f.write("\n")
+
+	regressions = []
+	if baseline_results:
+		regressions = find_regressions(results, baseline_results, threshold)
+	return results, baseline_results, regressions
@@ -0,0 +1,243 @@
+# use unicode literals
+from __future__ import unicode_literals
+
+# the shared image cache and the stage cache
+import os
+import sys
+import glob
+import io
+import json
+import hashlib
+import sqlite3
+import tempfile
+import threading
+import time
+import numpy as np
+
+# a path the way the file system takes it. python 2 encodes unicode paths with the
+# file system encoding, which is ascii under a C locale, so one with a card name
+# like "J\u00f6tun Grunt" in it is given as utf-8 bytes when it cannot be encoded
+def fs_path(path):
+	if isinstance(path, unicode):
+		try:
+			path.encode(sys.getfilesystemencoding() or "ascii")
+		except UnicodeError:
+			return path.encode("utf-8")
+	return path
+
+# write a file so that readers never see a partial one
+def write_atomic(path, data):
+	fd, tmp_path = tempfile.mkstemp(dir = os.path.dirname(path), prefix = ".tmp-")
+	try:
+		with os.fdopen(fd, "wb") as f:
+			f.write(data)
+		os.rename(tmp_path, path)
+	except:
+		os.remove(tmp_path)
+		raise
+
+# write_atomic for files that other programs read, which are left readable by everyone
+def write_shared(path, data):
+	write_atomic(path, data)
+	os.chmod(path, 0o644)
+
+# the downloaded card images are kept in one cache for every output directory
+DEFAULT_IMAGE_CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "pymrox")
+IMAGE_CACHE_SCHEMA = "1"
+IMAGE_CACHE_COUNTERS = ["hits", "misses", "downloads", "downloaded_bytes", "evictions", "evicted_bytes"]
+# images used this recently are never evicted, so runs going on at the same time keep theirs
+IMAGE_CACHE_GRACE = 3600
+
+# card images by (source url, set code, card number). the images themselves are
+# stored once per content hash under objects/ and the index is a sqlite database,
+# so several processes can use the cache at the same time
+class ImageCache(object):
+	def __init__(self, path, max_bytes):
+		self.path = path
+		self.max_bytes = max_bytes
+		self.local = threading.local()
+		if not os.path.exists(self.path + "/objects"):
+			try:
+				os.makedirs(self.path + "/objects")
+			except OSError:
+				if not os.path.isdir(self.path + "/objects"):
+					raise
+
+	# one connection per thread and process (pool workers are forked)
+	@property
+	def conn(self):
+		conn = getattr(self.local, "conn", None)
+		if not conn or self.local.pid != os.getpid():
+			conn = self.local.conn = sqlite3.connect(self.path + "/index.sqlite", timeout = 60)
+			self.local.pid = os.getpid()
+			conn.execute("PRAGMA journal_mode=WAL")
+			with conn:
+				conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+				conn.execute("CREATE TABLE IF NOT EXISTS images (url TEXT, set_code TEXT, number TEXT, sha1 TEXT, size INTEGER, fetched REAL, used REAL, PRIMARY KEY (url, set_code, number))")
+				conn.execute("CREATE INDEX IF NOT EXISTS images_sha1 ON images (sha1)")
+				conn.execute("CREATE INDEX IF NOT EXISTS images_card ON images (set_code, number)")
+				conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)")
+				conn.execute("INSERT OR IGNORE INTO meta VALUES ('schema', ?)", (IMAGE_CACHE_SCHEMA,))
+				conn.executemany("INSERT OR IGNORE INTO counters VALUES (?, 0)", [(name,) for name in IMAGE_CACHE_COUNTERS])
+		return conn
+
+	def close(self):
+		conn = getattr(self.local, "conn", None)
+		if conn and self.local.pid == os.getpid():
+			conn.close()
+		self.local.conn = None
+
+	def object_path(self, sha1):
+		return "{:s}/objects/{:s}/{:s}".format(self.path, sha1[:2], sha1)
+
+	# (path, sha1) of the cached image or None. touch marks it as used, a lookup that
+	# does not use the image leaves it out (it saves a write to the index)
+	def get(self, url, set_code, number, touch = True):
+		row = self.conn.execute("SELECT sha1 FROM images WHERE url = ? AND set_code = ? AND number = ?", (url, set_code, number)).fetchone()
+		if not row or not os.path.isfile(self.object_path(row[0])):
+			return None
+		if not touch:
+			return self.object_path(row[0]), row[0]
+		with self.conn:
+			self.conn.execute("UPDATE images SET used = ? WHERE url = ? AND set_code = ? AND number = ?", (time.time(), url, set_code, number))
+		return self.object_path(row[0]), row[0]
+
+	def put(self, url, set_code, number, data):
+		sha1 = hashlib.sha1(data).hexdigest()
+		path = self.object_path(sha1)
+		if not os.path.isfile(path):
+			if not os.path.isdir(os.path.dirname(path)):
+				try:
+					os.mkdir(os.path.dirname(path))
+				except OSError:
+					pass
+			write_atomic(path, data)
+		now = time.time()
+		with self.conn:
+			self.conn.execute("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?)", (url, set_code, number, sha1, len(data), now, now))
+		return path, sha1
+
+	# forget the images of a card so that they are fetched again
+	def forget(self, set_code, number):
+		with self.conn:
+			self.conn.execute("DELETE FROM images WHERE set_code = ? AND number = ?", (set_code, number))
+
+	def count(self, **counts):
+		with self.conn:
+			self.conn.executemany("UPDATE counters SET value = value + ? WHERE name = ?", [(value, name) for name, value in counts.items()])
+
+	# drop the least recently used images until the cache fits in max_bytes.
+	# returns (images removed, bytes freed)
+	def evict(self, max_bytes = None):
+		if max_bytes is None:
+			max_bytes = self.max_bytes
+		removed = []
+		freed = 0
+		with self.conn:
+			self.conn.execute("BEGIN IMMEDIATE")
+			rows = self.conn.execute("SELECT sha1, MAX(size), MAX(used) FROM images GROUP BY sha1 ORDER BY MAX(used)").fetchall()
+			total = sum(row[1] for row in rows)
+			recent = time.time() - IMAGE_CACHE_GRACE
+			for sha1, size, used in rows:
+				if total <= max_bytes or used >= recent:
+					break
+				self.conn.execute("DELETE FROM images WHERE sha1 = ?", (sha1,))
+				removed.append(sha1)
+				total -= size
+				freed += size
+			self.conn.execute("UPDATE counters SET value = value + ? WHERE name = 'evictions'", (len(removed),))
+			self.conn.execute("UPDATE counters SET value = value + ? WHERE name = 'evicted_bytes'", (freed,))
+		for sha1 in removed:
+			try:
+				os.remove(self.object_path(sha1))
+			except OSError:
+				pass
+		return len(removed), freed
+
+	# evict, and also remove files nothing refers to (left by interrupted runs)
+	def prune(self, max_bytes = None):
+		removed, freed = self.evict(max_bytes)
+		known = set(row[0] for row in self.conn.execute("SELECT DISTINCT sha1 FROM images"))
+		recent = time.time() - IMAGE_CACHE_GRACE
+		for path in glob.glob(self.path + "/objects/*/*") + glob.glob(self.path + "/objects/*/.tmp-*"):
+			if os.path.basename(path) in known or os.path.getmtime(path) >= recent:
+				continue
+			freed += os.path.getsize(path)
+			removed += 1
+			os.remove(path)
+		return removed, freed
+
+	def stats(self):
+		stats = dict(self.conn.execute("SELECT name, value FROM counters").fetchall())
+		stats["entries"] = self.conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+		stats["images"], stats["bytes"] = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM (SELECT MAX(size) AS size FROM images GROUP BY sha1)").fetchone()
+		return stats
+
+# bump when the detection or region code changes so older stage cache entries are not used
+STAGE_VERSION = "3"
+
+# intermediate results stored under a hash of everything that went into them,
+# so a re-run only redoes the stages whose inputs changed. entries are touched
+# when used and the least recently used ones go once the size limit is reached
+class StageCache(object):
+	def __init__(self, path, max_bytes):
+		self.path = path
+		self.max_bytes = max_bytes
+		if not os.path.exists(self.path):
+			try:
+				os.makedirs(self.path)
+			except OSError:
+				if not os.path.isdir(self.path):
+					raise
+
+	def key(self, stage, *inputs):
+		return stage + "-" + hashlib.sha1(json.dumps([STAGE_VERSION, stage] + list(inputs))).hexdigest()
+
+	def get(self, key):
+		path = self.path + "/" + key + ".npy"
+		try:
+			buf = np.load(path)
+		except (IOError, ValueError):
+			return None
+		os.utime(path, None)
+		return buf
+
+	def put(self, key, buf):
+		data = io.BytesIO()
+		np.save(data, buf)
+		write_atomic(self.path + "/" + key + ".npy", data.getvalue())
+
+	def evict(self):
+		entries = []
+		for path in glob.glob(self.path + "/*.npy"):
+			stat = os.stat(path)
+			entries.append((stat.st_mtime, stat.st_size, path))
+		total = sum(entry[1] for entry in entries)
+		for mtime, size, path in sorted(entries):
+			if total <= self.max_bytes:
+				break
+			os.remove(path)
+			total -= size
+
+# bump when crop_card changes so older pixel cache entries are not used
+PIXEL_VERSION = "2"
+
+# the cropped RGB pixels of each source image as an .npy file, so a warm run maps
+# them in instead of decoding the png or jpeg again. entries are named after the
+# content hash of the source and one that is older than its source file is not used
+class PixelCache(StageCache):
+	def key(self, sha1):
+		return "{:s}-{:s}".format(sha1, PIXEL_VERSION)
+
+	# mapped copy on write as the pipeline changes the pixels in place, so nothing
+	# is read until they are used
+	def get(self, key, source_path):
+		path = self.path + "/" + key + ".npy"
+		try:
+			if os.path.getmtime(path) < os.path.getmtime(source_path):
+				return None
+			buf = np.load(path, mmap_mode = "c")
+		except (IOError, OSError, ValueError):
+			return None
+		os.utime(path, None)
+		return buf
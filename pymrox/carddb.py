@@ -0,0 +1,439 @@
+# use unicode literals
+from __future__ import unicode_literals
+
+# the card data: an sqlite index over the mtgjson AllSets zip
+import os
+import re
+import urllib
+import zipfile
+import json
+import hashlib
+import sqlite3
+import difflib
+import unicodedata
+import numpy as np
+
+from pymrox import timing
+
+# bump when the index layout changes so old indexes get rebuilt
+CARD_INDEX_SCHEMA = "2"
+
+# card columns kept in the index, these are the only fields the tool reads
+CARD_INDEX_FIELDS = ["name", "number", "mciNumber", "layout", "border", "power", "toughness", "loyalty", "colorIdentity", "timeshifted", "names"]
+
+# stands in for a set from the mtgjson data, only carries what the index stores
+class IndexedSet(object):
+	def __init__(self, code, name, releaseDate, magicCardsInfoCode):
+		self.code = code
+		self.name = name
+		self.releaseDate = releaseDate
+		# only set when present so hasattr checks behave like they do on mtgjson data
+		if magicCardsInfoCode:
+			self.magicCardsInfoCode = magicCardsInfoCode
+
+# stands in for a card from the mtgjson data, attributes that are missing
+# from the json are missing here too (lots of code relies on hasattr)
+class IndexedCard(object):
+	def __init__(self, cardSet, row):
+		self.set = cardSet
+		for field, value in zip(CARD_INDEX_FIELDS, row):
+			if value is None:
+				continue
+			if field in ["colorIdentity", "names"]:
+				value = json.loads(value)
+			elif "timeshifted" == field:
+				value = bool(value)
+			setattr(self, field, value)
+
+# key used to look cards up by name
+def normalize_card_name(name):
+	if isinstance(name, bytes):
+		name = name.decode("utf-8")
+	return name.strip().lower()
+
+# letters that do not come apart into a plain letter and an accent (ae, oe, o
+# with a stroke, sharp s, d and l with a stroke, thorn)
+FOLDED_LETTERS = {"\u00e6": "ae", "\u0153": "oe", "\u00f8": "o", "\u00df": "ss", "\u0111": "d", "\u0142": "l", "\u00fe": "th"}
+
+# key used to look cards up by a name that is written differently: no case, accents
+# or punctuation, and the halves of a split card ("Fire // Ice", "Fire/Ice") are
+# just words
+def fuzzy_card_name(name):
+	if isinstance(name, bytes):
+		name = name.decode("utf-8")
+	name = unicodedata.normalize("NFKD", name.lower())
+	name = "".join(FOLDED_LETTERS.get(c, c) for c in name if not unicodedata.combining(c))
+	name = re.sub("['`\u2018\u2019]", "", name)
+	return " ".join(re.sub(r"[^0-9a-z]+", " ", name).split())
+
+# the trigrams of a fuzzy key, with the ends of the name marked
+def name_grams(key):
+	padded = " " + key + " "
+	return set(padded[ix:ix + 3] for ix in range(len(padded) - 2))
+
+# names closer than this (from 0 to 1) are not offered at all
+NAME_MATCH_MIN_SCORE = 0.6
+
+# names that share at least this much of their trigrams (dice) with the one
+# looked up are compared with it letter by letter
+NAME_MATCH_MIN_GRAMS = 0.4
+
+# how many of those are compared letter by letter, the ones sharing the most
+NAME_MATCH_CANDIDATES = 8
+
+# trigram index over every card name, for the names that are not in the card index
+# as written. the trigrams every name shares with the one looked up are counted at
+# once from the postings of its trigrams, then the few that share the most are
+# scored by how many letters they have in common with it
+class NameIndex(object):
+	def __init__(self, names):
+		self.names = []
+		self.keys = []
+		self.exact = {}
+		postings = {}
+		sizes = []
+		for name, key in names:
+			if not key or key in self.exact:
+				continue
+			self.exact[key] = len(self.names)
+			grams = name_grams(key)
+			for gram in grams:
+				postings.setdefault(gram, []).append(len(self.names))
+			self.names.append(name)
+			self.keys.append(key)
+			sizes.append(len(grams))
+		self.postings = dict((gram, np.array(ixs, dtype = np.int32)) for gram, ixs in postings.iteritems())
+		self.sizes = np.array(sizes, dtype = np.float32)
+
+	# (name, score) of the closest name, or None when none is at least NAME_MATCH_MIN_SCORE
+	def closest(self, card_name):
+		key = fuzzy_card_name(card_name)
+		if not key:
+			return None
+		if key in self.exact:
+			return self.names[self.exact[key]], 1.0
+
+		grams = name_grams(key)
+		found = [self.postings[gram] for gram in grams if gram in self.postings]
+		if not found:
+			return None
+		shared = np.bincount(np.concatenate(found), minlength = len(self.names))
+		dice = 2.0 * shared / (len(grams) + self.sizes)
+		candidates = np.flatnonzero(dice >= NAME_MATCH_MIN_GRAMS)
+		if len(candidates) > NAME_MATCH_CANDIDATES:
+			candidates = candidates[np.argpartition(-dice[candidates], NAME_MATCH_CANDIDATES)[:NAME_MATCH_CANDIDATES]]
+
+		best = None
+		matcher = difflib.SequenceMatcher(None, b = key, autojunk = False)
+		for ix in sorted(candidates, key = lambda ix: -dice[ix]):
+			matcher.set_seq1(self.keys[ix])
+			score = matcher.ratio()
+			if not best or score > best[1]:
+				best = (self.names[ix], score)
+		if best and best[1] >= NAME_MATCH_MIN_SCORE:
+			return best
+		return None
+
+def file_sha1(path):
+	digest = hashlib.sha1()
+	with open(path, "rb") as f:
+		for chunk in iter(lambda: f.read(1 << 20), b""):
+			digest.update(chunk)
+	return digest.hexdigest()
+
+# compact sqlite index over the card json, built once per version of the zip
+# so that a run only reads the handful of rows it actually needs
+class CardIndex(object):
+	def __init__(self, zip_path, index_path):
+		self.zip_path = zip_path
+		self.index_path = index_path
+		self._conn = None
+		self._sets = {}
+		self._names = None
+
+	@property
+	def conn(self):
+		# open (and if needed rebuild) on first use only
+		if not self._conn:
+			if not self.is_current():
+				with timing.stage("card_index_build", "setup"):
+					self.build()
+			# the server resolves cards from its request threads, one at a time
+			self._conn = sqlite3.connect(self.index_path, check_same_thread = False)
+		return self._conn
+
+	def read_meta(self):
+		if not os.path.isfile(self.index_path):
+			return {}
+		conn = sqlite3.connect(self.index_path)
+		try:
+			return dict(conn.execute("SELECT key, value FROM meta").fetchall())
+		except sqlite3.DatabaseError:
+			return {}
+		finally:
+			conn.close()
+
+	def is_current(self):
+		meta = self.read_meta()
+		if meta.get("schema") != CARD_INDEX_SCHEMA:
+			return False
+
+		# size and mtime unchanged means the zip is the same, skip hashing it
+		stat = os.stat(self.zip_path)
+		if meta.get("zip_size") == str(stat.st_size) and meta.get("zip_mtime") == repr(stat.st_mtime):
+			return True
+
+		# the zip was touched, only rebuild if the content really changed
+		if meta.get("zip_sha1") != file_sha1(self.zip_path):
+			return False
+		conn = sqlite3.connect(self.index_path)
+		with conn:
+			conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", [("zip_size", str(stat.st_size)), ("zip_mtime", repr(stat.st_mtime))])
+		conn.close()
+		return True
+
+	def build(self):
+		print "Building card index {:s} from {:s}".format(self.index_path, self.zip_path)
+		stat = os.stat(self.zip_path)
+		digest = file_sha1(self.zip_path)
+
+		# read the json straight out of the zip instead of extracting it
+		zip_ref = zipfile.ZipFile(self.zip_path, "r")
+		try:
+			all_sets = json.load(zip_ref.open(zip_ref.namelist()[0]))
+		finally:
+			zip_ref.close()
+
+		# build next to the real index and move it in place when done
+		tmp_path = self.index_path + ".tmp"
+		if os.path.exists(tmp_path):
+			os.remove(tmp_path)
+		conn = sqlite3.connect(tmp_path)
+		conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+		conn.execute("CREATE TABLE sets (code TEXT PRIMARY KEY, name TEXT, releaseDate TEXT, magicCardsInfoCode TEXT)")
+		conn.execute("CREATE TABLE cards (set_code TEXT, ordinal INTEGER, ascii_name TEXT, " + ", ".join(CARD_INDEX_FIELDS) + ")")
+		for code, cardSet in all_sets.iteritems():
+			conn.execute("INSERT INTO sets VALUES (?, ?, ?, ?)", (code, cardSet.get("name"), cardSet.get("releaseDate"), cardSet.get("magicCardsInfoCode")))
+			rows = []
+			for ordinal, card in enumerate(cardSet.get("cards", [])):
+				row = [code, ordinal, card.get("imageName")]
+				for field in CARD_INDEX_FIELDS:
+					value = card.get(field)
+					if field in ["colorIdentity", "names"] and value is not None:
+						value = json.dumps(value)
+					row.append(value)
+				rows.append(row)
+			conn.executemany("INSERT INTO cards VALUES (" + ", ".join(["?"] * (len(CARD_INDEX_FIELDS) + 3)) + ")", rows)
+		conn.execute("CREATE INDEX cards_by_name ON cards (set_code, name)")
+		conn.execute("CREATE INDEX cards_by_ascii_name ON cards (set_code, ascii_name)")
+		conn.executemany("INSERT INTO meta VALUES (?, ?)", [("schema", CARD_INDEX_SCHEMA), ("zip_sha1", digest), ("zip_size", str(stat.st_size)), ("zip_mtime", repr(stat.st_mtime))])
+		conn.commit()
+		conn.close()
+		os.rename(tmp_path, self.index_path)
+
+	# the connection must not be carried into forked processes, they open their own
+	def close(self):
+		if self._conn:
+			self._conn.close()
+			self._conn = None
+
+	# set codes oldest first, the same order mtgjson hands them out in
+	def set_codes(self):
+		return [row[0] for row in self.conn.execute("SELECT code FROM sets ORDER BY releaseDate, code")]
+
+	def get_set(self, code):
+		if code not in self._sets:
+			row = self.conn.execute("SELECT code, name, releaseDate, magicCardsInfoCode FROM sets WHERE code = ?", (code,)).fetchone()
+			self._sets[code] = IndexedSet(*row) if row else None
+		return self._sets[code]
+
+	# the ban lists are baked into the printings table, when they change
+	# only that table is rebuilt (the card data itself is left alone)
+	def use_rules(self, banned_sets, banned_cards):
+		self.banned_sets = banned_sets
+		self.banned_cards = banned_cards
+		self._names = None
+		self.rules = hashlib.sha1(json.dumps([sorted(banned_sets), sorted((code, sorted(names)) for code, names in banned_cards.items())])).hexdigest()
+		self._printings_ready = False
+
+	def build_printings(self):
+		conn = self.conn
+		rank = dict((code, i) for i, code in enumerate(self.set_codes()))
+
+		# one printing per set for every lookup key. an exact name beats an ascii
+		# name and when a name repeats in a set the last printing wins, which is
+		# what the per set name maps used to do
+		best = {}
+		for row in conn.execute("SELECT set_code, ordinal, ascii_name, " + ", ".join(CARD_INDEX_FIELDS) + " FROM cards"):
+			code, ordinal, ascii_name, fields = row[0], row[1], row[2], row[3:]
+			name, number, mciNumber = fields[0], fields[1], fields[2]
+
+			# cards without a numerical identifier can not be fetched
+			if not number and not mciNumber:
+				continue
+
+			# some cards have bad matches in a set so we don't want to keep them
+			if name in self.banned_cards.get(code.lower(), []):
+				continue
+
+			keys = [(normalize_card_name(name), 1)]
+			if ascii_name:
+				keys.append((normalize_card_name(ascii_name), 0))
+			for key, priority in keys:
+				current = best.get((key, code))
+				if not current or (priority, ordinal) > current[0]:
+					best[(key, code)] = ((priority, ordinal), fields)
+
+		rows = []
+		for (key, code), (_, fields) in best.iteritems():
+			rows.append([key, rank[code], code, code.lower() in self.banned_sets] + list(fields))
+
+		with conn:
+			conn.execute("DROP TABLE IF EXISTS printings")
+			conn.execute("CREATE TABLE printings (name_key TEXT, rank INTEGER, set_code TEXT, banned_set INTEGER, " + ", ".join(CARD_INDEX_FIELDS) + ")")
+			conn.executemany("INSERT INTO printings VALUES (" + ", ".join(["?"] * (len(CARD_INDEX_FIELDS) + 4)) + ")", rows)
+			conn.execute("CREATE INDEX printings_by_name ON printings (name_key, rank)")
+			conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('rules', ?)", (self.rules,))
+
+	def ensure_printings(self):
+		if not self._printings_ready:
+			row = self.conn.execute("SELECT value FROM meta WHERE key = 'rules'").fetchone()
+			if not row or row[0] != self.rules:
+				self.build_printings()
+			self._printings_ready = True
+
+	# every usable printing of a card, oldest set first. blessed sets and a
+	# forced set are applied here so neither of them needs a rebuild
+	def find_printings(self, card_name, force_set = None, blessed = ()):
+		self.ensure_printings()
+		printings = []
+		for row in self.conn.execute("SELECT set_code, banned_set, " + ", ".join(CARD_INDEX_FIELDS) + " FROM printings WHERE name_key = ? ORDER BY rank", (normalize_card_name(card_name),)):
+			code, banned_set = row[0], row[1]
+			if force_set and code.upper() != force_set.upper():
+				continue
+			if banned_set and code.lower() not in blessed:
+				continue
+			printings.append(IndexedCard(self.get_set(code), row[2:]))
+		return printings
+
+	# every card in the index, or in the set with that code, as mtgjson lists them
+	def cards(self, set_code = None):
+		query = "SELECT set_code, " + ", ".join(CARD_INDEX_FIELDS) + " FROM cards"
+		args = ()
+		if set_code:
+			query += " WHERE set_code = ? COLLATE NOCASE"
+			args = (set_code,)
+		for row in self.conn.execute(query + " ORDER BY set_code, ordinal", args).fetchall():
+			yield IndexedCard(self.get_set(row[0]), row[1:])
+
+	# the card name closest to one that has no printings as written, as (name, score)
+	# with a score from 0 to 1, or None. the name index is built on first use
+	def closest_name(self, card_name):
+		if not self._names:
+			self.ensure_printings()
+			with timing.stage("name_index_build", "setup"):
+				names = []
+				for key, name, card_names in self.conn.execute("SELECT DISTINCT name_key, name, names FROM printings ORDER BY name"):
+					names.append((name, fuzzy_card_name(name)))
+					names.append((name, fuzzy_card_name(key)))
+					# "Fire // Ice" is the printing of its first half
+					if card_names:
+						card_names = json.loads(card_names)
+						names.append((card_names[0], fuzzy_card_name(" ".join(card_names))))
+				self._names = NameIndex(names)
+		with timing.stage("name_match"):
+			return self._names.closest(card_name)
+
+# where the card data comes from when it is not there yet
+MTG_JSON_URL = "https://mtgjson.com/json/AllSets.json.zip"
+
+# sets we are just not going to pull from because...
+# - the artwork is not great because of print quality
+# - or there are too many errors in the mtgjson for that set
+# - or we want modern wording on the card to prevent issues
+# - or we just don't like the set
+BANNED_SETS = set([
+	"mps_akh", 
+	"lea", 
+	"leb", 
+	"pjgp", 
+	"pgpx", 
+	"ppre", 
+	"plpa", 
+	"pmgd", 
+	"pfnm", 
+	"parl", 
+	"pmei", 
+	"pmpr", 
+	"pcmp",
+	"pwpn",
+	"prel",
+	"pwp09",
+	"ddr",
+	"dd3_gvl", 
+	"v14", 
+	"s99", 
+	"cma", 
+	"tsb", 
+	"ced", 
+	"c16", 
+	"jvc", 
+	"dd3_jvc", 
+	"exp",
+	"v10", 
+	"v12",
+	"v13",
+	"mps",
+	"leg",
+	"cei",
+	"4ed", # none of these seem to have the right image at all
+	"3ed",
+	"2ed",
+	"me2",
+	"me4",
+	"por",
+	"po2",
+	"ath",
+	"drk",
+	"arc",
+	"v09",
+	"brb"
+
+])
+
+# not really banned but the mtgjson data is wrong
+# you could also use this to ban specific wordings
+# or artwork you hate
+BANNED_CARDS = {
+	"wth": ["Aura of Silence", "Gaea's Blessing"],
+	"4ed": ["Armageddon", "Balance", "Island Sanctuary"],
+	"5ed": ["Armageddon", "Island Sanctuary", "Wrath of God"],
+	"por": ["Armageddon", "Wrath of God"],
+	"ice": ["Swords to Plowshares"],
+	"6ed": ["Armageddon"],
+	"med": ["Armageddon"],
+	"me3": ["Karakas", "Mana Drain"],
+	"me4": ["Armageddon"],
+	"vis": ["Man-o'-War"],
+	"ptk": ["Rolling Earthquake"],
+	"sth": ["Volrath's Stronghold", "Mox Diamond"],
+	"fut": ["Venser, Shaper Savant"],
+	"lrw": ["Shriekmaw"],
+	"cmd": ["Shriekmaw"],
+	"usg": ["Sneak Attack"],
+	"con": ["Path to Exile"]
+}
+
+# the card index in json_dir, downloading the card data first if it is not there.
+# nothing is read until the index is first used
+def open_card_index(json_dir):
+	if not os.path.exists(json_dir):
+		os.makedirs(json_dir)
+	zip_path = json_dir + "/AllSets.json.zip"
+	if not os.path.isfile(zip_path):
+		urllib.urlretrieve(MTG_JSON_URL, zip_path)
+	db = CardIndex(zip_path, json_dir + "/AllSets.sqlite")
+
+	# bans are applied when the printings index is built
+	db.use_rules(BANNED_SETS, BANNED_CARDS)
+	return db
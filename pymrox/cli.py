@@ -0,0 +1,267 @@
+# use unicode literals
+from __future__ import unicode_literals
+
+# the command line
+import sys
+import os
+import io
+import glob
+import shutil
+import math
+import argparse
+import multiprocessing
+
+from pymrox.cache import DEFAULT_IMAGE_CACHE_DIR, ImageCache
+from pymrox.carddb import BANNED_SETS
+from pymrox.config import Config
+from pymrox.bench import benchmark, format_results, compare_stages
+from pymrox.pipeline import parse_decklist, read_decklist, process_cards
+from pymrox.server import serve
+from pymrox.batch import find_decks, process_batch
+from pymrox.sheets import sheet_layout, process_sheets
+from pymrox.ingest import import_sources, missing_printings
+from pymrox.regions import CALIBRATION_SAMPLES, calibrate
+
+# values for a --sweep-* option, either a comma separated list ("8,10,12")
+# or an inclusive range with a step ("8:16:2"), or a mix of both
+def sweep_values(cast):
+	def parse(spec):
+		values = []
+		try:
+			for part in spec.split(","):
+				if ":" in part:
+					bounds = part.split(":")
+					start, stop = float(bounds[0]), float(bounds[1])
+					step = float(bounds[2]) if len(bounds) > 2 else 1.0
+					if step <= 0 or len(bounds) > 3:
+						raise ValueError(part)
+					count = int(math.floor((stop - start) / step + 1e-9)) + 1
+					values.extend(cast(round(start + ix * step, 6)) for ix in range(count))
+				else:
+					values.append(cast(part))
+		except ValueError:
+			raise argparse.ArgumentTypeError("'{:s}' is not a list (8,10,12) or range (8:16:2) of values".format(spec))
+		return values
+	return parse
+
+# where the shared image cache is and how big it can get, for the main command and `cache`
+def add_image_cache_arguments(parser):
+	parser.add_argument('--cache-dir', dest='cache_dir', default=os.environ.get("PYMROX_CACHE") or DEFAULT_IMAGE_CACHE_DIR, help='The downloaded image cache, shared by every output directory and safe to use from several runs at once. Defaults to $PYMROX_CACHE or ~/.cache/pymrox.')
+	parser.add_argument('--cache-size', dest='cache_size', type=int, default=2048, help='The size limit of the image cache in MB. The least recently used images are removed past that at the end of each run.')
+
+# `PyMrox.py cache stats|prune` looks after the image cache without processing anything
+def cache_command(argv):
+	cache_parser = argparse.ArgumentParser(prog='PyMrox.py cache', description='Show the hit rate and size of the shared image cache or trim it.')
+	cache_parser.add_argument('action', choices=['stats', 'prune'], help='stats shows the cache, prune removes the least recently used images until the cache fits in --cache-size along with any files left behind by interrupted runs.')
+	add_image_cache_arguments(cache_parser)
+	cache_args = cache_parser.parse_args(argv)
+	image_cache = ImageCache(cache_args.cache_dir, cache_args.cache_size * 1024 * 1024)
+	if "prune" == cache_args.action:
+		removed, freed = image_cache.prune()
+		print "Removed {:d} images ({:.1f} MB)".format(removed, freed / 1048576.0)
+	stats = image_cache.stats()
+	lookups = stats["hits"] + stats["misses"]
+	print "Cache {:s}".format(cache_args.cache_dir)
+	print "  {:d} images for {:d} sources, {:.1f} of {:d} MB".format(stats["images"], stats["entries"], stats["bytes"] / 1048576.0, cache_args.cache_size)
+	print "  {:d} hits, {:d} misses ({:.0f}% hit rate)".format(stats["hits"], stats["misses"], 100.0 * stats["hits"] / lookups if lookups else 0)
+	print "  {:d} downloads ({:.1f} MB), {:d} evictions ({:.1f} MB)".format(stats["downloads"], stats["downloaded_bytes"] / 1048576.0, stats["evictions"], stats["evicted_bytes"] / 1048576.0)
+	return 0
+
+# `PyMrox.py bench` times the conditioning steps on synthetic cards, offline
+def bench_command(argv):
+	bench_parser = argparse.ArgumentParser(prog='PyMrox.py bench', description='Time every conditioning step for a synthetic card of each frame handler and then a whole deck, without using the network.')
+	bench_parser.add_argument('--cards', dest='cards', type=int, default=100, help='The number of cards in the deck that is run through the whole pipeline. Use 0 to only time the handlers.')
+	bench_parser.add_argument('--repeat', dest='repeat', type=int, default=3, help='How many times each handler is timed, the fastest run is kept.')
+	bench_parser.add_argument('--jobs', '-j', dest='jobs', type=int, default=1, help='The number of processes used to condition the deck. Use 0 for one per CPU.')
+	bench_parser.add_argument('--output', '-o', dest='output', default=None, help='Write the results to this file as JSON.')
+	bench_parser.add_argument('--baseline', '-b', dest='baseline', default=None, help='Results of an earlier run to compare with. Anything that got slower by more than --threshold fails the run.')
+	bench_parser.add_argument('--threshold', dest='threshold', type=float, default=0.15, help='How much slower than the baseline the time of a handler or of the deck can get, as a fraction (0.15 is 15%%). Differences under 2 ms are never counted.')
+	bench_parser.add_argument('--workdir', dest='workdir', default=None, help='Keep the fixtures in this directory so later runs reuse them. Defaults to a temporary directory.')
+	bench_args = bench_parser.parse_args(argv)
+
+	results, baseline, regressions = benchmark(bench_args.workdir, bench_args.cards, max(1, bench_args.repeat), bench_args.jobs, bench_args.output, bench_args.baseline, bench_args.threshold)
+	for line in format_results(results):
+		print line
+	for metric, old, new in regressions:
+		print "[ERROR] {:s} regressed from {:.1f} ms to {:.1f} ms ({:+.0f}%)".format(metric, old * 1000, new * 1000, 100.0 * (new - old) / old if old else 100.0)
+		# where a handler lost its time
+		if metric.startswith("handlers."):
+			print "  " + ", ".join("{:s} {:.1f} -> {:.1f}".format(stage, before * 1000, after * 1000) for stage, before, after in compare_stages(results, baseline, metric.split(".")[1]))
+	return 1 if regressions else 0
+
+# `PyMrox.py import <sources> <output directory>` puts card images from local archives
+# or directories into the image cache and reports which printings are still missing
+def import_command(argv):
+	import_parser = argparse.ArgumentParser(prog='PyMrox.py import', description='Fill the image cache from card images on disk instead of downloading them.')
+	import_parser.add_argument('sources', metavar='S', nargs='+', help='Zip or tar archives, or directories, of card images. Each image is matched to a printing by its set code and number, from a name like m15-62-jace_the_living_guildpact.png or m15-62.png, or from a path like m15/62.png.')
+	import_parser.add_argument('outputdir', metavar='O', help='The output directory whose card data (in .json) is used to match the images.')
+	import_parser.add_argument('--deck', dest='decks', action='append', default=[], help='Afterwards report the printings of the cards in this deck list that are still not cached. Can be given more than once.')
+	import_parser.add_argument('--sets', dest='sets', nargs='+', default=[], help='Afterwards report the printings in these sets (by set code) that are still not cached.')
+	import_parser.add_argument('--workers', dest='workers', type=int, default=0, help='The number of threads that verify and store the images. Defaults to one per CPU.')
+	import_parser.add_argument('--image-url', dest='image_urls', action='append', default=None, help='The image sources the runs use, to tell whether a printing is cached already. Defaults to Scryfall and then magiccards.info.')
+	add_image_cache_arguments(import_parser)
+	import_args = import_parser.parse_args(argv)
+	config = Config.from_args(import_args)
+	config.prepare()
+
+	try:
+		report = import_sources(import_args.sources, config, import_args.workers or multiprocessing.cpu_count())
+	except IOError as e:
+		import_parser.error(str(e))
+	for error in report.errors:
+		print error
+	print "Imported {imported:d} images ({cached:d} already cached, {unmatched:d} not matched, {bad:d} bad)".format(**report.counts)
+
+	card_names = []
+	for deck in import_args.decks:
+		with io.open(deck, "r", encoding = "utf-8") as f:
+			card_names.extend(read_decklist(f))
+	if card_names or import_args.sets:
+		for message in missing_printings(config, card_names, import_args.sets):
+			print message
+	return 0
+
+# `PyMrox.py calibrate <output directory>` finds where the text of each set really is
+# from its cached images
+def calibrate_command(argv):
+	calibrate_parser = argparse.ArgumentParser(prog='PyMrox.py calibrate', description='Find the tight boxes the credit and copyright lines of each set are in, from a sample of its cached images, so later runs only look for text and inpaint there.')
+	calibrate_parser.add_argument('outputdir', metavar='O', help='The output directory whose card data (in .json) is used.')
+	calibrate_parser.add_argument('--sets', dest='sets', nargs='+', default=[], help='The sets to calibrate, by set code. Defaults to every set with cached images.')
+	calibrate_parser.add_argument('--samples', dest='samples', type=int, default=CALIBRATION_SAMPLES, help='How many cached images of each set and frame handler to look at.')
+	calibrate_parser.add_argument('--image-url', dest='image_urls', action='append', default=None, help='The image sources whose cached images are used. Defaults to Scryfall and then magiccards.info.')
+	add_image_cache_arguments(calibrate_parser)
+	calibrate_args = calibrate_parser.parse_args(argv)
+	config = Config.from_args(calibrate_args)
+	config.prepare()
+
+	failed = False
+	for message in calibrate(config, calibrate_args.sets, max(1, calibrate_args.samples)):
+		failed = failed or message.startswith("[ERROR]")
+		print message
+	return 1 if failed else 0
+
+# the options of a normal run, of `serve` which takes no deck list and of `batch`
+# which takes many
+def build_parser(command = None):
+	parser = argparse.ArgumentParser(description='Condition and remove information from border of MTG cards in the quest of making perfect proxies.')
+	parser.add_argument('--debug', '-d', dest='debug', action='store_true', default=False, help='Adds debug regions (contours, fill, bounding mask) to the image so that you can see and debug the results of the detection phase.')
+	parser.add_argument('--mask', '-m', dest='mask', action='store_true', default=False, help='Outputs the mask used to generate the contours instead of the card image itself. This is amore esoteric but informative version of --debug.')
+	parser.add_argument('--infill', dest='infill', action='store_true', default=False, help='Write the image after each region is fixed to the .infill directory in the output directory. Only useful for debugging the detection.')
+	parser.add_argument('--verify', dest='verify', action='store_true', default=False, help='Also render each card through the slower reference path (full card detection and inpainting for every region, one PIL image per tone step) and report how far the output differs. Cards that differ by more than --tolerance are reported as errors.')
+	parser.add_argument('--tolerance', dest='tolerance', type=int, default=2, help='The largest per channel pixel difference --verify accepts away from the seam between the card and the border.')
+	parser.add_argument('--no-stage-cache', dest='stage_cache', action='store_false', default=True, help='Do not reuse (or keep) intermediate results from earlier runs. Normally the autocontrasted card with its text removed is kept in the .stages directory so re-runs that only change --lighten or --border skip detection and inpainting.')
+	parser.add_argument('--no-region-profiles', dest='region_profiles', action='store_false', default=True, help='Look for text in the wide boxes of each frame handler even for sets that were calibrated with the calibrate command.')
+	parser.add_argument('--stage-cache-size', dest='stage_cache_size', type=int, default=1024, help='The size limit of the .stages directory in MB. The least recently used entries are removed past that.')
+	parser.add_argument('--clear', '-c', dest='clear', action='store_true', default=False, help='Forget the cached images of the cards in this run so they are downloaded again.')
+	parser.add_argument('--overwrite', '-w', dest='overwrite', action='store_true', default=False, help='Overwrite cards that have already been processed. (It takes longer to write every card.)')
+	parser.add_argument('--remove', '--rm', '-r', dest='remove', action='store_true', default=False, help='Delete all of the processed cards before processing more. (Basically like --overwrite except all at once and before it starts.)')
+	parser.add_argument('--bless', '-b', dest='bless', nargs='+', default=[], help='Tempoarily bless a given set during a run. Best used to pull a single card that is wrong after the rest of the cards have been pulled. (Hint: do not use with --overwrite.) ')
+	parser.add_argument('--set', '-S', dest='force_set', default=None, help='Force the card to come from a certain set. The value should be the set code like 5ED, VIS, WTH, M15, or similar.')
+	parser.add_argument('--fuzzy-accept', dest='fuzzy_accept', type=float, default=1.0, help='Use the closest card name for a line that does not name a card exactly when it scores at least this, from 0 to 1 (0.85 takes most typos). The default of 1.0 only takes names that differ in case, accents or punctuation, like "Fire/Ice" for "Fire // Ice". Lines that are not taken are reported along with the closest name.')
+	parser.add_argument('--single','-s', dest='single', action='store_true', default=False, help='Instead of accepting a deck list the tool accepts the name of a single card as the input. Implies --overwrite.')
+	parser.add_argument('--border', '-B', dest='border', type=int, default=36, help='The amount to expand the image for the border, in pixels of a Scryfall size card.')
+	parser.add_argument('--autocontrast', '-a', dest='autocontrast', type=int, default=-1, help='The autocontrast cutoff percentage threshold. Makes any colors under this percentage of the histogram black. See OpenCV\' documentation on autocontrast for more information.')
+	parser.add_argument('--lighten', '-l', dest='lighten', type=float, default=-1, help='The lightening transform to use for the card. A value of 1.0 means no change. Less than 1.0 means darker. More than 1.0 means lighter.')
+	parser.add_argument('--sweep', dest='sweep', action='store_true', default=False, help='Render every combination of the --sweep-autocontrast, --sweep-lighten and --sweep-border values for each card into the sweep directory in the output directory, along with a labelled contact sheet. Each card is decoded once and its text is removed once per autocontrast cutoff. Implied by any of the --sweep-* options.')
+	parser.add_argument('--sweep-autocontrast', dest='sweep_autocontrast', type=sweep_values(int), default=None, help='Autocontrast cutoffs to sweep, like 8,10,12 or 8:16:2. Defaults to the cutoff the card would normally get.')
+	parser.add_argument('--sweep-lighten', dest='sweep_lighten', type=sweep_values(float), default=None, help='Lightening factors to sweep, like 1.0,1.04,1.08 or 1.0:1.1:0.02. Defaults to the factor the card would normally get.')
+	parser.add_argument('--sweep-border', dest='sweep_border', type=sweep_values(int), default=None, help='Border sizes to sweep, like 24,36 or 24:48:12. Defaults to --border.')
+	add_image_cache_arguments(parser)
+	parser.add_argument('--pixel-cache', dest='pixel_cache', action='store_true', default=False, help='Also keep the cropped pixels of each cached image, uncompressed (about 2 MB a card) in the pixels directory of the image cache, so later runs map them in instead of decoding the image again.')
+	parser.add_argument('--pixel-cache-size', dest='pixel_cache_size', type=int, default=4096, help='The size limit of the pixel cache in MB. The least recently used entries are removed past that.')
+	parser.add_argument('--connections', dest='connections', type=int, default=4, help='The maximum number of simultaneous downloads from any one image host.')
+	parser.add_argument('--retries', dest='retries', type=int, default=3, help='How many times a failed download (timeout, dropped connection, 5xx, 429) is retried, with exponential backoff, before moving on to the next image source.')
+	parser.add_argument('--image-url', dest='image_urls', action='append', default=None, help='Image source URL pattern with {:s} for the set code and then the card number. Can be given more than once; sources are tried in order. Defaults to Scryfall and then magiccards.info.')
+	parser.add_argument('--jobs', '-j', dest='jobs', type=int, default=1, help='The number of processes used to condition cards. Use 0 for one per CPU.')
+	parser.add_argument('--fetch-workers', dest='fetch_workers', type=int, default=0, help='The number of threads that look up and download card images. Defaults to --connections for each image host.')
+	parser.add_argument('--decode-workers', dest='decode_workers', type=int, default=2, help='The number of threads that decode cached card images.')
+	parser.add_argument('--write-workers', dest='write_workers', type=int, default=2, help='The number of threads that encode and write the finished cards.')
+	parser.add_argument('--in-flight', dest='in_flight', type=int, default=0, help='The most decoded card images held in memory at once. Decoding waits when this many cards are between being decoded and being written. Defaults to two per --jobs plus one per decode and write thread.')
+	parser.add_argument('--metrics', dest='metrics', default=None, help='Write a JSON summary of the run to this file: wall and CPU time for every stage and every card, the frame handler each card got, cache hits and misses, and download bytes, latency, fallbacks and failures.')
+	parser.add_argument('--trace', dest='trace', default=None, help='Write every stage of every card to this file as a Chrome trace, for chrome://tracing or ui.perfetto.dev.')
+	parser.add_argument('--prometheus', dest='prometheus', default=None, help='Write the totals of the run to this file as Prometheus metrics, for the node exporter textfile collector.')
+	if "serve" == command:
+		parser.prog = 'PyMrox.py serve'
+		parser.add_argument('--host', dest='host', default='127.0.0.1', help='The address the server listens on.')
+		parser.add_argument('--port', '-p', dest='port', type=int, default=8377, help='The port the server listens on.')
+		parser.add_argument('--socket', dest='socket', default=None, help='Listen on this Unix socket instead of a TCP port.')
+	elif "batch" == command:
+		parser.prog = 'PyMrox.py batch'
+		parser.add_argument('decks', metavar='D', nargs='+', help='Deck lists, or directories of *.txt deck lists. Each deck goes to a directory named after it in the output directory, or to the one given as deck.txt=directory.')
+	else:
+		parser.add_argument('--sheets', dest='sheets', default=None, help='Tile the cards 3 x 3 onto print sheets as they are finished, as the pages of this PDF file or as PNGs in this directory. Every copy of a card in the deck list is placed. The cards are not also written as separate PNGs unless --card-files is given.')
+		parser.add_argument('--sheet-size', dest='sheet_size', default='letter', help='The paper size of the sheets: letter, a4 or legal.')
+		parser.add_argument('--sheet-dpi', dest='sheet_dpi', type=int, default=300, help='The resolution of the sheets. The finished cards are 300 DPI.')
+		parser.add_argument('--cut-margin', dest='cut_margin', type=int, default=0, help='How much of the border around each card is kept on the sheets, in pixels of the finished 300 DPI card (up to 30), so that a cut a little outside the card does not leave white.')
+		parser.add_argument('--card-files', dest='card_files', action='store_true', default=False, help='With --sheets, also write each card as a PNG in the output directory.')
+		parser.add_argument('decklist', metavar='D', help='The input deck list. See README.md for format information.')
+	parser.add_argument('outputdir', metavar='O', default='/tmp', help='The location that the downloaded card images will be written to.')
+	return parser
+
+def main(argv = None):
+	if argv is None:
+		argv = sys.argv[1:]
+	if argv and "cache" == argv[0]:
+		return cache_command(argv[1:])
+	if argv and "bench" == argv[0]:
+		return bench_command(argv[1:])
+	if argv and "import" == argv[0]:
+		return import_command(argv[1:])
+	if argv and "calibrate" == argv[0]:
+		return calibrate_command(argv[1:])
+
+	# `PyMrox.py serve <output directory>` keeps everything loaded and takes jobs over http,
+	# `PyMrox.py batch <deck lists> <output directory>` does many decks at once
+	command = argv[0] if argv and argv[0] in ["serve", "batch"] else None
+	parser = build_parser(command)
+	args = parser.parse_args(argv[1:] if command else argv)
+	if "batch" == command and args.sweep:
+		parser.error("--sweep does not go with batch")
+	if getattr(args, "sheets", None) and args.sweep:
+		parser.error("--sweep does not go with --sheets")
+
+	# --single implies --overwrite
+	config = Config.from_args(args, overwrite = args.overwrite or getattr(args, "single", False))
+	if config.sheets:
+		try:
+			sheet_layout(config)
+		except ValueError as e:
+			parser.error(str(e))
+
+	# delete processed files before starting if asked
+	if args.remove:
+		for path in glob.glob(config.output_dir + "/*.png"):
+			os.remove(path)
+
+	# .infill only holds the regions of the last --infill run
+	if config.infill and os.path.exists(config.infill_dir):
+		shutil.rmtree(config.infill_dir)
+
+	# blessing mechanism (checked when looking cards up so the banned list itself stays as it is)
+	for blessed in args.bless:
+		if blessed.lower() in BANNED_SETS:
+			print "Removed blessed set {:s} from banned list".format(blessed)
+
+	if "serve" == command:
+		serve(config, args.host, args.port, args.socket)
+		return 0
+
+	if "batch" == command:
+		for message in process_batch(find_decks(args.decks, config.output_dir), config, args.clear):
+			print message
+		return 0
+
+	# card names to process, with how many of each for the sheets
+	entries = [(args.decklist.decode("utf-8") if isinstance(args.decklist, bytes) else args.decklist, 1)]
+	if not args.single:
+		# open file specified to use to find cards, the names are unicode like the card data
+		with io.open(args.decklist, "r", encoding = "utf-8") as file:
+			entries = parse_decklist(file)
+
+	if config.sheets:
+		messages = process_sheets(entries, config, args.clear)
+	else:
+		messages = process_cards([card_name for card_name, quantity in entries], config, args.clear)
+	for message in messages:
+		print message
+	return 0
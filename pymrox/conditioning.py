@@ -0,0 +1,605 @@
+# use unicode literals
+from __future__ import unicode_literals
+
+# conditioning: finding and removing the text along the bottom of the card,
+# the tone corrections and the border. opencv is imported by the functions
+# that need it so importing the package stays cheap
+import os
+import math
+import numpy as np
+from PIL import Image, ImageOps, ImageEnhance, ImageDraw
+
+from pymrox import timing
+from pymrox.cache import fs_path
+from pymrox.download import getCardFileName, getCardSetCode, getCardId
+
+# target resize
+RESIZE_TARGET = 816,1110
+
+# the region boxes, the detection kernels, the inpaint radius and the border are
+# in pixels of a Scryfall PNG (SOURCE_SIZE, REFERENCE_SIZE once crop_card took
+# CROP_MARGIN off each side) and are scaled for cards of any other size
+SOURCE_SIZE = 745, 1040
+CROP_MARGIN = 10
+REFERENCE_SIZE = 725, 1020
+
+# the finished card is not much bigger than REFERENCE_SIZE, so a source more than
+# this much bigger is reduced to it first (JPEGs are decoded reduced already)
+WORKING_SCALE_MAX = 1.1
+
+# bumped when a change to the conditioning changes how the cards come out, so
+# output directories have their cards made again (see pymrox/manifest.py)
+RENDER_VERSION = "3"
+
+# the size a JPEG source is decoded at (draft mode picks the smallest power of two
+# reduction that is still at least that), None for a source that is small enough
+def draft_size(size):
+	if size[1] <= SOURCE_SIZE[1] * WORKING_SCALE_MAX:
+		return None
+	return int(math.ceil(size[0] * SOURCE_SIZE[1] / float(size[1]))), SOURCE_SIZE[1]
+
+# the image, set to decode no bigger than it has to (only JPEGs can)
+def draft_image(img):
+	size = draft_size(img.size)
+	if size:
+		img.draft(img.mode, size)
+	return img
+
+# what crop_card does with a source of this size: the crop box, and the size the
+# card is then reduced to or None when it is used as it is
+def crop_layout(size):
+	width, height = size
+	margin_x = int(round(CROP_MARGIN * width / float(SOURCE_SIZE[0])))
+	margin_y = int(round(CROP_MARGIN * height / float(SOURCE_SIZE[1])))
+	box = (margin_x, margin_y, width - margin_x, height - margin_y)
+	reduced = None
+	if box[3] - box[1] > REFERENCE_SIZE[1] * WORKING_SCALE_MAX:
+		reduced = (int(round((box[2] - box[0]) * REFERENCE_SIZE[1] / float(box[3] - box[1]))), REFERENCE_SIZE[1])
+	return box, reduced
+
+# --border is in pixels of a REFERENCE_SIZE card, this is it for a card of the size
+def card_border(size, border):
+	return int(round(border * size[1] / float(REFERENCE_SIZE[1])))
+
+@timing.timed("mask")
+def mask_from_cv_image(card, cv_img):
+	import cv2
+	kern_x = 78
+	kern_y = 4
+	# rotate kernel if card is split layout
+	if hasattr(card, 'layout') and "split" == card.layout:
+		swap = kern_x
+		kern_x = kern_y
+		kern_y = swap
+
+	# need grayscale copy. the buffer is RGB but the detection was tuned when
+	# cards were loaded from disk as BGR and converted as if they were RGB,
+	# converting from "BGR" keeps exactly the same channel weights
+	gray = cv2.cvtColor(cv_img, cv2.COLOR_BGR2GRAY)
+
+	# the kernels and thresholds are tuned for REFERENCE_SIZE, a card of another
+	# size is detected on a copy resampled to it and the mask is at that size
+	if gray.shape != (REFERENCE_SIZE[1], REFERENCE_SIZE[0]):
+		gray = cv2.resize(gray, REFERENCE_SIZE, interpolation = cv2.INTER_AREA if gray.shape[0] > REFERENCE_SIZE[1] else cv2.INTER_LINEAR)
+
+	# kernels for operations
+	rectKernel = cv2.getStructuringElement(cv2.MORPH_RECT, (kern_x, kern_y))
+	sqKernel = cv2.getStructuringElement(cv2.MORPH_RECT, (5, 5))
+	horizontalKernel = cv2.getStructuringElement(cv2.MORPH_RECT, (9, 3))
+
+	# tophat
+	tophat = cv2.morphologyEx(gray, cv2.MORPH_TOPHAT, sqKernel)
+
+	# gradient operations
+	gradX = cv2.Sobel(gray, ddepth=cv2.CV_32F, dx=1, dy=0, ksize=-1)
+	gradX = np.absolute(gradX)
+	(minVal, maxVal) = (np.min(gradX), np.max(gradX))
+	gradX = (255 * ((gradX - minVal) / (maxVal - minVal)))
+	gradX = gradX.astype("uint8")
+
+	gradY = cv2.Sobel(gray, ddepth=cv2.CV_32F, dx=0, dy=1, ksize=-1)
+	gradY = np.absolute(gradY)
+	(minVal, maxVal) = (np.min(gradY), np.max(gradY))
+	gradY = (255 * ((gradX - minVal) / (maxVal - minVal)))
+	gradY = gradY.astype("uint8")
+
+	# combine grads
+	grads = gradX + gradY
+
+	# close and find thresholds
+	grads = cv2.morphologyEx(grads, cv2.MORPH_CLOSE, rectKernel)
+	thresh = cv2.threshold(grads, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)[1]
+
+	# dilate some
+	thresh = cv2.dilate(thresh, horizontalKernel, iterations = 7)
+
+	# close with kernel
+	thresh = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, sqKernel)
+
+	# return threshold (which can act as a mask)
+	return thresh
+
+# width of the band around the card edge that --verify does not hold to --tolerance
+VERIFY_SEAM = 4
+
+# detected areas smaller than this (in pixels) are not taken to be text
+CONTOUR_MIN_AREA = 450
+
+# the contours of what was detected in the region, in the coordinates of the card.
+# findContours does not look at the outermost pixels of what it is given so the
+# region gets a one pixel frame of zeros
+def region_contours(detected, y1, y2, x1, x2):
+	import cv2
+	region = np.zeros((y2 - y1 + 2, x2 - x1 + 2), np.uint8)
+	region[1:-1, 1:-1] = detected[y1:y2, x1:x2]
+	return cv2.findContours(region, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE, offset = (x1 - 1, y1 - 1))[1]
+
+# took a lot of hints from here:
+# https://www.pyimagesearch.com/2017/07/17/credit-card-ocr-with-opencv-and-python/
+# works on the card as an RGB numpy buffer and returns the (updated) buffer. the
+# region is in pixels of REFERENCE_SIZE like the detection mask, a calibrated
+# profile of the set (see pymrox/regions.py) narrows it down
+def fix_card_with_infill(masky1, masky2, maskx1, maskx2, card, img, config, fill_color = None, paint = True, flood = False, infillRange = 15, detected = None, profile = None):
+	import cv2
+	# fill color will be white unless unspecified
+	if not fill_color:
+		fill_color = (255, 255, 255)
+
+	# the split layout detects once for both of its regions and passes the result in
+	# (the reference path for --verify detects again for every region)
+	if detected is None or config.reference:
+		detected = mask_from_cv_image(card, img)
+	if profile:
+		masky1, masky2, maskx1, maskx2 = profile.region((masky1, masky2, maskx1, maskx2), detected)
+
+	# region bounds, clipped the same way slicing would clip them
+	height, width = detected.shape
+	y1, y2 = min(masky1, height), min(masky2, height)
+	x1, x2 = min(maskx1, width), min(maskx2, width)
+
+	# find contours only in the region
+	with timing.stage("contours"):
+		contours = region_contours(detected, y1, y2, x1, x2)
+
+	# a card of another size is changed at its own size: the region, the contours
+	# and the inpaint radius are scaled up (or down) from the detection mask
+	scale_x, scale_y = img.shape[1] / float(width), img.shape[0] / float(height)
+	scaled = img.shape[:2] != detected.shape
+	if scaled:
+		y1, y2, x1, x2 = int(round(y1 * scale_y)), int(round(y2 * scale_y)), int(round(x1 * scale_x)), int(round(x2 * scale_x))
+		masky1, masky2, maskx1, maskx2 = int(round(masky1 * scale_y)), int(round(masky2 * scale_y)), int(round(maskx1 * scale_x)), int(round(maskx2 * scale_x))
+		infillRange = max(1, int(round(infillRange * (scale_x + scale_y) / 2)))
+		height, width = img.shape[:2]
+
+	# everything that changes is within infillRange of the region, so only that
+	# window of the card is worked on (the reference path uses the whole card)
+	margin = infillRange + 2
+	wy1, wy2, wx1, wx2 = max(y1 - margin, 0), min(y2 + margin, height), max(x1 - margin, 0), min(x2 + margin, width)
+	if config.reference:
+		wy1, wy2, wx1, wx2 = 0, height, 0, width
+
+	# use contours to draw filled-in areas on map
+	with timing.stage("contours"):
+		mask = np.zeros((wy2 - wy1, wx2 - wx1), np.uint8)
+		kept_contours = []
+		for c in contours:
+			if cv2.contourArea(c) > CONTOUR_MIN_AREA:
+				if scaled:
+					c = np.round(c * (scale_x, scale_y)).astype(np.int32)
+				cv2.drawContours(mask, [c], 0, 255, -1, offset = (-wx1, -wy1))
+				kept_contours.append(c)
+		contours = kept_contours
+
+	# do inpaint if requested (in place, the window is a view of the card)
+	with timing.stage("inpaint"):
+		window = img[wy1:wy2, wx1:wx2]
+		if paint and not config.debug and not config.mask:
+			window[...] = cv2.inpaint(window, mask, infillRange, cv2.INPAINT_TELEA)
+		else:
+			window[np.where(mask)] = fill_color
+
+	# draw mask and fill areas (debuging)
+	if config.mask:
+		img = np.zeros(img.shape, np.uint8)
+		img[wy1:wy2, wx1:wx2] = cv2.cvtColor(mask, cv2.COLOR_GRAY2RGB)
+	elif config.debug:
+		cv2.drawContours(img, contours, -1, (255,0,255), 4)
+		cv2.rectangle(img, (maskx1, masky1), (maskx2, masky2), (0, 255, 0), 4)
+
+	# keep a copy of each step only when asked
+	if config.infill:
+		Image.fromarray(img).save(config.infill_dir + "/" + getCardFileName(card))
+
+	return img
+
+def fix_cards_with_split_layout(card, img, config, profile = None):
+	detected = mask_from_cv_image(card, img)
+	img = fix_card_with_infill(110, 480, REFERENCE_SIZE[0] - 60, REFERENCE_SIZE[0] - 28, card, img, config, detected = detected, profile = profile)
+	img = fix_card_with_infill(610, 980, REFERENCE_SIZE[0] - 60, REFERENCE_SIZE[0] - 28, card, img, config, detected = detected, profile = profile)
+	return img
+
+def fix_cards_with_illustrator_on_black_background(card, img, config, profile = None):
+	# variable height based on power/toughness or loyalty (creature/planeswalker)
+	MAX_HEIGHT = 64
+	MIN_HEIGHT = 39
+
+	height = MAX_HEIGHT
+	if hasattr(card, 'power') or hasattr(card, 'toughness'):
+		height = MIN_HEIGHT
+	elif hasattr(card, 'loyalty'):
+		height = MIN_HEIGHT + 4
+
+	# each region is detected again after the one before it was filled: the right
+	# and center regions overlap, and the threshold of the detection is taken over
+	# the whole card so a black fill anywhere changes what is found next
+	# fix right side
+	img = fix_card_with_infill(REFERENCE_SIZE[1] - height, REFERENCE_SIZE[1] - 5, REFERENCE_SIZE[0] - 300, REFERENCE_SIZE[0] - 25, card, img, config, fill_color = (0, 0, 0), paint = False, flood = True, profile = profile)
+	# fix left side
+	img = fix_card_with_infill(REFERENCE_SIZE[1] - MAX_HEIGHT, REFERENCE_SIZE[1] - 5, 20, 300, card, img, config, fill_color = (0, 0, 0), paint = False, flood = True, profile = profile)
+	# fix center
+	img = fix_card_with_infill(REFERENCE_SIZE[1] - MIN_HEIGHT, REFERENCE_SIZE[1] - 5, 250, REFERENCE_SIZE[0] - 250, card, img, config, fill_color = (0, 0, 0), paint = False, flood = True, profile = profile)
+
+	# return adjusted image
+	return img
+
+def fix_planeswalker(card, img, config, profile = None):
+	return fix_card_with_infill(REFERENCE_SIZE[1] - 70, REFERENCE_SIZE[1] - 5, REFERENCE_SIZE[0] - 575, REFERENCE_SIZE[0] - 150, card, img, config, fill_color = (0, 0, 0), paint = False, flood = True, profile = profile)
+
+def fix_cards_with_paintbrush_illustrator(card, img, config, profile = None):
+	return fix_card_with_infill(940, 990, 35, 540, card, img, config, profile = profile)
+
+def fix_futuresight_creature_card(card, img, config, profile = None):
+	return fix_card_with_infill(930, 985, 75, 555, card, img, config, profile = profile)
+
+def fix_cards_in_sets_with_a_range_of_locations(card, img, config, profile = None):
+	return fix_card_with_infill(940, 990, 45, 560, card, img, config, profile = profile)
+
+def fix_cards_in_sets_with_a_range_of_locations(card, img, config, profile = None):
+	return fix_card_with_infill(940, 990, 45, 555, card, img, config, profile = profile)
+
+def fix_cards_with_centered_illustrator(card, img, config, profile = None):
+	return fix_card_with_infill(925, 979, 100, 575, card, img, config, profile = profile)
+
+def fix_cards_with_left_illustrator(card, img, config, profile = None):
+	return fix_card_with_infill(925, 970, 50, 555, card, img, config, profile = profile)
+
+def crop_card(img):
+	# the pixel cache hands the card over already cropped
+	if isinstance(img, np.ndarray):
+		return Image.fromarray(img)
+
+	# crop off 10 pixels (of a Scryfall PNG) on each side to remove borders, potentially adjust for each generation of card
+	box, reduced = crop_layout(img.size)
+	img = img.crop(box)
+
+	# just rgb because transparent corners actually hurt a bit
+	img = img.convert('RGB')
+
+	# pixels the finished card has no room for only slow the rest down. area
+	# averaging in opencv is many times quicker than PIL's antialias filter for this
+	if reduced:
+		import cv2
+		with timing.stage("reduce"):
+			img = Image.fromarray(cv2.resize(np.asarray(img), reduced, interpolation = cv2.INTER_AREA))
+	return img
+
+# the size of the card once crop_card is done with it
+def cropped_size(img):
+	if isinstance(img, np.ndarray):
+		return img.shape[1], img.shape[0]
+	box, reduced = crop_layout(img.size)
+	return reduced or (box[2] - box[0], box[3] - box[1])
+
+# picks the region handler and the default tone settings for the
+# frame of the card, with the command line overrides applied. returns
+# (handler, autocontrast cutoff, lightening factor, border color)
+def select_frame(card, config):
+	# release dates for card frame magic
+	db = config.db
+	bfz_release = db.get_set("BFZ").releaseDate
+	m15_release = db.get_set("M15").releaseDate
+	m08_release = db.get_set("8ED").releaseDate
+	m04_release = db.get_set("4ED").releaseDate
+
+	# default brightness enhancement factor
+	l_factor = 1.08
+
+	# get set code
+	sCode = card.set.code.lower()
+
+	# autocontrast threshold
+	autocontrast = 10
+
+	# function to use (default is to fix cards with illustrator on the left)
+	operational_func = fix_cards_with_left_illustrator
+
+	# the pattern is to ALWAYS correct the contrast and then
+	# to do the computer vision work on the card. this gives
+	# us the _best_ chance of detecting contours nad having
+	# blacks that fill in properly. so the set-sepecific logic
+	# selects a function for removing text and sets other
+	# settings that will make the card look better
+
+	# version/era specific fixes
+	if hasattr(card, 'layout') and "split" == card.layout:
+		#print "Fixing split layout card"
+		operational_func = fix_cards_with_split_layout
+	elif card.set.releaseDate < bfz_release and hasattr(card, 'loyalty'):
+		#print "Fixing planeswalker card"
+		autocontrast = 15
+		operational_func = fix_planeswalker
+		l_factor = 1.0
+	elif sCode in ["vma", "ema", "mm3"]:
+		#print "Fixing ==VMA, EMA card"
+		autocontrast = 12
+		operational_func = fix_cards_with_illustrator_on_black_background
+	elif sCode in ["fut"] and (hasattr(card, 'power') or hasattr(card, 'toughness')): # future sight creatures have a different card layout ???
+		autocontrast = 12
+		operational_func = fix_futuresight_creature_card
+	elif sCode in ["vis", "wth", "sth", "me4", "5ed"]:
+		#print "Fixing ==VIS, WTH, STH, ME4, ME3"
+		autocontrast = 12
+		operational_func = fix_cards_with_left_illustrator
+	elif sCode in ["med", "me3"]:
+		#print "Fixing ==MED, ME3 card"
+		autocontrast = 10
+		operational_func = fix_cards_with_centered_illustrator
+	elif card.set.releaseDate >= m15_release:
+		#print "Fixing >=M15 card"
+		if hasattr(card, 'colorIdentity') and "W" in card.colorIdentity:
+			autocontrast = 18
+			l_factor = 1.02
+		operational_func = fix_cards_with_illustrator_on_black_background
+	elif card.set.releaseDate >= m08_release:
+		#print "Fixing >=8ED card"
+		if hasattr(card, 'colorIdentity') and "W" in card.colorIdentity:
+			l_factor = 1.00
+		if "bng" == sCode:
+			autocontrast = 16
+		operational_func = fix_cards_with_paintbrush_illustrator
+	elif card.set.releaseDate > m04_release:
+		#print "Fixing >=4ED card"
+		operational_func = fix_cards_with_centered_illustrator
+
+	# autocontrast threshold and lightening factor
+	if config.autocontrast >= 0:
+		autocontrast = config.autocontrast
+	if config.lighten >= 0:
+		l_factor = config.lighten
+
+	# create 36px border
+	fill_border = "black"
+	if hasattr(card,'border') and "black" != card.border:
+		fill_border = card.border
+
+	timing.note(card.name, "handler", operational_func.__name__)
+	return operational_func, autocontrast, l_factor, fill_border
+
+# basically starts to fix the card, autocontrast, lighten, etc
+# and also hands off to specific functions that handle masked
+# areas of each different card style/type. source_hash identifies
+# the source image for the stage cache
+def fix_card(card, img, config, source_hash = None):
+	operational_func, autocontrast, l_factor, fill_border = select_frame(card, config)
+
+	# the step by step version of the pipeline (for --verify)
+	if config.reference:
+		return tone_card_reference(card, crop_card(img), config, operational_func, autocontrast, l_factor, fill_border)
+
+	buf = fix_regions(card, img, config, operational_func, autocontrast, source_hash)
+
+	# lighten just a little bit
+	with timing.stage("enhance"):
+		apply_lut(buf, brightness_lut(l_factor))
+
+	# border and final resize to fit in a single resample
+	return resize_with_border(Image.fromarray(buf), card_border((buf.shape[1], buf.shape[0]), config.border), fill_border)
+
+# the calibrated region profile of the card's set for the handler, None when the
+# set was not calibrated or profiles are turned off
+def region_profile(card, config, operational_func):
+	if not config.regions:
+		return None
+	return config.regions.profile(card.set.code, operational_func.__name__)
+
+# crops and autocontrasts the card and removes its text, as one RGB buffer. the
+# regions are the ones calibrated for the set unless another profile is given
+def fix_regions(card, img, config, operational_func, autocontrast, source_hash = None, profile = None):
+	if profile is None:
+		profile = region_profile(card, config, operational_func)
+
+	# the autocontrasted card with its text removed does not depend on the lightening
+	# or the border, so it is reused from an earlier run when only those changed
+	stage_cache = config.stages
+	stage_key = None
+	if stage_cache and source_hash:
+		inputs = [source_hash, operational_func.__name__, autocontrast, config.debug, config.mask, region_traits(card)]
+		if profile:
+			inputs.append(profile.key())
+		stage_key = stage_cache.key("regions", *inputs)
+	buf = stage_cache.get(stage_key) if stage_key else None
+	if stage_key:
+		timing.count("stage_cache_misses" if buf is None else "stage_cache_hits")
+
+	# everything below works on one RGB buffer: the autocontrast and brightness
+	# tables are applied to it in place and the regions are fixed in place.
+	# the region fixing has to see the autocontrasted card before it is
+	# lightened, which is why the two tables are not folded into one
+	if buf is None:
+		with timing.stage("crop"):
+			if isinstance(img, np.ndarray):
+				# mapped from the pixel cache, this is the first time the pixels are read
+				buf = np.array(img)
+				histogram = Image.fromarray(buf).histogram()
+			else:
+				img = crop_card(img)
+				buf = np.array(img)
+				histogram = img.histogram()
+		with timing.stage("autocontrast"):
+			apply_lut(buf, autocontrast_lut(histogram, autocontrast))
+
+		# do selected function for fixing text
+		buf = operational_func(card, buf, config, profile)
+		if stage_key:
+			stage_cache.put(stage_key, buf)
+
+	return buf
+
+# the card data the region handlers look at besides the set
+def region_traits(card):
+	return [hasattr(card, 'power'), hasattr(card, 'toughness'), hasattr(card, 'loyalty'), getattr(card, 'layout', None)]
+
+# the table ImageOps.autocontrast builds from the histogram of an RGB image,
+# returned as one 256 entry table per channel
+def autocontrast_lut(histogram, cutoff):
+	lut = []
+	for layer in range(0, len(histogram), 256):
+		h = histogram[layer:layer + 256]
+		if cutoff:
+			# cut off pixels from both ends of the histogram
+			n = sum(h)
+			cut = n * cutoff // 100
+			for lo in range(256):
+				if cut > h[lo]:
+					cut = cut - h[lo]
+					h[lo] = 0
+				else:
+					h[lo] -= cut
+					cut = 0
+				if cut <= 0:
+					break
+			cut = n * cutoff // 100
+			for hi in range(255, -1, -1):
+				if cut > h[hi]:
+					cut = cut - h[hi]
+					h[hi] = 0
+				else:
+					h[hi] -= cut
+					cut = 0
+				if cut <= 0:
+					break
+
+		# find lowest/highest samples after preprocessing
+		for lo in range(256):
+			if h[lo]:
+				break
+		for hi in range(255, -1, -1):
+			if h[hi]:
+				break
+		if hi <= lo:
+			lut.append(np.arange(256, dtype = np.uint8))
+		else:
+			scale = 255.0 / (hi - lo)
+			offset = -lo * scale
+			lut.append(np.array([min(max(int(ix * scale + offset), 0), 255) for ix in range(256)], np.uint8))
+	return lut
+
+# the table ImageEnhance.Brightness uses, taken from a ramp so it matches PIL's rounding exactly
+BRIGHTNESS_RAMP = Image.frombytes("L", (256, 1), bytes(bytearray(range(256))))
+def brightness_lut(factor):
+	table = np.array(ImageEnhance.Brightness(BRIGHTNESS_RAMP).enhance(factor).getdata(), np.uint8)
+	return [table, table, table]
+
+# apply a table per channel to an RGB buffer in place
+def apply_lut(buf, lut):
+	import cv2
+	cv2.LUT(buf, np.dstack(lut), dst = buf)
+
+# scale of a card of the given size once it is expanded by the border and
+# resized to RESIZE_TARGET, and the whole target pixels that fall on the card
+def border_layout(size, border):
+	width, height = size
+	scale_x = RESIZE_TARGET[0] / float(width + 2 * border)
+	scale_y = RESIZE_TARGET[1] / float(height + 2 * border)
+	box = (int(math.ceil(border * scale_x - 1e-9)), int(math.ceil(border * scale_y - 1e-9)), int(math.floor((border + width) * scale_x + 1e-9)), int(math.floor((border + height) * scale_y + 1e-9)))
+	return scale_x, scale_y, box
+
+# expand by the border and resize to RESIZE_TARGET with one resample: the card is
+# scaled straight into its spot on a canvas that is already filled with the border
+def resize_with_border(img, border, fill_border):
+	scale_x, scale_y, (left, top, right, bottom) = border_layout(img.size, border)
+
+	# the source box those target pixels map to, so the card lands on the same
+	# sampling grid it would have on the expanded image (clamped for float error)
+	width, height = img.size
+	box = (max(left / scale_x - border, 0), max(top / scale_y - border, 0), min(right / scale_x - border, width), min(bottom / scale_y - border, height))
+
+	with timing.stage("resize"):
+		resized = img.resize((right - left, bottom - top), Image.ANTIALIAS, box)
+	with timing.stage("expand"):
+		canvas = Image.new("RGB", RESIZE_TARGET, fill_border)
+		canvas.paste(resized, (left, top))
+	return canvas
+
+# the original pipeline, one PIL image per step
+def tone_card_reference(card, img, config, operational_func, autocontrast, l_factor, fill_border):
+	img = ImageOps.autocontrast(img, autocontrast)
+	img = Image.fromarray(operational_func(card, np.array(img), config, region_profile(card, config, operational_func)))
+	img = ImageEnhance.Brightness(img).enhance(l_factor)
+	img = ImageOps.expand(img, border=card_border(img.size, config.border), fill=fill_border)
+	return img.resize(RESIZE_TARGET, Image.ANTIALIAS)
+
+# renders the card again through the reference path and reports the difference.
+# where the card meets the border the one step resample blends a little
+# differently, so that seam is reported but not held to --tolerance
+def verify_card(card, img, output_image, config):
+	reference_image = fix_card(card, img, config.copy(reference = True))
+
+	diff = np.abs(np.asarray(output_image, np.int16) - np.asarray(reference_image, np.int16)).max(axis = 2)
+
+	# band of VERIFY_SEAM pixels on both sides of the card edge
+	seam = np.zeros(diff.shape, bool)
+	left, top, right, bottom = border_layout(cropped_size(img), card_border(cropped_size(img), config.border))[2]
+	seam[max(top - VERIFY_SEAM, 0):bottom + VERIFY_SEAM, max(left - VERIFY_SEAM, 0):right + VERIFY_SEAM] = True
+	seam[top + VERIFY_SEAM:bottom - VERIFY_SEAM, left + VERIFY_SEAM:right - VERIFY_SEAM] = False
+	inside = int(diff[~seam].max())
+
+	message = "verified {:s} against the reference path: max difference {:d} ({:d} on the border seam), {:d} pixels differ".format(card.name, inside, int(diff[seam].max()), int(np.count_nonzero(diff)))
+	if inside > config.tolerance:
+		return "[ERROR] " + message + " (tolerance {:d})".format(config.tolerance)
+	return message
+
+# size of each variant on the contact sheet and of the label under it
+SWEEP_THUMBNAIL = 204, 277
+SWEEP_LABEL_HEIGHT = 16
+
+# renders every combination of the swept autocontrast cutoffs, lightening factors
+# and borders for the card. the card is decoded once and its regions are fixed
+# once per cutoff (detection has to see the autocontrasted card, and those are
+# kept in the stage cache); every lightening factor and border is then just a
+# table lookup and a resize on that buffer
+def sweep_card(card, img, config, source_hash = None):
+	import cv2
+	operational_func, autocontrast, l_factor, fill_border = select_frame(card, config)
+	autocontrasts = config.sweep_autocontrast or [autocontrast]
+	lightens = config.sweep_lighten or [l_factor]
+	borders = config.sweep_border or [config.border]
+
+	card_dir = config.sweep_dir + "/" + card.name
+	if not os.path.exists(fs_path(card_dir)):
+		os.makedirs(fs_path(card_dir))
+
+	thumbnails = []
+	for cutoff in autocontrasts:
+		buf = fix_regions(card, img, config, operational_func, cutoff, source_hash)
+		for factor in lightens:
+			toned = Image.fromarray(cv2.LUT(buf, np.dstack(brightness_lut(factor))))
+			for border in borders:
+				variant = resize_with_border(toned, card_border(toned.size, border), fill_border)
+				variant.save(fs_path("{:s}/ac{:d}-l{:g}-b{:d}.png".format(card_dir, cutoff, factor, border)))
+				thumbnails.append(("ac {:d}  l {:g}  b {:d}".format(cutoff, factor, border), variant.resize(SWEEP_THUMBNAIL, Image.ANTIALIAS)))
+
+	# contact sheet, row by row with the settings under each variant
+	columns = int(math.ceil(math.sqrt(len(thumbnails))))
+	rows = int(math.ceil(len(thumbnails) / float(columns)))
+	cell_width, cell_height = SWEEP_THUMBNAIL[0], SWEEP_THUMBNAIL[1] + SWEEP_LABEL_HEIGHT
+	sheet = Image.new("RGB", (columns * cell_width, rows * cell_height), "white")
+	draw = ImageDraw.Draw(sheet)
+	for ix, (label, thumbnail) in enumerate(thumbnails):
+		left, top = (ix % columns) * cell_width, (ix // columns) * cell_height
+		sheet.paste(thumbnail, (left, top))
+		draw.text((left + 2, top + SWEEP_THUMBNAIL[1] + 2), label, fill = "black")
+	sheet_path = config.sweep_dir + "/" + card.name + ".png"
+	sheet.save(fs_path(sheet_path))
+
+	return "Swept {:s} - {:d} variants @ {:s} (contact sheet {:s}) (set={:s}, id={:s})".format(card.name, len(thumbnails), card_dir, sheet_path, getCardSetCode(card), getCardId(card))
@@ -0,0 +1,215 @@
+# use unicode literals
+from __future__ import unicode_literals
+
+# settings for a run and the things that are opened for it
+import os
+import multiprocessing
+
+from pymrox.cache import DEFAULT_IMAGE_CACHE_DIR, ImageCache, StageCache, PixelCache
+from pymrox.carddb import BANNED_SETS, open_card_index
+from pymrox.download import SCRYFALL_INFO_URL_PATTERN, MCI_INFO_URL_PATTERN
+from pymrox.regions import open_region_profiles
+
+# everything a run can be told, with the same defaults as the command line.
+# code using the package builds a config directly:
+#   config = Config("~/proxies", border = 24, jobs = 4)
+# the card index and the caches hang off the config and are only opened
+# when they are first used
+class Config(object):
+	OPTIONS = {
+		# detection debugging
+		"debug": False,
+		"mask": False,
+		"infill": False,
+		# compare with the reference path
+		"verify": False,
+		"tolerance": 2,
+		# the stage cache in the output directory (size in MB)
+		"stage_cache": True,
+		"stage_cache_size": 1024,
+		# which cards get processed and where they come from
+		"overwrite": False,
+		"bless": [],
+		"force_set": None,
+		# names that are not in the card index as written are taken to be the closest
+		# card name when it scores at least this (1.0 only takes names that differ in
+		# case, accents or punctuation, None never takes one)
+		"fuzzy_accept": 1.0,
+		# tone and border, -1 keeps the value picked for the frame of the card
+		"border": 36,
+		"autocontrast": -1,
+		"lighten": -1,
+		# tone sweeps, lists of values
+		"sweep": False,
+		"sweep_autocontrast": None,
+		"sweep_lighten": None,
+		"sweep_border": None,
+		# the shared image cache (size in MB) and downloading
+		"cache_dir": os.environ.get("PYMROX_CACHE") or DEFAULT_IMAGE_CACHE_DIR,
+		"cache_size": 2048,
+		"connections": 4,
+		"retries": 3,
+		"image_urls": None,
+		# the cropped pixels of each source image kept next to the image cache so warm
+		# runs skip decoding (size in MB)
+		"pixel_cache": False,
+		"pixel_cache_size": 4096,
+		# the text of a calibrated set is only looked for where calibration found it
+		"region_profiles": True,
+		# processes that condition cards, 0 for one per cpu
+		"jobs": 1,
+		# threads for the other stages of the stream and the most decoded images held
+		# at once, 0 picks them from --connections and --jobs
+		"fetch_workers": 0,
+		"decode_workers": 2,
+		"write_workers": 2,
+		"in_flight": 0,
+		# print sheets of the finished cards (a pdf, or a directory of pngs) instead of
+		# a png for each card, unless card_files asks for those too. the cut margin is
+		# how much of the border around each card is kept, in pixels of the finished card
+		"sheets": None,
+		"sheet_size": "letter",
+		"sheet_dpi": 300,
+		"cut_margin": 0,
+		"card_files": False,
+		# where to write the timings and counters of the run, nothing is recorded
+		# unless one of them is set
+		"metrics": None,
+		"trace": None,
+		"prometheus": None,
+		# render through the reference path (only set by --verify)
+		"reference": False,
+	}
+
+	def __init__(self, output_dir = "/tmp", **options):
+		for name in options:
+			if name not in Config.OPTIONS:
+				raise TypeError("unknown option {:s}".format(name))
+		for name, default in Config.OPTIONS.items():
+			setattr(self, name, options.get(name, default))
+		if self.sweep_autocontrast or self.sweep_lighten or self.sweep_border:
+			self.sweep = True
+
+		# output directory name
+		output_dir = os.path.expanduser((output_dir or "").strip())
+		if not output_dir:
+			output_dir = "/tmp"
+		elif output_dir[-1] == "/":
+			output_dir = output_dir[:-1]
+		self.output_dir = output_dir
+
+		# other dirs
+		self.json_dir = output_dir + "/.json"
+		self.infill_dir = output_dir + "/.infill"
+		self.stages_dir = output_dir + "/.stages"
+		self.sweep_dir = output_dir + "/sweep"
+
+		self._db = None
+		self._image_cache = None
+		self._stages = None
+		self._pixels = None
+		self._regions = None
+
+	# the options from parsed command line arguments, anything else is left out
+	@classmethod
+	def from_args(cls, args, **options):
+		for name in Config.OPTIONS:
+			if name not in options and hasattr(args, name):
+				options[name] = getattr(args, name)
+		return cls(args.outputdir, **options)
+
+	# the same config with some options changed, sharing whatever is already open
+	def copy(self, **options):
+		config = Config.__new__(Config)
+		config.__dict__.update(self.__dict__)
+		for name, value in options.items():
+			if name not in Config.OPTIONS:
+				raise TypeError("unknown option {:s}".format(name))
+			setattr(config, name, value)
+		return config
+
+	# nothing that is open goes to the worker processes, they open their own
+	def __getstate__(self):
+		state = dict(self.__dict__)
+		state.update(_db = None, _image_cache = None, _stages = None, _pixels = None, _regions = None)
+		return state
+
+	# create the directories the options need
+	def prepare(self):
+		for path, wanted in [(self.output_dir, True), (self.json_dir, True), (self.infill_dir, self.infill), (self.stages_dir, self.stage_cache), (self.sweep_dir, self.sweep)]:
+			if wanted and not os.path.exists(path):
+				os.makedirs(path)
+
+	@property
+	def jobs_count(self):
+		if self.jobs > 0:
+			return self.jobs
+		return multiprocessing.cpu_count()
+
+	@property
+	def instrumented(self):
+		return bool(self.metrics or self.trace or self.prometheus)
+
+	# enough for every stage that holds images to be busy with one and have the next
+	# one waiting for each conditioning job
+	@property
+	def in_flight_count(self):
+		if self.in_flight > 0:
+			return self.in_flight
+		return 2 * self.jobs_count + max(1, self.decode_workers) + max(1, self.write_workers)
+
+	# the card index, opened (and downloaded or built if needed) on first use
+	@property
+	def db(self):
+		if not self._db:
+			self._db = open_card_index(self.json_dir)
+		return self._db
+
+	# banned sets that are allowed for this run
+	@property
+	def blessed_sets(self):
+		return set(code.lower() for code in self.bless if code.lower() in BANNED_SETS)
+
+	@property
+	def image_cache(self):
+		if not self._image_cache:
+			self._image_cache = ImageCache(self.cache_dir, self.cache_size * 1024 * 1024)
+		return self._image_cache
+
+	# the stage cache, None when it is turned off
+	@property
+	def stages(self):
+		if self.stage_cache and not self._stages:
+			self._stages = StageCache(self.stages_dir, self.stage_cache_size * 1024 * 1024)
+		return self._stages
+
+	# the decoded pixel cache, None when it is turned off
+	@property
+	def pixels(self):
+		if self.pixel_cache and not self._pixels:
+			self._pixels = PixelCache(self.cache_dir + "/pixels", self.pixel_cache_size * 1024 * 1024)
+		return self._pixels
+
+	# the calibrated region profiles next to the image cache, None when they are turned off
+	@property
+	def regions(self):
+		if self.region_profiles and not self._regions:
+			self._regions = open_region_profiles(self.cache_dir)
+		return self._regions
+
+	# image sources, tried in this order
+	@property
+	def image_url_patterns(self):
+		return self.image_urls or [SCRYFALL_INFO_URL_PATTERN, MCI_INFO_URL_PATTERN]
+
+	# the options that change how a conditioned card comes out, renders of the same
+	# printing with the same parameters are the same image
+	def render_params(self):
+		return {"border": self.border, "autocontrast": self.autocontrast, "lighten": self.lighten, "debug": self.debug, "mask": self.mask, "image_urls": self.image_url_patterns}
+
+	# close what is open before forking worker processes
+	def close(self):
+		if self._db:
+			self._db.close()
+		if self._image_cache:
+			self._image_cache.close()
@@ -0,0 +1,226 @@
+# use unicode literals
+from __future__ import unicode_literals
+
+# finding card images and downloading them into the image cache
+import re
+import io
+import urlparse
+import httplib
+import socket
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+from PIL import Image
+
+from pymrox import timing
+
+# url pattern
+MCI_INFO_URL_PATTERN = "https://magiccards.info/scans/en/{:s}/{:s}.jpg"
+SCRYFALL_INFO_URL_PATTERN = "https://img.scryfall.com/cards/png/en/{:s}/{:s}.png"
+
+# where `PyMrox.py import` files the images it takes from local archives, looked at
+# after every image source
+IMPORT_URL_PATTERN = "import:{:s}/{:s}"
+
+def getCardFileName(card):
+	name = card.name.lower()
+	name = re.sub(r'\W+', '_', name)
+	return card.set.code.lower() + "-" + getCardId(card) + "-" + name + ".png"
+
+def getCardId(card, urlPattern = None):
+	cardId = None
+
+	# find card id
+	if hasattr(card, 'number') and card.number:
+		cardId = card.number
+
+	# need to look somwhere else for card id		
+	if (not cardId or urlPattern == MCI_INFO_URL_PATTERN) and hasattr(card, 'mciNumber') and card.mciNumber:
+		cardId = card.mciNumber
+
+	return cardId
+
+def getCardSetCode(card, urlPattern = None):
+	setCode = card.set.code.lower()
+	if urlPattern == MCI_INFO_URL_PATTERN and hasattr(card.set, 'magicCardsInfoCode'):
+		setCode = card.set.magicCardsInfoCode.lower()
+	return setCode
+
+# download tuning
+DOWNLOAD_TIMEOUT = 30
+DOWNLOAD_BACKOFF = 0.5
+DOWNLOAD_MAX_REDIRECTS = 5
+RETRY_STATUS = [429, 500, 502, 503, 504]
+REDIRECT_STATUS = [301, 302, 303, 307, 308]
+
+# keep-alive connections to a single host, at most `size` requests are in flight at once
+class HostPool(object):
+	def __init__(self, scheme, host, size):
+		self.scheme = scheme
+		self.host = host
+		self.slots = threading.BoundedSemaphore(size)
+		self.lock = threading.Lock()
+		self.idle = []
+
+	def connect(self):
+		if "https" == self.scheme:
+			return httplib.HTTPSConnection(self.host, timeout = DOWNLOAD_TIMEOUT)
+		return httplib.HTTPConnection(self.host, timeout = DOWNLOAD_TIMEOUT)
+
+	def get(self, path):
+		with self.slots:
+			with self.lock:
+				conn = self.idle.pop() if self.idle else None
+			if not conn:
+				conn = self.connect()
+			try:
+				conn.request("GET", path, headers = {"User-Agent": "PyMrox"})
+				response = conn.getresponse()
+				data = response.read()
+			except:
+				conn.close()
+				raise
+			# hand the connection back for reuse unless the server is closing it
+			if response.will_close:
+				conn.close()
+			else:
+				with self.lock:
+					self.idle.append(conn)
+			return response.status, response.getheader("location"), data
+
+# fetches card images from the url patterns in order, many at a time
+class ImageDownloader(object):
+	def __init__(self, patterns, connections, retries):
+		self.patterns = patterns
+		self.connections = max(1, connections)
+		self.retries = retries
+		self.pools = {}
+		self.lock = threading.Lock()
+
+	def pool(self, scheme, host):
+		with self.lock:
+			if (scheme, host) not in self.pools:
+				self.pools[(scheme, host)] = HostPool(scheme, host, self.connections)
+			return self.pools[(scheme, host)]
+
+	# returns the body, or None if the source does not have it. raises IOError
+	# when the source keeps failing after all of the retries
+	def fetch(self, url):
+		for redirect in range(DOWNLOAD_MAX_REDIRECTS):
+			parts = urlparse.urlsplit(url)
+			path = parts.path + ("?" + parts.query if parts.query else "")
+			pool = self.pool(parts.scheme, parts.netloc)
+			attempt = 0
+			while True:
+				try:
+					status, location, data = pool.get(path)
+					if status not in RETRY_STATUS:
+						break
+					error = "HTTP {:d} from {:s}".format(status, url)
+				except (httplib.HTTPException, socket.error) as e:
+					error = "{:s} from {:s}".format(str(e) or e.__class__.__name__, url)
+				if attempt >= self.retries:
+					raise IOError(error)
+				timing.count("download_retries")
+				time.sleep(DOWNLOAD_BACKOFF * (2 ** attempt))
+				attempt += 1
+
+			if status in REDIRECT_STATUS and location:
+				url = urlparse.urljoin(url, location)
+				continue
+			if 200 == status:
+				return data
+			return None
+		return None
+
+	# try each source in order and return (url, data) for the first good image,
+	# or (None, a description of what went wrong)
+	def download(self, card):
+		errors = []
+		for source, urlPattern in enumerate(self.patterns):
+			url = urlPattern.format(getCardSetCode(card, urlPattern), getCardId(card, urlPattern))
+			try:
+				with timing.stage("download", "download"):
+					data = self.fetch(url)
+			except IOError as e:
+				errors.append(str(e))
+				continue
+			if not data:
+				errors.append("no image at {:s}".format(url))
+				continue
+
+			# make sure it is really an image before it goes into the cache
+			try:
+				Image.open(io.BytesIO(data)).verify()
+			except Exception as e:
+				errors.append("bad image from {:s} ({:s})".format(url, str(e)))
+				continue
+
+			timing.count("downloads")
+			timing.count("download_bytes", len(data))
+			# found, but not at the first source
+			if source:
+				timing.count("download_fallbacks")
+			return url, data
+		timing.count("download_failures")
+		return None, " | ".join(errors)
+
+# (path, sha1) of the cached image of the card, from the first source that has it
+# or else the one imported for it
+def cached_card_image(card, config, touch = True):
+	for urlPattern in config.image_url_patterns + [IMPORT_URL_PATTERN]:
+		url = urlPattern.format(getCardSetCode(card, urlPattern), getCardId(card, urlPattern))
+		cached = config.image_cache.get(url, getCardSetCode(card), getCardId(card), touch)
+		if cached:
+			return cached
+	return None
+
+# how many downloads can run at once: --connections to each image host
+def download_workers(config):
+	hosts = set(urlparse.urlsplit(urlPattern).netloc for urlPattern in config.image_url_patterns)
+	return max(1, config.connections) * len(hosts)
+
+# ((path, sha1), None) for the card's image, downloading it into the cache first when it
+# is not there yet, or (None, errors) when no source has it
+def fetch_card_image(card, config, downloader):
+	cached = cached_card_image(card, config)
+	if cached:
+		config.image_cache.count(hits = 1)
+		timing.count("image_cache_hits")
+		return cached, None
+	config.image_cache.count(misses = 1)
+	timing.count("image_cache_misses")
+	url, result = downloader.download(card)
+	if not url:
+		return None, result
+	config.image_cache.count(downloads = 1, downloaded_bytes = len(result))
+	return config.image_cache.put(url, getCardSetCode(card), getCardId(card), result), None
+
+# the line logged when no source has the card's image
+def missing_image_message(card, errors):
+	return "[ERROR] {:s} | could not find {:s} (id={:s}, set={:s}) at any URL".format(errors, card.name, getCardId(card), getCardSetCode(card))
+
+# download every image in the list that is not already cached, all at the
+# same time (limited per host by --connections). errors are reported in
+# the order of the list once everything is done
+def download_images(cards, config):
+	jobs = []
+	seen = set()
+	for card in cards:
+		if getCardFileName(card) not in seen:
+			seen.add(getCardFileName(card))
+			jobs.append(card)
+	if not jobs:
+		return
+
+	downloader = ImageDownloader(config.image_url_patterns, config.connections, config.retries)
+	workers = ThreadPool(min(len(jobs), download_workers(config)))
+	try:
+		results = workers.map(lambda card: fetch_card_image(card, config, downloader), jobs)
+	finally:
+		workers.close()
+		workers.join()
+
+	for card, (cached, errors) in zip(jobs, results):
+		if errors:
+			print missing_image_message(card, errors)
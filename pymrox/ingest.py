@@ -0,0 +1,180 @@
+# use unicode literals
+from __future__ import unicode_literals
+
+# `PyMrox.py import`: fills the image cache from card images that are already on
+# disk (a zip or tar archive or a directory tree) instead of downloading them, so a
+# host without access to the image sources can be warmed up in one pass
+import os
+import io
+import re
+import Queue
+import hashlib
+import tarfile
+import zipfile
+import threading
+from PIL import Image
+
+from pymrox.download import IMPORT_URL_PATTERN, MCI_INFO_URL_PATTERN, getCardSetCode, getCardId, getCardFileName, cached_card_image
+from pymrox.pipeline import resolve_entry
+
+# the files that are taken to be card images
+IMPORT_EXTENSIONS = [".png", ".jpg", ".jpeg"]
+
+# a file named like getCardFileName names them, "m15-62-jace_the_living_guildpact.png",
+# or with just the set code and number, "m15-62.png"
+IMPORT_FILE_NAME_REGEX = re.compile(r"^([a-z0-9_]+)-([0-9]+[a-z]?)(?:-.*)?$", re.IGNORECASE)
+
+# (set code, number) pairs the file could stand for: from its name, and from the
+# directory it is in and its name like the image sources lay them out ("m15/62.png")
+def import_keys(name):
+	parts = name.replace("\\", "/").split("/")
+	stem, extension = os.path.splitext(parts[-1])
+	if extension.lower() not in IMPORT_EXTENSIONS:
+		return []
+	keys = []
+	match = IMPORT_FILE_NAME_REGEX.match(stem)
+	if match:
+		keys.append((match.group(1).lower(), match.group(2).lower()))
+	if len(parts) > 1 and parts[-2]:
+		keys.append((parts[-2].lower(), stem.lower()))
+	return keys
+
+# every card in the index with an image, by (set code, number) in lower case. the
+# magiccards.info set codes and numbers work too as those are how its images are named
+def printings_by_number(config):
+	printings = {}
+	for card in config.db.cards():
+		for urlPattern in [None, MCI_INFO_URL_PATTERN]:
+			number = getCardId(card, urlPattern)
+			if number:
+				printings.setdefault((getCardSetCode(card, urlPattern), number.lower()), card)
+	return printings
+
+# (name, read) for every file in the source, read() returns its content. the files
+# of a tar archive come out in the order they are stored and have to be read then
+def source_files(source):
+	if os.path.isdir(source):
+		for root, dirs, files in os.walk(source):
+			dirs.sort()
+			for name in sorted(files):
+				path = os.path.join(root, name)
+				yield os.path.relpath(path, source), lambda path = path: open(path, "rb").read()
+	elif zipfile.is_zipfile(source):
+		archive = zipfile.ZipFile(source, "r")
+		try:
+			for info in archive.infolist():
+				if not info.filename.endswith("/"):
+					yield info.filename, lambda info = info: archive.read(info)
+		finally:
+			archive.close()
+	elif tarfile.is_tarfile(source):
+		archive = tarfile.open(source, "r|*")
+		try:
+			for member in archive:
+				if member.isfile():
+					yield member.name, lambda member = member: archive.extractfile(member).read()
+		finally:
+			archive.close()
+	else:
+		raise IOError("{:s} is not a directory or a zip or tar archive".format(source))
+
+# what an import did with the files
+class ImportReport(object):
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.counts = {"imported": 0, "cached": 0, "unmatched": 0, "bad": 0}
+		self.errors = []
+
+	def add(self, outcome, error = None):
+		with self.lock:
+			self.counts[outcome] += 1
+			if error:
+				self.errors.append(error)
+
+# checks that the file is an image and puts it in the image cache for the card
+def import_image(card, name, data, config, report):
+	try:
+		Image.open(io.BytesIO(data)).verify()
+	except Exception as e:
+		report.add("bad", "[ERROR] {:s} is not a good image ({:s})".format(name, str(e)))
+		return
+
+	setCode, cardId = getCardSetCode(card), getCardId(card)
+	url = IMPORT_URL_PATTERN.format(setCode, cardId)
+	# the same image again leaves the cache as it is
+	cached = config.image_cache.get(url, setCode, cardId)
+	if cached and cached[1] == hashlib.sha1(data).hexdigest():
+		report.add("cached")
+		return
+	config.image_cache.put(url, setCode, cardId, data)
+	report.add("imported")
+
+# reads the files of every source one after the other and has workers threads
+# verify them and write them to the cache (atomically, like a download) meanwhile.
+# only a few files are held in memory at once. returns the ImportReport
+def import_sources(sources, config, workers):
+	printings = printings_by_number(config)
+	report = ImportReport()
+	inbox = Queue.Queue(2 * workers)
+
+	def run():
+		while True:
+			job = inbox.get()
+			if job is None:
+				break
+			try:
+				import_image(*job)
+			except Exception as e:
+				report.add("bad", "[ERROR] {:s}: {:s} | could not import {:s}".format(e.__class__.__name__, str(e), job[1]))
+
+	threads = [threading.Thread(target = run, name = "import-{:d}".format(ix + 1)) for ix in range(workers)]
+	for thread in threads:
+		thread.daemon = True
+		thread.start()
+	try:
+		for source in sources:
+			for name, read in source_files(os.path.expanduser(source)):
+				keys = import_keys(name)
+				if not keys:
+					continue
+				card = next((printings[key] for key in keys if key in printings), None)
+				if not card:
+					report.add("unmatched", "[ERROR] {:s} does not match a printing (set code and number)".format(name))
+					continue
+				inbox.put((card, name, read(), config, report))
+	finally:
+		for thread in threads:
+			inbox.put(None)
+		for thread in threads:
+			thread.join()
+	return report
+
+# the printings of the cards in the deck lists and of every card in the sets that
+# have no image in the cache yet, as the lines to log
+def missing_printings(config, card_names = (), set_codes = ()):
+	messages = []
+	wanted = []
+	for card_name in card_names:
+		if not card_name.strip():
+			continue
+		card, lines = resolve_entry(card_name, config)
+		messages.extend(lines)
+		if card:
+			wanted.append(card)
+	for code in set_codes:
+		cards = [card for card in config.db.cards(code) if getCardId(card)]
+		if not cards:
+			messages.append("[ERROR] no set {:s} in the card data".format(code))
+		wanted.extend(cards)
+
+	seen = set()
+	missing = 0
+	for card in wanted:
+		if getCardFileName(card) in seen:
+			continue
+		seen.add(getCardFileName(card))
+		if not cached_card_image(card, config):
+			missing += 1
+			messages.append("Missing {:s} (set={:s}, id={:s})".format(card.name, getCardSetCode(card), getCardId(card)))
+	messages.append("{:d} of {:d} printings are in the cache".format(len(seen) - missing, len(seen)))
+	return messages
@@ -0,0 +1,100 @@
+# use unicode literals
+from __future__ import unicode_literals
+
+# the manifest of an output directory: what each card in it was made from, so a
+# run only makes the cards again whose printing, source image, frame handler,
+# settings or conditioning code changed. telling which those are takes the card
+# index, the image cache index and a stat of the output, no image is opened
+import os
+import json
+import threading
+
+from pymrox.cache import fs_path, write_shared
+from pymrox.download import getCardSetCode, getCardId, cached_card_image
+from pymrox.conditioning import RENDER_VERSION, select_frame, region_profile
+
+OUTPUT_MANIFEST = ".manifest.json"
+OUTPUT_MANIFEST_VERSION = 1
+
+# what an input is called when it is the reason a card is made again
+INPUT_NAMES = {
+	"set": "printing",
+	"number": "printing",
+	"source": "source image",
+	"handler": "frame handler",
+	"version": "conditioning code",
+	"fill": "border color",
+	"regions": "region profile",
+}
+
+# the outputs of the manifest by file name, none if there is no (readable) manifest
+def read_manifest(path):
+	try:
+		with open(path, "r") as f:
+			data = json.load(f)
+	except (IOError, ValueError):
+		return {}
+	if OUTPUT_MANIFEST_VERSION != data.get("version"):
+		return {}
+	return data.get("outputs", {})
+
+class OutputManifest(object):
+	def __init__(self, output_dir):
+		self.path = output_dir + "/" + OUTPUT_MANIFEST
+		self.outputs = read_manifest(self.path)
+		self.updated = {}
+		self.lock = threading.Lock()
+
+	# what the card is made from with the config, but for the source image which is
+	# only known for sure once it is fetched. the same as it reads back from the manifest
+	def inputs(self, card, config):
+		operational_func, autocontrast, l_factor, fill_border = select_frame(card, config)
+		profile = region_profile(card, config, operational_func)
+		params = {"autocontrast": autocontrast, "lighten": l_factor, "fill": fill_border, "border": config.border, "debug": config.debug, "mask": config.mask, "regions": profile.key() if profile else None}
+		return json.loads(json.dumps({"set": getCardSetCode(card), "number": getCardId(card), "handler": operational_func.__name__, "params": params, "version": RENDER_VERSION}))
+
+	# what changed since the output at path was made, or None when it is up to date.
+	# outputs the manifest does not know (made before there was one) or that were
+	# replaced since (by hand, see README.md) are left as they are
+	def stale(self, card, config, inputs, path):
+		entry = self.outputs.get(os.path.basename(path))
+		if not entry:
+			return None
+		st = os.stat(fs_path(path))
+		if st.st_size != entry.get("size") or st.st_mtime != entry.get("mtime"):
+			return None
+
+		changed = []
+		for name in ["set", "number", "handler", "version"]:
+			if entry.get(name) != inputs[name]:
+				changed.append(INPUT_NAMES[name])
+		params = entry.get("params", {})
+		for name in sorted(inputs["params"]):
+			if params.get(name) != inputs["params"][name]:
+				changed.append(INPUT_NAMES.get(name, name))
+		# a source image that is no longer cached is taken to be the same one
+		cached = cached_card_image(card, config, touch = False)
+		if cached and cached[1] != entry.get("source"):
+			changed.append(INPUT_NAMES["source"])
+
+		changed = sorted(set(changed), key = changed.index)
+		return ", ".join(changed) if changed else None
+
+	# the output at path was just made from the inputs and the source image
+	def record(self, path, inputs, source_hash):
+		st = os.stat(fs_path(path))
+		entry = dict(inputs, source = source_hash, size = st.st_size, mtime = st.st_mtime)
+		with self.lock:
+			self.outputs[os.path.basename(path)] = entry
+			self.updated[os.path.basename(path)] = entry
+
+	# writes what was recorded, on top of the manifest as it is on disk now so runs
+	# on the same directory at once do not drop each other's cards
+	def save(self):
+		with self.lock:
+			if not self.updated:
+				return
+			outputs = read_manifest(self.path)
+			outputs.update(self.updated)
+			write_shared(self.path, json.dumps({"version": OUTPUT_MANIFEST_VERSION, "outputs": outputs}, indent = 1, sort_keys = True).encode("utf-8"))
+			self.updated = {}
@@ -0,0 +1,581 @@
+# use unicode literals
+from __future__ import unicode_literals
+
+# from card names to conditioned cards: resolving, fetching and the worker pool
+import re
+import io
+import os
+import Queue
+import contextlib
+import threading
+import multiprocessing
+import numpy as np
+from PIL import Image
+
+from pymrox import timing
+from pymrox.cache import fs_path
+from pymrox.download import getCardSetCode, getCardId, cached_card_image, download_images, download_workers, fetch_card_image, missing_image_message, ImageDownloader
+from pymrox.conditioning import crop_card, draft_image, fix_card, verify_card, sweep_card
+from pymrox.manifest import OutputManifest
+
+# string patterns for save location
+SAVE_MODIFIED_PATTERN = "{:s}/{:s}"
+
+# compile regular expression to split the leading number (the quantity) off
+LINE_PATTERN_REGEX = re.compile(r"^([0-9]+?)[ ]+?(.+)$")
+
+# the printing to use for the card name and, when the name is not in the card
+# index as written, the closest name as (name, score) or None. the closest name is
+# used instead when its score is at least config.fuzzy_accept
+def match_card(card_name_input, config, force_set = None):
+	# if conditioned line is empty, go to next line
+	if not card_name_input.strip():
+		return None, None
+
+	# every usable printing of the card, oldest set first, with banned sets
+	# (unless blessed) and banned cards already left out
+	force_set = force_set or config.force_set
+	printings = config.db.find_printings(card_name_input, force_set = force_set, blessed = config.blessed_sets)
+
+	# a misspelled name or one from another site's export
+	closest = None
+	if not printings:
+		closest = config.db.closest_name(card_name_input)
+		found = config.db.find_printings(closest[0], force_set = force_set, blessed = config.blessed_sets) if closest else []
+		# a name that is only in banned sets (or not in the forced one) is no use either
+		if not found:
+			closest = None
+		elif config.fuzzy_accept is not None and closest[1] >= config.fuzzy_accept:
+			timing.count("fuzzy_matches")
+			printings = found
+
+	# look for oldest version of the card from black bordered sets that are not online only
+	card = None
+	for cardCheck in printings:
+		# keep the first valid card
+		if not card:
+			card = cardCheck
+
+		# dont immediately accept timeshifted cards
+		if hasattr(cardCheck, 'timeshifted') and cardCheck.timeshifted:
+			continue
+
+		# if card is found with a black border, break (otherwise keep searching)
+		# this means that a white bordered card will still show up but if a black bordered
+		# version exists it will be pulled down
+		if hasattr(card, 'border') and "black" == card.border:
+			card = cardCheck
+			break
+
+	return card, closest
+
+# the printing to use for the card name, or None
+def find_card(card_name_input, config, force_set = None):
+	return match_card(card_name_input, config, force_set)[0]
+
+# the line logged for a card name that has no usable printing, with the closest
+# name if there is one
+def not_found_message(card_name_input, closest = None):
+	message = "[ERROR] card {:s} not found in available sets/cards".format(card_name_input)
+	if closest:
+		message += " (closest is {:s} at {:.2f}, see --fuzzy-accept)".format(closest[0], closest[1])
+	return message
+
+# the line logged for a card name that was taken to be the closest name
+def matched_message(card_name_input, card, closest):
+	return "Matched {:s} to {:s} ({:.2f})".format(card_name_input.strip(), card.name, closest[1])
+
+# match_card, logging the names that are not found or were matched
+def resolve_card(card_name_input, config, force_set = None):
+	card, closest = match_card(card_name_input, config, force_set)
+
+	# if no card is found after search we need to move on
+	if not card and card_name_input.strip():
+		print not_found_message(card_name_input, closest)
+	elif card and closest:
+		print matched_message(card_name_input, card, closest)
+
+	return card
+
+# match_card for a name that is resolved ahead of the stream, timed like the stream
+# does it. returns the card (or None) and the lines to log for it
+def resolve_entry(card_name_input, config):
+	with timing.stage("resolve", timing.PIPELINE, card_name_input) as timer:
+		card, closest = match_card(card_name_input, config)
+		# the rest of the card's time goes under the name it resolved to
+		if card and timer:
+			timer.card = card.name
+	messages = []
+	if card and closest:
+		messages.append(matched_message(card_name_input, card, closest))
+	if not card:
+		messages.append(not_found_message(card_name_input, closest))
+	return card, messages
+
+# (image, cache path, sha1) for the card from the image cache, or None
+def open_cached_image(card, config):
+	cached = cached_card_image(card, config)
+	if not cached:
+		return None
+	path, sha1 = cached
+	with open(path, "rb") as f:
+		return draft_image(Image.open(io.BytesIO(f.read()))), path, sha1
+
+# (image, cache path, sha1) for the card, downloading it if it is not cached yet.
+# None when no source has it
+def fetch_image(card, config):
+	download_images([card], config)
+	return open_cached_image(card, config)
+
+# the card's image to condition. with the pixel cache that is its cropped pixels
+# mapped in from there, which are put there the first time the image is decoded
+def decode_card_image(path, source_hash, config):
+	pixels = config.pixels
+	if pixels:
+		key = pixels.key(source_hash)
+		buf = pixels.get(key, path)
+		timing.count("pixel_cache_misses" if buf is None else "pixel_cache_hits")
+		if buf is not None:
+			return buf
+
+	with open(path, "rb") as f:
+		img = draft_image(Image.open(io.BytesIO(f.read())))
+	img.load()
+	if pixels:
+		buf = np.asarray(crop_card(img))
+		pixels.put(key, buf)
+		return buf
+	return img
+
+# where the processed card goes
+def getOutputFileName(card, config):
+	return SAVE_MODIFIED_PATTERN.format(config.output_dir, card.name + ".png")
+
+# the card is processed unless it is already there and we were not asked to redo it
+def needs_processing(card, config, overwrite = False):
+	return overwrite or config.overwrite or config.sweep or not os.path.isfile(fs_path(getOutputFileName(card, config)))
+
+# the line logged for a card that is already there
+def existing_message(card, config):
+	return "Existing {:s} @ {:s} (set={:s}, id={:s})".format(card.name, getOutputFileName(card, config), getCardSetCode(card), getCardId(card))
+
+# the line logged for a card that could not be processed
+def failed_message(card, e):
+	return "[ERROR] {:s}: {:s} | could not process {:s} (set={:s}, id={:s})".format(e.__class__.__name__, str(e), card.name, getCardSetCode(card), getCardId(card))
+
+# the line logged for a deck entry that could not be resolved
+def unresolved_message(entry, e):
+	return "[ERROR] {:s}: {:s} | could not resolve {:s}".format(e.__class__.__name__, str(e), entry)
+
+# the line message_func makes for an error, or a plainer one when that cannot be
+# put together (a name or error message in bytes that are not ascii). every entry
+# of the deck has to get a line or the stream waits for it forever
+def error_message(message_func, subject, e, seq):
+	try:
+		return message_func(subject, e)
+	except Exception:
+		return "[ERROR] {:s} | could not process entry {:d} of the deck".format(e.__class__.__name__, seq + 1)
+
+# the config of a worker process, set when the pool starts it
+worker_config = None
+
+# the conditioned image of the card and anything more to log for it (the --verify
+# report). for --sweep the variants are written here and only the log line comes back
+def condition_card(card, img, source_hash, config = None):
+	config = config or worker_config
+
+	# tone variants instead of the card itself
+	if config.sweep:
+		return None, sweep_card(card, img, config, source_hash)
+
+	# mitigate copyright based on frame type
+	output_image = fix_card(card, img, config, source_hash)
+
+	# compare with the reference path if asked
+	report = None
+	if config.verify:
+		report = verify_card(card, img, output_image, config)
+
+	return output_image, report
+
+# condition_card on a worker of the pool, along with what the worker recorded for it
+# when the run is instrumented
+def condition_in_worker(card, img, source_hash):
+	with timing.stage("condition", timing.PIPELINE, card.name):
+		output_image, report = condition_card(card, img, source_hash)
+	return output_image, report, timing.recorder.drain() if timing.recorder else None
+
+# runs once in each worker process before it is handed any cards
+def init_worker(config):
+	global worker_config
+	worker_config = config
+
+	# a recorder of its own, whatever was recorded before the fork stays with the parent
+	timing.record(timing.Recorder() if config.instrumented else None)
+
+	# the pool provides the parallelism so opencv should not start threads of its own
+	import cv2
+	cv2.setNumThreads(1)
+
+# a pool for conditioning cards, the config is handed to each worker once.
+# whatever the config has open is closed first so the workers open their own
+def start_pool(config, size):
+	config.close()
+	return multiprocessing.Pool(size, init_worker, (config,))
+
+# (card name, quantity) for each line of a deck list, a line without a quantity
+# in front counts once
+def parse_decklist(lines):
+	entries = []
+	for line in lines:
+		# condition string
+		line = line.rstrip()
+		match = LINE_PATTERN_REGEX.match(line)
+		if match:
+			entries.append((match.group(2), int(match.group(1))))
+		else:
+			entries.append((line, 1))
+	return entries
+
+# the card names in a deck list, one per line with the quantity in front
+def read_decklist(lines):
+	return [card_name for card_name, quantity in parse_decklist(lines)]
+
+# resolve the whole deck up front, cards listed more than once are only processed
+# once. returns the cards and the names that could not be found
+def resolve_deck(card_names, config, force_set = None):
+	cards = []
+	missing = []
+	outputs = set()
+	for card_name in card_names:
+		card = resolve_card(card_name, config, force_set)
+		if not card:
+			if card_name.strip():
+				missing.append(card_name)
+		elif getOutputFileName(card, config) not in outputs:
+			outputs.add(getOutputFileName(card, config))
+			cards.append(card)
+	return cards, missing
+
+# marks the end of the work put on a stage's queue
+STREAM_DONE = object()
+
+# a card on its way through the stream, seq is its place in the deck
+class StreamItem(object):
+	def __init__(self, seq, card):
+		self.seq = seq
+		self.card = card
+		self.path = None
+		self.source_hash = None
+		self.img = None
+		self.output = None
+		self.report = None
+		self.slot = False
+		self.matched = None
+		self.inputs = None
+		self.stale = None
+
+# cards go through as a stream of stages joined by bounded queues:
+#   resolve -> fetch -> decode -> condition -> encode/write
+# every stage has its own threads (--fetch-workers, --decode-workers, --jobs and
+# --write-workers) so a card is being downloaded while the one before it is
+# conditioned and the one before that is written. a decoded card holds one of
+# --in-flight slots until it is written, decoding waits for a free slot and the
+# full queues hold up the stages behind them, so memory stays at that many
+# images however long the deck is. the log lines come back in deck order. with a
+# compositor the finished cards go onto its sheets, in deck order too, instead of
+# each being written (unless config.card_files asks for both). what each written
+# card was made from goes in the manifest of the output directory, cards that are
+# already there are only made again when that changed
+class CardStream(object):
+	def __init__(self, config, pool = None, overwrite = False, resolve = False, force_set = None, clear = False, compositor = None):
+		self.config = config
+		self.compositor = compositor
+		self.manifest = None if config.sweep else OutputManifest(config.output_dir)
+		self.pool = pool
+		self.overwrite = overwrite
+		self.resolve = resolve
+		self.force_set = force_set
+		self.clear = clear
+		self.downloader = ImageDownloader(config.image_url_patterns, config.connections, config.retries)
+		self.slots = threading.Semaphore(config.in_flight_count)
+		self.results = Queue.Queue()
+		# what goes on the sheets for a card by its place in the deck, the compositor
+		# is fed in deck order as the log lines are put back in order
+		self.placing = {}
+		self.threads = []
+
+	# the card is done, whatever happened to it
+	def finish(self, item, message = None):
+		if item.slot:
+			self.slots.release()
+			item.slot = False
+		item.img = item.output = None
+		if item.matched:
+			message = item.matched + ("\n" + message if message else "")
+		self.results.put((item.seq, message))
+
+	# runs work on each item from the inbox with this many threads. what work returns
+	# goes on to the outbox, a card that fails is finished with the error. the stage
+	# is timed for each card unless timed is False (it is timed where it runs)
+	def stage(self, name, work, workers, inbox, outbox, timed = True):
+		running = [workers]
+		lock = threading.Lock()
+
+		def run():
+			while True:
+				item = inbox.get()
+				if item is STREAM_DONE:
+					# leave it there for the other threads of the stage
+					inbox.put(STREAM_DONE)
+					break
+				try:
+					if timed:
+						with timing.stage(name, timing.PIPELINE, item.card.name):
+							item = work(item)
+					else:
+						item = work(item)
+				except Exception as e:
+					self.finish(item, error_message(failed_message, item.card, e, item.seq))
+					continue
+				if item:
+					outbox.put(item)
+
+			# the last thread out tells the next stage
+			with lock:
+				running[0] -= 1
+				last = not running[0]
+			if last:
+				outbox.put(STREAM_DONE)
+
+		for ix in range(workers):
+			thread = threading.Thread(target = run, name = "{:s}-{:d}".format(name, ix + 1))
+			thread.daemon = True
+			thread.start()
+			self.threads.append(thread)
+
+	# whether the card has to be made: it is not there yet, it was asked for again or
+	# the manifest says what it is made from changed. it is finished here otherwise
+	def wanted(self, item):
+		if self.manifest:
+			item.inputs = self.manifest.inputs(item.card, self.config)
+		if needs_processing(item.card, self.config, self.overwrite):
+			return True
+		if self.manifest:
+			item.stale = self.manifest.stale(item.card, self.config, item.inputs, getOutputFileName(item.card, self.config))
+		if item.stale:
+			return True
+		self.finish(item, existing_message(item.card, self.config))
+		return False
+
+	# one thread as the card index is a single connection. cards that are already
+	# there and up to date and duplicates are finished here, before anything is downloaded
+	def resolve_cards(self, entries, outbox):
+		seq = 0
+		outputs = set()
+		try:
+			for seq, entry in enumerate(entries, 1):
+				item = StreamItem(seq - 1, entry)
+				if not self.resolve:
+					try:
+						if self.wanted(item):
+							outbox.put(item)
+					except Exception as e:
+						self.finish(item, error_message(failed_message, item.card, e, item.seq))
+					continue
+
+				try:
+					with timing.stage("resolve", timing.PIPELINE, entry) as timer:
+						item.card, closest = match_card(entry, self.config, self.force_set)
+						# the rest of the card's time goes under the name it resolved to
+						if item.card and timer:
+							timer.card = item.card.name
+					if item.card and closest:
+						item.matched = matched_message(entry, item.card, closest)
+					if not item.card:
+						self.results.put((item.seq, not_found_message(entry, closest) if entry.strip() else None))
+						continue
+				except Exception as e:
+					self.results.put((item.seq, error_message(unresolved_message, entry, e, item.seq)))
+					continue
+
+				# the card is known from here on, what goes wrong is not about resolving it
+				try:
+					if getOutputFileName(item.card, self.config) in outputs:
+						self.results.put((item.seq, item.matched))
+					else:
+						outputs.add(getOutputFileName(item.card, self.config))
+						# forget the cached image so it is downloaded again
+						if self.clear:
+							self.config.image_cache.forget(getCardSetCode(item.card), getCardId(item.card))
+						if self.wanted(item):
+							outbox.put(item)
+				except Exception as e:
+					self.finish(item, error_message(failed_message, item.card, e, item.seq))
+		finally:
+			self.results.put((None, seq))
+			outbox.put(STREAM_DONE)
+
+	def fetch(self, item):
+		cached, errors = fetch_card_image(item.card, self.config, self.downloader)
+		if not cached:
+			self.finish(item, missing_image_message(item.card, errors) + "\n[ERROR] No image data found for {:s}".format(item.card.name))
+			return None
+		item.path, item.source_hash = cached
+		return item
+
+	# timed here so that waiting for a slot is not counted as decoding
+	def decode(self, item):
+		with timing.stage("in_flight_wait", "wait", item.card.name):
+			self.slots.acquire()
+		item.slot = True
+		with timing.stage("decode", timing.PIPELINE, item.card.name):
+			item.img = decode_card_image(item.path, item.source_hash, self.config)
+		return item
+
+	def condition(self, item):
+		if self.pool:
+			item.output, item.report, recorded = self.pool.apply(condition_in_worker, (item.card, item.img, item.source_hash))
+			if recorded and timing.recorder:
+				timing.recorder.merge(recorded)
+		else:
+			item.output, item.report = condition_card(item.card, item.img, item.source_hash, self.config)
+		item.img = None
+
+		# --sweep wrote its variants already
+		if not item.output:
+			self.finish(item, item.report)
+			return None
+		return item
+
+	def write(self, item):
+		messages = []
+		if not self.compositor or self.config.card_files:
+			toSave = getOutputFileName(item.card, self.config)
+			with timing.stage("encode"):
+				item.output.save(fs_path(toSave))
+			if self.manifest:
+				self.manifest.record(toSave, item.inputs, item.source_hash)
+			message = "Saved {:s} - {:s} (cached@ {:s}) (set={:s}, id={:s})".format(item.card.name, toSave, item.path, getCardSetCode(item.card), getCardId(item.card))
+			if item.stale:
+				message += " ({:s} changed)".format(item.stale)
+			messages.append(message)
+		message = "\n".join(messages)
+		if self.compositor:
+			# cut out here, in parallel, and placed in deck order by run()
+			with timing.stage("compose"):
+				tile = self.compositor.cut(item.output)
+			self.placing[item.seq] = (item.card, tile, item.report)
+		elif item.report:
+			message += "\n" + item.report
+		self.finish(item, message)
+
+	# the log lines of a card that goes on the sheets once it is placed there
+	def place(self, seq, message):
+		card, tile, report = self.placing.pop(seq)
+		lines = [message] if message else []
+		try:
+			with timing.stage("compose"):
+				lines.append(self.compositor.place(card, tile))
+		except Exception as e:
+			lines.append(error_message(failed_message, card, e, seq))
+		if report:
+			lines.append(report)
+		return "\n".join(lines)
+
+	# the log line of each card (or name if resolving), in order
+	def run(self, entries):
+		config = self.config
+		size = config.in_flight_count
+		resolved, fetched, decoded, conditioned = [Queue.Queue(size) for _ in range(4)]
+		self.stage("fetch", self.fetch, config.fetch_workers or download_workers(config), resolved, fetched)
+		self.stage("decode", self.decode, config.decode_workers, fetched, decoded, timed = False)
+		self.stage("condition", self.condition, config.jobs_count if self.pool else 1, decoded, conditioned, timed = not self.pool)
+		self.stage("write", self.write, config.write_workers, conditioned, Queue.Queue())
+		resolver = threading.Thread(target = self.resolve_cards, args = (entries, resolved), name = "resolve")
+		resolver.daemon = True
+		resolver.start()
+		self.threads.append(resolver)
+
+		# put the lines back in deck order as the cards finish
+		done = {}
+		total = None
+		seq = 0
+		while total is None or seq < total:
+			finished, message = self.results.get()
+			if finished is None:
+				total = message
+				continue
+			done[finished] = message
+			while seq in done:
+				message = done.pop(seq)
+				if seq in self.placing:
+					message = self.place(seq, message)
+				seq += 1
+				if message:
+					yield message
+
+		# the end of the work is still on its way through the stages
+		for thread in self.threads:
+			thread.join()
+		if self.manifest:
+			self.manifest.save()
+
+# conditions the cards as a stream, on the pool if there is one (started with
+# start_pool for this config). the log lines come back in the order of the cards
+def condition_cards(cards, config, pool = None, overwrite = False):
+	return CardStream(config, pool, overwrite).run(cards)
+
+# keep the caches within their size limits
+def evict_caches(config):
+	if config.stages:
+		config.stages.evict()
+	if config.pixels:
+		config.pixels.evict()
+	config.image_cache.evict()
+
+# resolves, fetches and conditions the named cards as a stream, with the cards
+# conditioned in parallel when config.jobs asks for it, and yields the line to log
+# for each card. clear forgets the cached images of the cards first so they are
+# downloaded again
+def process_cards(card_names, config, clear = False):
+	config.prepare()
+	with recording(config):
+		count = len([card_name for card_name in card_names if card_name.strip()])
+		with conditioning_pool(config, count) as pool:
+			for message in CardStream(config, pool, resolve = True, clear = clear).run(card_names):
+				yield message
+
+# records the run for --metrics, --trace and --prometheus. the caches are trimmed
+# when the run is done and then what was recorded is written
+@contextlib.contextmanager
+def recording(config):
+	recorder = timing.Recorder() if config.instrumented else None
+	previous = timing.record(recorder) if recorder else None
+	try:
+		yield recorder
+	finally:
+		if recorder:
+			timing.record(previous)
+
+	evict_caches(config)
+	if recorder:
+		recorder.write(config.metrics, config.trace, config.prometheus)
+
+# a pool for conditioning count cards in parallel if config.jobs asks for it,
+# or None when they are conditioned in this process
+@contextlib.contextmanager
+def conditioning_pool(config, count):
+	pool = None
+	if config.jobs_count > 1 and count > 1:
+		pool = start_pool(config, min(config.jobs_count, count))
+	try:
+		yield pool
+	finally:
+		if pool:
+			pool.close()
+			pool.join()
+
+# process_cards for the lines of a deck list
+def process_decklist(lines, config, clear = False):
+	return process_cards(read_decklist(lines), config, clear)
@@ -0,0 +1,184 @@
+# use unicode literals
+from __future__ import unicode_literals
+
+# region profiles: where the credit and copyright lines of each set really are.
+# the handlers look for text in wide boxes because the lines move from set to set.
+# `PyMrox.py calibrate` runs the detection over a sample of the cached images of
+# each set and keeps the tight boxes the text turned up in, and every later card of
+# that set and frame handler is searched and inpainted only there
+import os
+import json
+
+from pymrox.cache import write_shared
+from pymrox.download import getCardId, cached_card_image
+from pymrox.conditioning import CONTOUR_MIN_AREA, region_contours, select_frame, fix_regions
+from pymrox.pipeline import decode_card_image
+
+# the profiles live next to the images they were calibrated from
+REGION_PROFILES_FILE = "regions.json"
+REGION_PROFILES_VERSION = 1
+
+# how many cards of each set and handler are looked at
+CALIBRATION_SAMPLES = 12
+# a region is only narrowed when text turned up in it on at least this many of them
+CALIBRATION_MIN_CARDS = 3
+# room left around the text that was found, in pixels
+CALIBRATION_PAD = 6
+
+# a box of a handler as it is written in the profiles, "y1,y2,x1,x2"
+def region_key(box):
+	return ",".join("{:d}".format(int(value)) for value in box)
+
+# the tight boxes of one set and handler, by the box of the handler each stands in for
+class RegionProfile(object):
+	def __init__(self, regions):
+		self.regions = regions
+
+	def region(self, box, detected):
+		return tuple(self.regions.get(region_key(box), box))
+
+	# what the stage cache keys on
+	def key(self):
+		return sorted(self.regions.items())
+
+# the calibrated profiles of every set, by set code and handler name
+class RegionProfiles(object):
+	def __init__(self, path):
+		self.path = path
+		try:
+			with open(path, "r") as f:
+				data = json.load(f)
+		except (IOError, ValueError):
+			data = {}
+		self.sets = data.get("sets", {}) if REGION_PROFILES_VERSION == data.get("version") else {}
+		self._profiles = {}
+
+	# the profile of the set for the handler, None if nothing was narrowed
+	def profile(self, set_code, handler):
+		key = (set_code.lower(), handler)
+		if key not in self._profiles:
+			entry = self.sets.get(key[0], {}).get(handler)
+			self._profiles[key] = RegionProfile(entry["regions"]) if entry and entry["regions"] else None
+		return self._profiles[key]
+
+	def update(self, set_code, handler, cards, regions):
+		self.sets.setdefault(set_code.lower(), {})[handler] = {"cards": cards, "regions": regions}
+		self._profiles.pop((set_code.lower(), handler), None)
+
+	def save(self):
+		write_shared(self.path, json.dumps({"version": REGION_PROFILES_VERSION, "sets": self.sets}, indent = 1, sort_keys = True).encode("utf-8"))
+
+def open_region_profiles(cache_dir):
+	return RegionProfiles(os.path.join(cache_dir, REGION_PROFILES_FILE))
+
+# stands in for a profile while calibrating: looks for text in each box of the
+# handler, notes where it is, and leaves the box as it is. the detected areas are
+# closed and dilated enough to run into the frame around the box, so only what is
+# inside it counts and a profile can only narrow a box down
+class RegionSampler(object):
+	def __init__(self):
+		self.found = {}
+
+	def region(self, box, detected):
+		import cv2
+		height, width = detected.shape
+		y1, y2, x1, x2 = min(box[0], height), min(box[1], height), min(box[2], width), min(box[3], width)
+
+		# the areas the handler would take as text
+		bounds = None
+		for c in region_contours(detected, y1, y2, x1, x2):
+			if cv2.contourArea(c) <= CONTOUR_MIN_AREA:
+				continue
+			x, y, w, h = cv2.boundingRect(c)
+			if bounds:
+				bounds = [min(bounds[0], y), max(bounds[1], y + h), min(bounds[2], x), max(bounds[3], x + w)]
+			else:
+				bounds = [y, y + h, x, x + w]
+
+		found = self.found.setdefault(region_key(box), [])
+		if bounds:
+			found.append(bounds)
+		return box
+
+	# the tight box of every region text turned up in often enough, with how much of
+	# the handler's box it keeps, and how many regions text turned up in often
+	# enough but all over (those are left as they are)
+	def regions(self):
+		regions = {}
+		kept = []
+		spread = 0
+		for key, found in self.found.items():
+			if len(found) < CALIBRATION_MIN_CARDS:
+				continue
+			box = [int(value) for value in key.split(",")]
+			tight = [max(min(bounds[0] for bounds in found) - CALIBRATION_PAD, box[0]), min(max(bounds[1] for bounds in found) + CALIBRATION_PAD, box[1]), max(min(bounds[2] for bounds in found) - CALIBRATION_PAD, box[2]), min(max(bounds[3] for bounds in found) + CALIBRATION_PAD, box[3])]
+			if tight == box:
+				spread += 1
+				continue
+			regions[key] = tight
+			kept.append(float((tight[1] - tight[0]) * (tight[3] - tight[2])) / ((box[1] - box[0]) * (box[3] - box[2])))
+		return regions, kept, spread
+
+# the cards spread evenly over the list
+def sample_cards(cards, count):
+	count = min(count, len(cards))
+	return [cards[ix * len(cards) // count] for ix in range(count)]
+
+# calibrates the sets (every set with cached images when none are given) from up to
+# samples of their cached images for each handler and stores the profiles. yields
+# the line to log for each set and handler
+def calibrate(config, set_codes = (), samples = CALIBRATION_SAMPLES):
+	profiles = open_region_profiles(config.cache_dir)
+	# the handlers run on their own boxes and change the card as a normal run does,
+	# so a region that is detected after another one was fixed (black background
+	# frames) sees the card the way it will then. --mask would leave it black
+	sample_config = config.copy(mask = False, debug = False, infill = False, reference = False, stage_cache = False)
+
+	calibrated = False
+	for code in set_codes or config.db.set_codes():
+		# the cached cards of the set by the handler they get
+		handlers = {}
+		order = []
+		for card in config.db.cards(code):
+			if not getCardId(card):
+				continue
+			cached = cached_card_image(card, config)
+			if not cached:
+				continue
+			operational_func, autocontrast = select_frame(card, config)[:2]
+			if operational_func.__name__ not in handlers:
+				handlers[operational_func.__name__] = []
+				order.append(operational_func)
+			handlers[operational_func.__name__].append((card, cached, autocontrast))
+		if not order:
+			if set_codes:
+				yield "[ERROR] no cached images of set {:s} to calibrate from".format(code)
+			continue
+
+		for operational_func in order:
+			sampler = RegionSampler()
+			picked = sample_cards(handlers[operational_func.__name__], samples)
+			for card, (path, sha1), autocontrast in picked:
+				try:
+					img = decode_card_image(path, sha1, sample_config)
+					fix_regions(card, img, sample_config, operational_func, autocontrast, profile = sampler)
+				except Exception as e:
+					yield "[ERROR] {:s}: {:s} | could not calibrate from {:s} (set={:s}, id={:s})".format(e.__class__.__name__, str(e), card.name, card.set.code, getCardId(card))
+			regions, kept, spread = sampler.regions()
+			profiles.update(code, operational_func.__name__, len(picked), regions)
+			calibrated = True
+			if regions:
+				message = "Calibrated {:s} {:s} from {:d} cards - {:d} of {:d} regions narrowed to {:.0f}% of their area".format(code, operational_func.__name__, len(picked), len(regions), len(sampler.found), 100.0 * sum(kept) / len(kept))
+				if spread:
+					message += ", text takes up all of {:d} more".format(spread)
+				yield message
+			elif spread:
+				yield "Calibrated {:s} {:s} from {:d} cards - text turned up in {:d} of {:d} regions but takes up all of them, its regions stay as they are".format(code, operational_func.__name__, len(picked), spread, len(sampler.found))
+			else:
+				yield "Calibrated {:s} {:s} from {:d} cards - no text turned up often enough, its regions stay as they are".format(code, operational_func.__name__, len(picked))
+	if calibrated:
+		profiles.save()
+	# without --sets only the sets with cached images are looked at, say so when
+	# that was none of them rather than nothing at all
+	elif not set_codes:
+		yield "[ERROR] no set has cached images from {:s} or imported ones to calibrate from, download or import some first".format(" or ".join(config.image_url_patterns))
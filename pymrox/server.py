@@ -0,0 +1,150 @@
+# use unicode literals
+from __future__ import unicode_literals
+
+# `PyMrox.py serve`: a long running process that takes card and deck list jobs
+import os
+import json
+import time
+import threading
+import BaseHTTPServer
+import SocketServer
+
+from pymrox import timing
+from pymrox.cache import fs_path
+from pymrox.pipeline import read_decklist, resolve_deck, condition_cards, evict_caches, getOutputFileName, start_pool
+
+# the card index, the banned tables and opencv stay loaded and the
+# cards are conditioned on a pool that lives as long as the server. the api is
+# json over http on a local port or a unix socket:
+#   POST /card {"name": "Sol Ring", "set": "M15", "format": "path" or "png"}
+#   POST /deck {"decklist": "1 Sol Ring\n4 Forest", "set": null, "overwrite": false}
+#   GET /status
+# a card job always reprocesses the card (like --single), a deck job only does
+# what is missing unless overwrite is set
+class JobServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	daemon_threads = True
+	allow_reuse_address = True
+
+class UnixJobServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+	daemon_threads = True
+
+class JobHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+	protocol_version = "HTTP/1.1"
+
+	def reply(self, status, body, content_type = "application/json"):
+		if "application/json" == content_type:
+			body = json.dumps(body)
+		self.send_response(status)
+		self.send_header("Content-Type", content_type)
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def do_GET(self):
+		if "/status" != self.path:
+			return self.reply(404, {"error": "unknown path " + self.path})
+		config = self.server.config
+		self.reply(200, {"output": config.output_dir, "jobs": config.jobs_count, "cards": self.server.cards, "uptime": time.time() - self.server.started})
+
+	def do_POST(self):
+		config = self.server.config
+		try:
+			request = json.loads(self.rfile.read(int(self.headers.getheader("content-length") or 0)) or "{}")
+			if not isinstance(request, dict):
+				raise ValueError("expected an object")
+		except ValueError as e:
+			return self.reply(400, {"error": "bad request: " + str(e)})
+
+		if "/card" == self.path:
+			self.card_job(request)
+		elif "/deck" == self.path:
+			self.deck_job(request)
+		else:
+			return self.reply(404, {"error": "unknown path " + self.path})
+		self.server.evict()
+
+		# the totals so far after every job, the trace is only written on the way out
+		if timing.recorder:
+			timing.recorder.write(config.metrics, prometheus = config.prometheus)
+
+	def card_job(self, request):
+		config = self.server.config
+		name = request.get("name") or ""
+		with self.server.lock:
+			cards, missing = resolve_deck([name], config, request.get("set"))
+		if not cards:
+			return self.reply(404, {"error": "card {:s} not found in available sets/cards".format(name)})
+		card = cards[0]
+		message = list(condition_cards(cards, config, self.server.pool, overwrite = True))[0]
+		self.server.cards += 1
+		if message.startswith("[ERROR]"):
+			return self.reply(500, {"name": card.name, "error": message})
+		if "png" == request.get("format"):
+			with open(fs_path(getOutputFileName(card, config)), "rb") as f:
+				return self.reply(200, f.read(), "image/png")
+		self.reply(200, {"name": card.name, "path": getOutputFileName(card, config), "log": message})
+
+	def deck_job(self, request):
+		config = self.server.config
+		card_names = read_decklist((request.get("decklist") or "").splitlines())
+		with self.server.lock:
+			cards, missing = resolve_deck(card_names, config, request.get("set"))
+		results = []
+		for card, message in zip(cards, condition_cards(cards, config, self.server.pool, overwrite = bool(request.get("overwrite")))):
+			results.append({"name": card.name, "path": getOutputFileName(card, config), "log": message, "error": message.startswith("[ERROR]")})
+		self.server.cards += len(cards)
+		self.reply(200, {"cards": results, "missing": missing})
+
+	def log_message(self, format, *args):
+		print "[serve] " + (format % args)
+
+# runs until interrupted. socket_path, when given, is used instead of host and port
+def serve(config, host = "127.0.0.1", port = 8377, socket_path = None):
+	config.prepare()
+	if socket_path:
+		if os.path.exists(socket_path):
+			os.remove(socket_path)
+		server = UnixJobServer(socket_path, JobHandler)
+		where = socket_path
+	else:
+		server = JobServer((host, port), JobHandler)
+		where = "http://{:s}:{:d}".format(host, port)
+
+	# load the card index and opencv before the workers are forked, once
+	config.db.get_set("BFZ")
+	import cv2
+
+	# --metrics, --trace and --prometheus cover everything the server does until it stops
+	recorder = timing.Recorder() if config.instrumented else None
+	timing.record(recorder)
+
+	server.config = config
+	server.pool = start_pool(config, config.jobs_count)
+	server.lock = threading.Lock()
+	server.cards = 0
+	server.started = time.time()
+
+	# trim the caches at most once a minute
+	evict_lock = threading.Lock()
+	evicted = [time.time()]
+	def evict():
+		with evict_lock:
+			if time.time() - evicted[0] >= 60:
+				evicted[0] = time.time()
+				evict_caches(config)
+	server.evict = evict
+
+	print "Serving {:s} with {:d} workers, writing to {:s}".format(where, config.jobs_count, config.output_dir)
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		server.pool.terminate()
+		server.pool.join()
+		if socket_path and os.path.exists(socket_path):
+			os.remove(socket_path)
+		if recorder:
+			timing.record(None)
+			recorder.write(config.metrics, config.trace, config.prometheus)
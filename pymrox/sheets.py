@@ -0,0 +1,228 @@
+# use unicode literals
+from __future__ import unicode_literals
+
+# --sheets: the finished cards tiled 3 x 3 onto print sheets as they come out of
+# the stream, either as a png for each sheet or as the pages of one pdf. only the
+# sheet being filled is held in memory and each sheet is written as soon as it is
+# full, so a 600 card order takes no more memory than a 9 card one
+import io
+import os
+import glob
+import threading
+from PIL import Image
+
+from pymrox import timing
+from pymrox.conditioning import RESIZE_TARGET
+from pymrox.download import getCardSetCode, getCardId
+from pymrox.pipeline import resolve_entry, CardStream, recording, conditioning_pool
+
+# the finished cards are a 2.5 x 3.5 inch card at 300 dpi with a bleed around it
+SHEET_CARD_DPI = 300
+SHEET_CARD_SIZE = 750, 1050
+
+# cards across and down each sheet
+SHEET_GRID = 3, 3
+
+# paper sizes in inches
+SHEET_SIZES = {
+	"letter": (8.5, 11.0),
+	"a4": (8.27, 11.69),
+	"legal": (8.5, 14.0),
+}
+
+# the pages of a pdf are jpegs this good, with full resolution color
+SHEET_JPEG_QUALITY = 95
+
+# the sheets as pngs in a directory, sheet-001.png and on
+class PngSheets(object):
+	def __init__(self, path):
+		self.path = path
+		self.count = 0
+		if not os.path.exists(path):
+			os.makedirs(path)
+		# the sheets of the last run would be mixed in with these
+		for old in glob.glob(path + "/sheet-*.png"):
+			os.remove(old)
+
+	def add(self, sheet, dpi):
+		self.count += 1
+		sheet.save("{:s}/sheet-{:03d}.png".format(self.path, self.count), dpi = (dpi, dpi))
+
+	def close(self):
+		pass
+
+# the sheets as the pages of a pdf, written a page at a time. the page tree has to
+# list every page so it is the last object written (it is numbered 2, the catalog
+# that points at it is 1). the pdf is only moved in place once it is complete
+class PdfSheets(object):
+	def __init__(self, path):
+		self.path = path
+		self.tmp_path = path + ".tmp"
+		directory = os.path.dirname(os.path.abspath(path))
+		if not os.path.exists(directory):
+			os.makedirs(directory)
+		self.file = open(self.tmp_path, "wb")
+		self.file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+		self.offsets = []
+		self.pages = []
+		self.write_object("<< /Type /Catalog /Pages 2 0 R >>")
+		self.offsets.append(None)
+
+	# writes the next object and returns its number
+	def write_object(self, body, stream = None):
+		self.offsets.append(self.file.tell())
+		return self.write_body(len(self.offsets), body, stream)
+
+	def write_body(self, number, body, stream = None):
+		self.file.write("{:d} 0 obj\n{:s}\n".format(number, body).encode("ascii"))
+		if stream is not None:
+			self.file.write(b"stream\n")
+			self.file.write(stream)
+			self.file.write(b"\nendstream\n")
+		self.file.write(b"endobj\n")
+		return number
+
+	def add(self, sheet, dpi):
+		buf = io.BytesIO()
+		sheet.save(buf, "JPEG", quality = SHEET_JPEG_QUALITY, subsampling = 0, dpi = (dpi, dpi))
+		data = buf.getvalue()
+
+		width, height = sheet.size
+		points = width * 72.0 / dpi, height * 72.0 / dpi
+		image = self.write_object("<< /Type /XObject /Subtype /Image /Width {:d} /Height {:d} /ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /DCTDecode /Length {:d} >>".format(width, height, len(data)), data)
+		content = "q {:.2f} 0 0 {:.2f} 0 0 cm /Sheet Do Q".format(points[0], points[1]).encode("ascii")
+		contents = self.write_object("<< /Length {:d} >>".format(len(content)), content)
+		self.pages.append(self.write_object("<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {:.2f} {:.2f}] /Resources << /XObject << /Sheet {:d} 0 R >> >> /Contents {:d} 0 R >>".format(points[0], points[1], image, contents)))
+
+	def close(self):
+		self.offsets[1] = self.file.tell()
+		self.write_body(2, "<< /Type /Pages /Kids [{:s}] /Count {:d} >>".format(" ".join("{:d} 0 R".format(page) for page in self.pages), len(self.pages)))
+
+		xref = self.file.tell()
+		lines = ["xref", "0 {:d}".format(len(self.offsets) + 1), "0000000000 65535 f "]
+		lines.extend("{:010d} 00000 n ".format(offset) for offset in self.offsets)
+		lines.append("trailer\n<< /Size {:d} /Root 1 0 R >>\nstartxref\n{:d}\n%%EOF\n".format(len(self.offsets) + 1, xref))
+		self.file.write("\n".join(lines).encode("ascii"))
+		self.file.close()
+		os.rename(self.tmp_path, self.path)
+
+# where the cards go on a sheet for the config: (sheet size, the part of a finished
+# card that is kept, the size it is drawn at, the top left of each spot on the
+# sheet). a ValueError says why the cards do not fit
+def sheet_layout(config):
+	if config.sheet_size not in SHEET_SIZES:
+		raise ValueError("unknown sheet size {:s}, use one of {:s}".format(config.sheet_size, ", ".join(sorted(SHEET_SIZES))))
+	bleed = (RESIZE_TARGET[0] - SHEET_CARD_SIZE[0]) // 2, (RESIZE_TARGET[1] - SHEET_CARD_SIZE[1]) // 2
+	if config.cut_margin < 0 or config.cut_margin > min(bleed):
+		raise ValueError("--cut-margin has to be between 0 and {:d}".format(min(bleed)))
+
+	# the card and as much of its border as the cut margin asks for
+	margin = config.cut_margin
+	crop = (bleed[0] - margin, bleed[1] - margin, RESIZE_TARGET[0] - bleed[0] + margin, RESIZE_TARGET[1] - bleed[1] + margin)
+
+	dpi = config.sheet_dpi
+	scale = float(dpi) / SHEET_CARD_DPI
+	tile = int(round((crop[2] - crop[0]) * scale)), int(round((crop[3] - crop[1]) * scale))
+	inches = SHEET_SIZES[config.sheet_size]
+	size = int(round(inches[0] * dpi)), int(round(inches[1] * dpi))
+	if tile[0] * SHEET_GRID[0] > size[0] or tile[1] * SHEET_GRID[1] > size[1]:
+		raise ValueError("{:d} x {:d} cards with a {:d} pixel cut margin do not fit on a {:s} sheet".format(SHEET_GRID[0], SHEET_GRID[1], margin, config.sheet_size))
+
+	# the grid in the middle of the sheet
+	left = (size[0] - tile[0] * SHEET_GRID[0]) // 2
+	top = (size[1] - tile[1] * SHEET_GRID[1]) // 2
+	spots = [(left + col * tile[0], top + row * tile[1]) for row in range(SHEET_GRID[1]) for col in range(SHEET_GRID[0])]
+	return size, crop, tile, spots
+
+# places every copy of each card on the sheet being filled in the order of the
+# cards, and writes each sheet once it is full. the tile of a card is cut out by
+# the write thread that finished it, the stream places the tiles in order.
+# quantities has how many copies of each card (by name) go on the sheets
+class SheetCompositor(object):
+	def __init__(self, config, quantities):
+		self.quantities = quantities
+		self.dpi = config.sheet_dpi
+		self.size, self.crop, self.tile, self.spots = sheet_layout(config)
+		self.path = config.sheets
+		self.writer = PdfSheets(config.sheets) if config.sheets.lower().endswith(".pdf") else PngSheets(config.sheets)
+		self.lock = threading.Lock()
+		self.sheet = None
+		self.spot = 0
+		self.sheets = 0
+		self.cards = 0
+
+	# the finished card as it is drawn on the sheets
+	def cut(self, img):
+		tile = img.crop(self.crop)
+		if tile.size != self.tile:
+			tile = tile.resize(self.tile, Image.ANTIALIAS)
+		return tile
+
+	# returns the line to log for the card
+	def place(self, card, tile):
+		count = self.quantities.get(card.name, 1)
+		with self.lock:
+			first = last = self.sheets + 1
+			for _ in range(count):
+				if not self.sheet:
+					self.sheet = Image.new("RGB", self.size, (255, 255, 255))
+				self.sheet.paste(tile, self.spots[self.spot])
+				self.spot += 1
+				self.cards += 1
+				last = self.sheets + 1
+				if self.spot == len(self.spots):
+					self.flush()
+		where = "sheet {:d}".format(first) if first == last else "sheets {:d}-{:d}".format(first, last)
+		return "Placed {:d} x {:s} on {:s} (set={:s}, id={:s})".format(count, card.name, where, getCardSetCode(card), getCardId(card))
+
+	def flush(self):
+		if self.sheet:
+			with timing.stage("sheet_write"):
+				self.writer.add(self.sheet, self.dpi)
+			self.sheet = None
+			self.spot = 0
+			self.sheets += 1
+
+	# writes the last sheet, even if it is not full. returns the line to log
+	def close(self):
+		with self.lock:
+			self.flush()
+			self.writer.close()
+		return "Sheets - {:d} cards on {:d} sheets @ {:s}".format(self.cards, self.sheets, self.path)
+
+# resolves the (card name, quantity) entries, then conditions each card once and
+# puts all of its copies on the sheets. yields the line to log for each card and
+# then one for the sheets. clear forgets the cached images of the cards first so
+# they are downloaded again
+def process_sheets(entries, config, clear = False):
+	config.prepare()
+	with recording(config):
+		# the copies of a card add up, however its name was written
+		cards = []
+		quantities = {}
+		for card_name, quantity in entries:
+			if not card_name.strip():
+				continue
+			card, messages = resolve_entry(card_name, config)
+			for message in messages:
+				yield message
+			if not card:
+				continue
+			if card.name in quantities:
+				quantities[card.name] += quantity
+			else:
+				quantities[card.name] = quantity
+				cards.append(card)
+
+		# forget the cached images so they are downloaded again
+		if clear:
+			for card in cards:
+				config.image_cache.forget(getCardSetCode(card), getCardId(card))
+
+		# every card is conditioned for the sheets, the stage cache keeps that quick
+		# for cards that were done before
+		compositor = SheetCompositor(config, quantities)
+		with conditioning_pool(config, len(cards)) as pool:
+			for message in CardStream(config, pool, overwrite = True, compositor = compositor).run(cards):
+				yield message
+		yield compositor.close()
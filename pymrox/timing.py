@@ -0,0 +1,295 @@
+# use unicode literals
+from __future__ import unicode_literals
+
+# timing and counters. the steps are marked in the code with
+#   with timing.stage("mask"):
+# or the timed("mask") decorator, and things worth counting with
+#   timing.count("image_cache_hits")
+# all of which cost next to nothing unless a recorder has been installed with
+# record(). the benchmark installs a StageTimes, --metrics, --trace and
+# --prometheus install a Recorder
+import os
+import json
+import time
+import threading
+import functools
+
+from pymrox.cache import write_shared
+
+try:
+	import resource
+except ImportError:
+	resource = None
+
+# RUSAGE_THREAD is linux only and python 2 does not name it
+RUSAGE_THREAD = 1
+if resource:
+	try:
+		resource.getrusage(RUSAGE_THREAD)
+	except (ValueError, resource.error):
+		resource = None
+
+# the installed recorder, None when nothing is being timed
+recorder = None
+
+# the card the thread is working on, so the steps inside a stage are put down to it
+local = threading.local()
+
+# the stages a card goes through in the pipeline, its time is the sum of these
+# (the steps inside them are counted in their stage already)
+PIPELINE = "pipeline"
+
+# a long running server keeps at most this many events for its trace
+TRACE_EVENT_LIMIT = 1000000
+
+# cpu time of the calling thread, or of the whole process where that is all there is
+def thread_cpu_time():
+	if resource:
+		usage = resource.getrusage(RUSAGE_THREAD)
+		return usage.ru_utime + usage.ru_stime
+	return time.clock()
+
+# seconds spent in each step, summed over however many times it ran
+class StageTimes(object):
+	def __init__(self):
+		self.seconds = {}
+		self.calls = {}
+
+	def add(self, name, seconds, cpu = 0.0, start = 0.0, card = None, category = None):
+		self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+		self.calls[name] = self.calls.get(name, 0) + 1
+
+	def count(self, name, amount = 1):
+		pass
+
+	def note(self, card, key, value):
+		pass
+
+# everything about a run: every stage as an event with its wall and cpu time, the
+# card it was for and the thread it ran on, the counters and notes about the cards.
+# worker processes record into one of their own and hand it over with drain()
+class Recorder(StageTimes):
+	def __init__(self):
+		self.started = time.time()
+		self.lock = threading.Lock()
+		self.reset()
+
+	def reset(self):
+		StageTimes.__init__(self)
+		self.events = []
+		self.dropped = 0
+		self.stages = {}
+		self.cards = {}
+		self.counters = {}
+		self.notes = {}
+		self.threads = {}
+
+	def add(self, name, seconds, cpu = 0.0, start = 0.0, card = None, category = None):
+		thread = threading.current_thread()
+		with self.lock:
+			self.add_event((name, category, card, start, seconds, cpu, os.getpid(), thread.ident))
+			self.threads[(os.getpid(), thread.ident)] = thread.name
+
+	# totals are kept as the events come in, the trace only keeps the first TRACE_EVENT_LIMIT
+	def add_event(self, event):
+		name, category, card, start, wall, cpu, pid, tid = event
+		StageTimes.add(self, name, wall)
+		stage = self.stages.setdefault(name, {"category": category, "calls": 0, "wall": 0.0, "cpu": 0.0})
+		stage["calls"] += 1
+		stage["wall"] += wall
+		stage["cpu"] += cpu
+		if card is not None:
+			entry = self.cards.setdefault(card, {"wall": 0.0, "cpu": 0.0, "stages": {}})
+			card_stage = entry["stages"].setdefault(name, {"wall": 0.0, "cpu": 0.0})
+			card_stage["wall"] += wall
+			card_stage["cpu"] += cpu
+			if PIPELINE == category:
+				entry["wall"] += wall
+				entry["cpu"] += cpu
+		if len(self.events) < TRACE_EVENT_LIMIT:
+			self.events.append(event)
+		else:
+			self.dropped += 1
+
+	def count(self, name, amount = 1):
+		with self.lock:
+			self.counters[name] = self.counters.get(name, 0) + amount
+
+	def note(self, card, key, value):
+		with self.lock:
+			self.notes.setdefault(card, {})[key] = value
+
+	# what has been recorded since the last drain, to be merged into another recorder
+	def drain(self):
+		with self.lock:
+			data = {"events": self.events, "counters": self.counters, "notes": self.notes, "threads": self.threads}
+			self.reset()
+		return data
+
+	def merge(self, data):
+		with self.lock:
+			for event in data["events"]:
+				self.add_event(event)
+			for name, amount in data["counters"].items():
+				self.counters[name] = self.counters.get(name, 0) + amount
+			for card, notes in data["notes"].items():
+				self.notes.setdefault(card, {}).update(notes)
+			self.threads.update(data["threads"])
+
+	# totals per stage, per card and per handler along with the counters
+	def summary(self):
+		with self.lock:
+			stages = json.loads(json.dumps(self.stages))
+			cards = json.loads(json.dumps(self.cards))
+			counters = dict(self.counters)
+			notes = json.loads(json.dumps(self.notes))
+
+		handlers = {}
+		for card, card_notes in notes.items():
+			cards.setdefault(card, {"wall": 0.0, "cpu": 0.0, "stages": {}}).update(card_notes)
+			if "handler" in card_notes:
+				handlers[card_notes["handler"]] = handlers.get(card_notes["handler"], 0) + 1
+
+		download = stages.get("download", {"calls": 0, "wall": 0.0})
+		return {
+			"started": self.started,
+			"elapsed": time.time() - self.started,
+			"stages": stages,
+			"cards": cards,
+			"handlers": handlers,
+			"counters": counters,
+			"downloads": {
+				"requests": download["calls"],
+				"seconds": download["wall"],
+				"mean_latency": download["wall"] / download["calls"] if download["calls"] else 0.0,
+				"bytes": counters.get("download_bytes", 0),
+				"fallbacks": counters.get("download_fallbacks", 0),
+				"failures": counters.get("download_failures", 0),
+			},
+			"dropped_events": self.dropped,
+		}
+
+	# the events in the chrome trace format (chrome://tracing or ui.perfetto.dev),
+	# one row per thread of each process
+	def chrome_trace(self):
+		with self.lock:
+			events = list(self.events)
+			threads = dict(self.threads)
+		trace = []
+		for pid in set(pid for pid, tid in threads):
+			trace.append({"name": "process_name", "ph": "M", "pid": pid, "args": {"name": "pymrox" if pid == os.getpid() else "pymrox worker"}})
+		for (pid, tid), name in threads.items():
+			trace.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}})
+		for name, category, card, start, wall, cpu, pid, tid in events:
+			args = {"cpu_ms": round(cpu * 1000, 3)}
+			if card is not None:
+				args["card"] = card
+			trace.append({"name": name, "cat": category or "step", "ph": "X", "ts": int((start - self.started) * 1000000), "dur": int(wall * 1000000), "pid": pid, "tid": tid, "args": args})
+		return {"traceEvents": trace, "displayTimeUnit": "ms"}
+
+	# the totals in the prometheus text format, for the node exporter's textfile collector
+	def prometheus(self):
+		summary = self.summary()
+		lines = []
+
+		def metric(name, kind, description, samples):
+			lines.append("# HELP pymrox_{:s} {:s}".format(name, description))
+			lines.append("# TYPE pymrox_{:s} {:s}".format(name, kind))
+			for labels, value in samples:
+				label_text = ",".join('{:s}="{:s}"'.format(key, prometheus_label(label)) for key, label in labels)
+				lines.append("pymrox_{:s}{:s} {:s}".format(name, "{" + label_text + "}" if label_text else "", repr(float(value))))
+
+		stages = sorted(summary["stages"].items())
+		metric("stage_seconds_total", "counter", "Wall time spent in each stage.", [([("stage", name)], stage["wall"]) for name, stage in stages])
+		metric("stage_cpu_seconds_total", "counter", "CPU time spent in each stage.", [([("stage", name)], stage["cpu"]) for name, stage in stages])
+		metric("stage_calls_total", "counter", "Times each stage ran.", [([("stage", name)], stage["calls"]) for name, stage in stages])
+		metric("cards_total", "counter", "Cards conditioned by each frame handler.", [([("handler", name)], count) for name, count in sorted(summary["handlers"].items())])
+		for name, value in sorted(summary["counters"].items()):
+			metric(name + "_total", "counter", "The {:s} counter.".format(name.replace("_", " ")), [([], value)])
+		metric("run_seconds", "gauge", "How long the run has been going.", [([], summary["elapsed"])])
+		metric("last_run_timestamp_seconds", "gauge", "When the run started.", [([], summary["started"])])
+		return "\n".join(lines) + "\n"
+
+	# writes whichever of the summary, the trace and the prometheus metrics have a path
+	def write(self, metrics = None, trace = None, prometheus = None):
+		if metrics:
+			write_report(metrics, json.dumps(self.summary(), indent = 2, sort_keys = True))
+		if trace:
+			write_report(trace, json.dumps(self.chrome_trace()))
+		if prometheus:
+			write_report(prometheus, self.prometheus())
+
+# the node exporter usually runs as a user of its own
+def write_report(path, text):
+	write_shared(os.path.abspath(path), text.encode("utf-8"))
+
+def prometheus_label(value):
+	return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+# installs a recorder (or removes it with None) and returns the one it replaced
+def record(new_recorder):
+	global recorder
+	previous = recorder
+	recorder = new_recorder
+	return previous
+
+class Stage(object):
+	__slots__ = ("name", "category", "card", "recorder", "previous", "start", "cpu")
+
+	def __init__(self, name, category, card, recorder):
+		self.name = name
+		self.category = category
+		self.card = card
+		self.recorder = recorder
+
+	def __enter__(self):
+		# steps inside this stage are for its card
+		self.previous = getattr(local, "card", None)
+		if self.card is None:
+			self.card = self.previous
+		local.card = self.card
+		self.start = time.time()
+		self.cpu = thread_cpu_time()
+		return self
+
+	def __exit__(self, *exc_info):
+		self.recorder.add(self.name, time.time() - self.start, thread_cpu_time() - self.cpu, self.start, self.card, self.category)
+		local.card = self.previous
+
+# what stage() hands out when nothing is recording
+class NullStage(object):
+	__slots__ = ()
+
+	def __enter__(self):
+		pass
+
+	def __exit__(self, *exc_info):
+		pass
+
+NULL_STAGE = NullStage()
+
+# a step (or with category PIPELINE, a stage of the pipeline) for the card, or for
+# the card of the stage it is in
+def stage(name, category = None, card = None):
+	if recorder is None:
+		return NULL_STAGE
+	return Stage(name, category, card, recorder)
+
+# times every call of the function as the named step
+def timed(name):
+	def decorate(func):
+		@functools.wraps(func)
+		def wrapper(*args, **kwargs):
+			with stage(name):
+				return func(*args, **kwargs)
+		return wrapper
+	return decorate
+
+def count(name, amount = 1):
+	if recorder is not None:
+		recorder.count(name, amount)
+
+# something about the card, like the frame handler it got
+def note(card, key, value):
+	if recorder is not None:
+		recorder.note(card, key, value)
@@ -0,0 +1,69 @@
+# use unicode literals
+from __future__ import unicode_literals
+
+# many decks in one run on the benchmark fixtures
+import io
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from pymrox.batch import BATCH_MANIFEST, process_batch, render_dir
+from pymrox.bench import fixture_card, prepare_fixtures
+
+class BatchTest(unittest.TestCase):
+	def setUp(self):
+		self.workdir = tempfile.mkdtemp(prefix = "pymrox-test-")
+		self.config = prepare_fixtures(self.workdir, 3, 1)
+		self.left, self.centered, self.paintbrush = [fixture_card(n)[5] for n in range(3)]
+
+	def tearDown(self):
+		self.config.close()
+		shutil.rmtree(self.workdir, ignore_errors = True)
+
+	# the lines of a run on the named decks, each given as its lines
+	def run_batch(self, decks):
+		specs = []
+		for name, lines in sorted(decks.items()):
+			path = "{:s}/{:s}.txt".format(self.workdir, name)
+			with io.open(path, "w", encoding = "utf-8") as f:
+				f.write("\n".join(lines) + "\n")
+			specs.append((path, self.deck_dir(name)))
+		return list(process_batch(specs, self.config))
+
+	def deck_dir(self, name):
+		return "{:s}/decks/{:s}".format(self.workdir, name)
+
+	# {name: quantity} of the deck's manifest
+	def quantities(self, name):
+		with open(self.deck_dir(name) + "/" + BATCH_MANIFEST, "r") as f:
+			return dict((entry["name"], entry["quantity"]) for entry in json.load(f)["cards"])
+
+	def test_shared_printing(self):
+		lines = self.run_batch({
+			"one": ["2 " + self.left, "1 " + self.centered, "1 " + self.left.lower()],
+			"two": ["4 " + self.left, "1 " + self.paintbrush],
+		})
+		# conditioned once for both decks
+		self.assertEqual(1, len([line for line in lines if line.startswith("Saved " + self.left + " ")]))
+		self.assertFalse([line for line in lines if line.startswith("[ERROR]")], lines)
+
+		# and the same file in both of them
+		rendered = render_dir(self.config) + "/" + self.left + ".png"
+		for name in ["one", "two"]:
+			self.assertTrue(os.path.samefile(rendered, self.deck_dir(name) + "/" + self.left + ".png"))
+		self.assertEqual(3, os.stat(rendered).st_nlink)
+
+		self.assertEqual({self.left: 3, self.centered: 1}, self.quantities("one"))
+		self.assertEqual({self.left: 4, self.paintbrush: 1}, self.quantities("two"))
+
+	def test_dropped_cards_removed(self):
+		self.run_batch({"one": ["1 " + self.left, "1 " + self.centered]})
+		self.assertTrue(os.path.isfile(self.deck_dir("one") + "/" + self.centered + ".png"))
+		self.run_batch({"one": ["2 " + self.left]})
+		self.assertEqual([self.left + ".png"], sorted(name for name in os.listdir(self.deck_dir("one")) if name.endswith(".png")))
+		self.assertEqual({self.left: 2}, self.quantities("one"))
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,62 @@
+# use unicode literals
+from __future__ import unicode_literals
+
+# the border and the final resize done in one resample, over the --border values
+# a deck could be run with
+import unittest
+import numpy as np
+from PIL import Image, ImageOps
+
+from pymrox.conditioning import RESIZE_TARGET, REFERENCE_SIZE, VERIFY_SEAM, border_layout, resize_with_border
+
+# the borders that are tried, in pixels
+BORDERS = range(0, 121)
+
+# every how many borders the output is compared with the reference path
+REFERENCE_STEP = 8
+
+# the border colour, something the card never is
+FILL_BORDER = (0, 0, 255)
+
+# a card with a gradient so the sampling grid shows
+def fixture_card_image(size):
+	x = np.linspace(0, 255, size[0]).astype(np.uint8)
+	y = np.linspace(0, 255, size[1]).astype(np.uint8)
+	buf = np.zeros((size[1], size[0], 3), np.uint8)
+	buf[..., 0] = x[np.newaxis, :]
+	buf[..., 1] = y[:, np.newaxis]
+	return Image.fromarray(buf)
+
+class BorderTest(unittest.TestCase):
+	def check_borders(self, size):
+		img = fixture_card_image(size)
+		for border in BORDERS:
+			output = resize_with_border(img, border, FILL_BORDER)
+			self.assertEqual(RESIZE_TARGET, output.size)
+
+			# the card box is on the canvas and has the border all around it
+			left, top, right, bottom = border_layout(size, border)[2]
+			self.assertTrue(0 <= left < right <= RESIZE_TARGET[0] and 0 <= top < bottom <= RESIZE_TARGET[1], (border, left, top, right, bottom))
+			buf = np.asarray(output)
+			if left:
+				self.assertEqual(FILL_BORDER, tuple(buf[RESIZE_TARGET[1] // 2, left - 1]), border)
+
+			# and it matches expanding and then resizing away from the seam, like
+			# --verify checks it (on some of the borders, the reference is slow)
+			if border % REFERENCE_STEP:
+				continue
+			reference = np.asarray(ImageOps.expand(img, border = border, fill = FILL_BORDER).resize(RESIZE_TARGET, Image.ANTIALIAS))
+			diff = np.abs(buf.astype(np.int16) - reference).max(axis = 2)
+			seam = np.zeros(diff.shape, bool)
+			seam[max(top - VERIFY_SEAM, 0):bottom + VERIFY_SEAM, max(left - VERIFY_SEAM, 0):right + VERIFY_SEAM] = True
+			seam[top + VERIFY_SEAM:bottom - VERIFY_SEAM, left + VERIFY_SEAM:right - VERIFY_SEAM] = False
+			self.assertLessEqual(int(diff[~seam].max()), 2, border)
+
+	def test_reference_size(self):
+		self.check_borders(REFERENCE_SIZE)
+
+	def test_other_size(self):
+		self.check_borders((700, 983))
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,144 @@
+# use unicode literals
+from __future__ import unicode_literals
+
+# looking cards up in the card index of a small AllSets, against the way the
+# single file PyMrox.py picked the printing of a card
+import json
+import shutil
+import zipfile
+import tempfile
+import unittest
+
+from pymrox.carddb import BANNED_SETS, BANNED_CARDS
+from pymrox.config import Config
+from pymrox.pipeline import find_card
+
+# sets from the ban lists and not, oldest first
+CARDDB_SETS = [
+	("LEA", "1993-08-05"),
+	("4ED", "1995-04-01"),
+	("WTH", "1997-06-09"),
+	("PLC", "2007-02-02"),
+	("M10", "2009-07-17"),
+	("M15", "2014-07-18"),
+]
+
+# the printings of each card by set
+CARDDB_CARDS = {
+	"LEA": [
+		{"name": "Serra Angel", "number": "1", "border": "black"},
+	],
+	"4ED": [
+		{"name": "Serra Angel", "number": "40", "border": "white"},
+	],
+	"WTH": [
+		# on the ban list of the set
+		{"name": "Aura of Silence", "number": "1", "border": "black"},
+		{"name": "White First", "number": "3", "border": "white"},
+		# nothing to fetch its image by
+		{"name": "No Number", "border": "black"},
+		{"name": "Never Numbered", "border": "black"},
+		{"name": "Mci Only", "mciNumber": "7", "border": "black"},
+	],
+	"PLC": [
+		{"name": "Timely Card", "number": "1", "border": "black", "timeshifted": True},
+		{"name": "Only Timeshifted", "number": "2", "border": "black", "timeshifted": True},
+	],
+	"M10": [
+		{"name": "Serra Angel", "number": "20", "border": "black"},
+		{"name": "White First", "number": "4", "border": "black"},
+	],
+	"M15": [
+		{"name": "Serra Angel", "number": "30", "border": "black"},
+		{"name": "Aura of Silence", "number": "5", "border": "black"},
+		{"name": "Timely Card", "number": "2", "border": "black"},
+		{"name": "No Number", "number": "6", "border": "black"},
+	],
+}
+
+CARDDB_NAMES = ["Serra Angel", "Aura of Silence", "White First", "No Number", "Never Numbered", "Mci Only", "Timely Card", "Only Timeshifted", "Nowhere"]
+
+def fixture_all_sets():
+	return dict((code, {"name": code, "code": code, "releaseDate": date, "cards": CARDDB_CARDS[code]}) for code, date in CARDDB_SETS)
+
+# the set of the printing handle_card in PyMrox.py picked, on the json of the sets
+def baseline_set(all_sets, card_name, force_set = None, bless = ()):
+	banned_sets = BANNED_SETS - set(code.lower() for code in bless)
+	available_sets = [code for code, date in CARDDB_SETS]
+	if force_set:
+		available_sets = [force_set.upper()]
+
+	card = None
+	for code in available_sets:
+		if code.lower() in banned_sets:
+			continue
+		found = [c for c in all_sets[code]["cards"] if c["name"] == card_name]
+		cardCheck = dict(found[-1], set = code) if found else None
+		if cardCheck and cardCheck["name"] in BANNED_CARDS.get(code.lower(), []):
+			continue
+		number = cardCheck and (cardCheck.get("number") or cardCheck.get("mciNumber"))
+		if not card and number:
+			card = cardCheck
+		if cardCheck and cardCheck.get("timeshifted"):
+			continue
+		if number and "black" == card.get("border"):
+			card = cardCheck
+			break
+	return card["set"] if card else None
+
+class CardIndexTest(unittest.TestCase):
+	def setUp(self):
+		self.workdir = tempfile.mkdtemp(prefix = "pymrox-test-")
+		self.config = Config(self.workdir)
+		self.config.prepare()
+		with zipfile.ZipFile(self.config.json_dir + "/AllSets.json.zip", "w") as zip_ref:
+			zip_ref.writestr("AllSets.json", json.dumps(fixture_all_sets()))
+
+	def tearDown(self):
+		self.config.close()
+		shutil.rmtree(self.workdir, ignore_errors = True)
+
+	# the set code of the printing picked for the name, None when there is none
+	def find_set(self, card_name, **options):
+		card = find_card(card_name, self.config.copy(**options))
+		return card.set.code if card else None
+
+	def test_banned_sets_and_cards(self):
+		self.assertEqual(["M10", "M15"], [card.set.code for card in self.config.db.find_printings("Serra Angel")])
+		self.assertEqual(["M15"], [card.set.code for card in self.config.db.find_printings("Aura of Silence")])
+		self.assertEqual(None, self.find_set("Aura of Silence", force_set = "WTH"))
+
+	def test_cards_without_number(self):
+		self.assertEqual("M15", self.find_set("No Number"))
+		self.assertEqual(None, self.find_set("Never Numbered"))
+		self.assertEqual("WTH", self.find_set("Mci Only"))
+
+	# blessing a set or forcing one is applied to the printings there are, the
+	# printings table is not built again for it
+	def test_bless_and_force_set_without_rebuild(self):
+		self.assertEqual("M10", self.find_set("Serra Angel"))
+		built = []
+		build_printings = self.config.db.build_printings
+		self.config.db.build_printings = lambda: built.append(True) or build_printings()
+		self.assertEqual("LEA", self.find_set("Serra Angel", bless = ["LEA"]))
+		self.assertEqual("M15", self.find_set("Serra Angel", force_set = "m15"))
+		self.assertEqual(None, self.find_set("Serra Angel", force_set = "4ED"))
+		self.assertEqual("4ED", self.find_set("Serra Angel", force_set = "4ED", bless = ["4ed"]))
+		self.assertEqual([], built)
+
+	def test_preferred_printing(self):
+		# the oldest one that is not timeshifted
+		self.assertEqual("M15", self.find_set("Timely Card"))
+		# but a timeshifted one is better than none
+		self.assertEqual("PLC", self.find_set("Only Timeshifted"))
+		# the first printing is kept when it is not black bordered
+		self.assertEqual("WTH", self.find_set("White First"))
+
+	def test_same_as_baseline(self):
+		all_sets = fixture_all_sets()
+		for options in [{}, {"bless": ["LEA"]}, {"bless": ["4ED"]}, {"force_set": "WTH"}, {"force_set": "M15"}, {"force_set": "4ED", "bless": ["4ED"]}]:
+			for card_name in CARDDB_NAMES:
+				self.assertEqual(baseline_set(all_sets, card_name, options.get("force_set"), options.get("bless", ())), self.find_set(card_name, **options), "{:s} {!r}".format(card_name, options))
+
+if __name__ == "__main__":
+	unittest.main()
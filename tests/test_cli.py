@@ -0,0 +1,70 @@
+# use unicode literals
+from __future__ import unicode_literals
+
+# deck lists read from disk by the command line
+import os
+import io
+import sys
+import json
+import shutil
+import zipfile
+import tempfile
+import unittest
+import StringIO
+
+from pymrox import cli
+from pymrox.cache import ImageCache
+from pymrox.bench import BENCH_URL_PATTERN, fixture_sets, fixture_image
+
+# a card whose name has an accent and a split card, in the sets select_frame looks at
+CLI_CARDS = [
+	{"name": "J\u00f6tun Grunt", "number": "1", "layout": "normal", "colorIdentity": ["W"]},
+	{"name": "Fire", "names": ["Fire", "Ice"], "number": "2a", "layout": "split", "colorIdentity": ["R", "U"]},
+	{"name": "Ice", "names": ["Fire", "Ice"], "number": "2b", "layout": "split", "colorIdentity": ["R", "U"]},
+]
+
+class DecklistTest(unittest.TestCase):
+	def setUp(self):
+		self.workdir = tempfile.mkdtemp(prefix = "pymrox-test-")
+		self.output_dir = self.workdir + "/out"
+		# the card data is where it would have been downloaded to
+		os.makedirs(self.output_dir + "/.json")
+		with zipfile.ZipFile(self.output_dir + "/.json/AllSets.json.zip", "w") as zip_ref:
+			all_sets = fixture_sets(0)
+			all_sets["APC"]["cards"] = CLI_CARDS
+			zip_ref.writestr("AllSets.json", json.dumps(all_sets))
+		# and the images are in the cache so nothing is downloaded
+		image_cache = ImageCache(self.workdir + "/images", 1 << 30)
+		for n, card in enumerate(CLI_CARDS[:2]):
+			image_cache.put(BENCH_URL_PATTERN.format("apc", card["number"]), "apc", card["number"], fixture_image(n))
+		image_cache.close()
+
+	def tearDown(self):
+		# as bytes, under a C locale the accented card names are utf-8 bytes on disk
+		shutil.rmtree(self.workdir.encode("utf-8"), ignore_errors = True)
+
+	# the lines main() prints for the deck list
+	def run_deck(self, lines):
+		deck = self.workdir + "/deck.txt"
+		with io.open(deck, "w", encoding = "utf-8") as f:
+			f.write("\n".join(lines) + "\n")
+		argv = [deck, self.output_dir, "--cache-dir", self.workdir + "/images", "--image-url", BENCH_URL_PATTERN]
+		stdout = sys.stdout
+		sys.stdout = StringIO.StringIO()
+		try:
+			cli.main(argv)
+			return sys.stdout.getvalue().splitlines()
+		finally:
+			sys.stdout = stdout
+
+	def test_accented_and_split_names(self):
+		lines = self.run_deck(["1 J\u00f6tun Grunt", "Jotun Grunt", "J\u00f6t\u00fcn Grunt", "2 Fire // Ice", "F\u00efre/Ice"])
+		self.assertIn("Matched Jotun Grunt to J\u00f6tun Grunt (1.00)", lines)
+		self.assertIn("Matched J\u00f6t\u00fcn Grunt to J\u00f6tun Grunt (1.00)", lines)
+		self.assertIn("Matched Fire // Ice to Fire (1.00)", lines)
+		self.assertIn("Matched F\u00efre/Ice to Fire (1.00)", lines)
+		self.assertEqual(["Saved J\u00f6tun Grunt", "Saved Fire"], [line.split(" - ")[0] for line in lines if line.startswith("Saved ")])
+		self.assertFalse([line for line in lines if line.startswith("[ERROR]")], lines)
+
+if __name__ == "__main__":
+	unittest.main()
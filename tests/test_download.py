@@ -0,0 +1,136 @@
+# use unicode literals
+from __future__ import unicode_literals
+
+# the image downloader against a local http server that stands in for the image
+# sources, so nothing goes out to the network
+import io
+import threading
+import unittest
+import SocketServer
+import BaseHTTPServer
+from PIL import Image
+
+from pymrox import download
+from pymrox.download import ImageDownloader
+
+# how often /flaky/ answers 503 before it sends the image
+FLAKY_FAILURES = 2
+
+# a small png for the server to send
+def fixture_png():
+	out = io.BytesIO()
+	Image.new("RGB", (20, 28), (200, 40, 40)).save(out, "PNG")
+	return out.getvalue()
+
+class ImageSourceHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+	# keep-alive like the real sources, so the pooled connections are used again
+	protocol_version = "HTTP/1.1"
+
+	def do_GET(self):
+		server = self.server
+		with server.lock:
+			server.requests.append(self.path)
+			count = server.requests.count(self.path)
+		source = self.path.split("/")[1]
+		if "img" == source:
+			self.answer(200, server.png)
+		elif "flaky" == source and count > FLAKY_FAILURES:
+			self.answer(200, server.png)
+		elif source in ["flaky", "down"]:
+			self.answer(503, b"busy")
+		elif "moved" == source:
+			self.answer(302, b"", self.path.replace("/moved/", "/img/", 1))
+		elif "bad" == source:
+			self.answer(200, b"not an image")
+		else:
+			self.answer(404, b"not found")
+
+	def answer(self, status, body, location = None):
+		self.send_response(status)
+		if location:
+			self.send_header("Location", location)
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, *args):
+		pass
+
+class ImageSourceServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	daemon_threads = True
+
+# the card data the url patterns are filled in from
+class FixtureSet(object):
+	code = "M15"
+
+class FixtureCard(object):
+	name = "Fixture Card"
+	number = "62"
+	set = FixtureSet()
+
+class DownloadTest(unittest.TestCase):
+	@classmethod
+	def setUpClass(cls):
+		cls.server = ImageSourceServer(("127.0.0.1", 0), ImageSourceHandler)
+		cls.server.lock = threading.Lock()
+		cls.server.png = fixture_png()
+		thread = threading.Thread(target = cls.server.serve_forever)
+		thread.daemon = True
+		thread.start()
+		cls.base = "http://127.0.0.1:{:d}".format(cls.server.server_address[1])
+
+	@classmethod
+	def tearDownClass(cls):
+		cls.server.shutdown()
+		cls.server.server_close()
+
+	def setUp(self):
+		self.server.requests = []
+		# no waiting between retries
+		self.backoff = download.DOWNLOAD_BACKOFF
+		download.DOWNLOAD_BACKOFF = 0
+
+	def tearDown(self):
+		download.DOWNLOAD_BACKOFF = self.backoff
+
+	def downloader(self, sources, retries = 3):
+		return ImageDownloader([self.base + "/" + source + "/{:s}/{:s}.png" for source in sources], 2, retries)
+
+	def test_download(self):
+		url, data = self.downloader(["img"]).download(FixtureCard())
+		self.assertEqual(self.base + "/img/m15/62.png", url)
+		self.assertEqual(self.server.png, data)
+
+	def test_retry(self):
+		url, data = self.downloader(["flaky"]).download(FixtureCard())
+		self.assertEqual(self.base + "/flaky/m15/62.png", url)
+		self.assertEqual(self.server.png, data)
+		self.assertEqual(["/flaky/m15/62.png"] * (FLAKY_FAILURES + 1), self.server.requests)
+
+	def test_retries_run_out(self):
+		url, errors = self.downloader(["down"], retries = 2).download(FixtureCard())
+		self.assertIsNone(url)
+		self.assertIn("HTTP 503", errors)
+		self.assertEqual(3, len(self.server.requests))
+
+	def test_redirect(self):
+		url, data = self.downloader(["moved"]).download(FixtureCard())
+		# the image is filed under the url of the source, not where it moved to
+		self.assertEqual(self.base + "/moved/m15/62.png", url)
+		self.assertEqual(self.server.png, data)
+		self.assertEqual(["/moved/m15/62.png", "/img/m15/62.png"], self.server.requests)
+
+	def test_fallback(self):
+		url, data = self.downloader(["missing", "bad", "down", "img"], retries = 1).download(FixtureCard())
+		self.assertEqual(self.base + "/img/m15/62.png", url)
+		self.assertEqual(self.server.png, data)
+		self.assertEqual(["/missing/m15/62.png", "/bad/m15/62.png", "/down/m15/62.png", "/down/m15/62.png", "/img/m15/62.png"], self.server.requests)
+
+	def test_no_source_has_it(self):
+		url, errors = self.downloader(["missing", "bad"]).download(FixtureCard())
+		self.assertIsNone(url)
+		self.assertIn("no image at " + self.base + "/missing/m15/62.png", errors)
+		self.assertIn("bad image from " + self.base + "/bad/m15/62.png", errors)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,60 @@
+# use unicode literals
+from __future__ import unicode_literals
+
+# the manifest of an output directory on the benchmark fixtures: which cards a
+# run makes again and which it leaves as they are
+import os
+import shutil
+import tempfile
+import unittest
+
+from pymrox.bench import BENCH_URL_PATTERN, fixture_card, fixture_image, prepare_fixtures
+from pymrox.pipeline import getOutputFileName, process_cards
+
+class ManifestTest(unittest.TestCase):
+	def setUp(self):
+		self.workdir = tempfile.mkdtemp(prefix = "pymrox-test-")
+		self.config = prepare_fixtures(self.workdir, 1, 1).copy(overwrite = False)
+		self.name = fixture_card(0)[5]
+		self.card = self.config.db.find_printings(self.name)[0]
+		self.assertTrue(self.run_card()[0].startswith("Saved "))
+
+	def tearDown(self):
+		self.config.close()
+		shutil.rmtree(self.workdir, ignore_errors = True)
+
+	# the lines of a run on the fixture card
+	def run_card(self, config = None):
+		return list(process_cards([self.name], config or self.config))
+
+	def test_nothing_changed(self):
+		mtime = os.stat(getOutputFileName(self.card, self.config)).st_mtime
+		lines = self.run_card()
+		self.assertEqual(1, len(lines))
+		self.assertTrue(lines[0].startswith("Existing " + self.name), lines[0])
+		self.assertEqual(mtime, os.stat(getOutputFileName(self.card, self.config)).st_mtime)
+
+	def test_render_parameter_changed(self):
+		lines = self.run_card(self.config.copy(border = self.config.border + 4))
+		self.assertEqual(1, len(lines))
+		self.assertTrue(lines[0].startswith("Saved " + self.name), lines[0])
+		self.assertTrue(lines[0].endswith("(border changed)"), lines[0])
+		# and it is up to date with the new border from then on
+		self.assertTrue(self.run_card(self.config.copy(border = self.config.border + 4))[0].startswith("Existing "))
+
+	def test_source_image_changed(self):
+		code, number = fixture_card(0)[2].lower(), fixture_card(0)[6]
+		self.config.image_cache.put(BENCH_URL_PATTERN.format(code, number), code, number, fixture_image(1))
+		lines = self.run_card()
+		self.assertTrue(lines[0].startswith("Saved " + self.name), lines[0])
+		self.assertTrue(lines[0].endswith("(source image changed)"), lines[0])
+
+	# a card put there by hand is not made again, whatever changed
+	def test_replaced_by_hand(self):
+		with open(getOutputFileName(self.card, self.config), "wb") as f:
+			f.write(fixture_image(0))
+		lines = self.run_card(self.config.copy(border = self.config.border + 4))
+		self.assertTrue(lines[0].startswith("Existing " + self.name), lines[0])
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,63 @@
+# use unicode literals
+from __future__ import unicode_literals
+
+# the card stream on the benchmark fixtures
+import shutil
+import tempfile
+import threading
+import unittest
+
+from pymrox.bench import fixture_card, prepare_fixtures
+from pymrox import pipeline
+from pymrox.pipeline import process_cards
+
+# how long a run of a few fixture cards may take before it is taken to hang
+STREAM_TIMEOUT = 120
+
+class PipelineTest(unittest.TestCase):
+	def setUp(self):
+		self.workdir = tempfile.mkdtemp(prefix = "pymrox-test-")
+		self.config = prepare_fixtures(self.workdir, 2, 1)
+
+	def tearDown(self):
+		self.config.close()
+		shutil.rmtree(self.workdir, ignore_errors = True)
+
+	# the lines of the run, None when it did not finish in time
+	def run_stream(self, entries):
+		messages = []
+		def run():
+			messages.extend(process_cards(entries, self.config))
+			messages.append(None)
+		thread = threading.Thread(target = run)
+		thread.daemon = True
+		thread.start()
+		thread.join(STREAM_TIMEOUT)
+		if not messages or messages[-1] is not None:
+			return None
+		return messages[:-1]
+
+	# an entry whose error cannot be formatted still gets a line, the stream used
+	# to wait for it forever
+	def test_entry_in_bytes_does_not_hang(self):
+		messages = self.run_stream([b"B\xc3\xa9nch Nope", fixture_card(0)[5]])
+		self.assertIsNotNone(messages, "the stream did not finish")
+		self.assertEqual(2, len(messages))
+		self.assertTrue(messages[0].startswith("[ERROR]"), messages[0])
+		self.assertTrue(messages[1].startswith("Saved "), messages[1])
+
+	# a card that resolved and then could not be looked for on disk is not
+	# reported as one that could not be resolved
+	def test_error_after_resolving(self):
+		def needs_processing(card, config, overwrite = False):
+			raise OSError("no file system")
+		original = pipeline.needs_processing
+		pipeline.needs_processing = needs_processing
+		try:
+			messages = self.run_stream([fixture_card(0)[5]])
+		finally:
+			pipeline.needs_processing = original
+		self.assertEqual(["[ERROR] OSError: no file system | could not process {:s} (set=wth, id=1)".format(fixture_card(0)[5])], messages)
+
+if __name__ == "__main__":
+	unittest.main()
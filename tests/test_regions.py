@@ -0,0 +1,58 @@
+# use unicode literals
+from __future__ import unicode_literals
+
+# calibrating region profiles from the benchmark fixtures
+import shutil
+import tempfile
+import unittest
+
+from pymrox.bench import BENCH_FIXTURES, BENCH_URL_PATTERN, prepare_fixtures
+from pymrox.config import Config
+from pymrox.regions import calibrate, open_region_profiles
+
+# fixture cards of each handler, the text of this many left illustrator cards
+# together spans the whole box of the handler
+FIXTURES_PER_HANDLER = 9
+
+class CalibrateTest(unittest.TestCase):
+	@classmethod
+	def setUpClass(cls):
+		cls.workdir = tempfile.mkdtemp(prefix = "pymrox-test-")
+		prepare_fixtures(cls.workdir, FIXTURES_PER_HANDLER * len(BENCH_FIXTURES), 1).close()
+
+	@classmethod
+	def tearDownClass(cls):
+		shutil.rmtree(cls.workdir, ignore_errors = True)
+
+	# the messages of calibrating the sets, and the profiles that were stored
+	def calibrate(self, set_codes):
+		config = prepare_fixtures(self.workdir, FIXTURES_PER_HANDLER * len(BENCH_FIXTURES), 1)
+		try:
+			return list(calibrate(config, set_codes)), open_region_profiles(config.cache_dir).sets
+		finally:
+			config.close()
+
+	# the text of a fixture is drawn all over the boxes of its handler, which is
+	# not the same as no text turning up
+	def test_text_all_over_the_region(self):
+		messages, profiles = self.calibrate(["WTH"])
+		self.assertEqual(["Calibrated WTH fix_cards_with_left_illustrator from 9 cards - text turned up in 1 of 1 regions but takes up all of them, its regions stay as they are"], messages)
+
+	# the black background handler detects each of its regions on the card as the
+	# region before it left it, text has to turn up in all three (narrowed or not)
+	def test_regions_detected_after_each_other(self):
+		messages, profiles = self.calibrate(["VMA"])
+		self.assertEqual(["Calibrated VMA fix_cards_with_illustrator_on_black_background from 9 cards - 1 of 3 regions narrowed to 92% of their area, text takes up all of 2 more"], messages)
+		self.assertEqual({"981,1015,250,475": [981, 1015, 267, 475]}, profiles["vma"]["fix_cards_with_illustrator_on_black_background"]["regions"])
+
+	def test_nothing_cached(self):
+		config = Config(self.workdir, cache_dir = self.workdir + "/empty", image_urls = [BENCH_URL_PATTERN])
+		try:
+			messages = list(calibrate(config))
+		finally:
+			config.close()
+		self.assertEqual(1, len(messages))
+		self.assertTrue(messages[0].startswith("[ERROR] no set has cached images"), messages[0])
+
+if __name__ == "__main__":
+	unittest.main()
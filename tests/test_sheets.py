@@ -0,0 +1,50 @@
+# use unicode literals
+from __future__ import unicode_literals
+
+# the print sheets of the benchmark fixtures
+import time
+import shutil
+import tempfile
+import unittest
+
+from pymrox.bench import fixture_card, prepare_fixtures
+from pymrox.pipeline import CardStream
+from pymrox.sheets import SheetCompositor
+
+# more cards than fit on a sheet
+SHEET_CARDS = 12
+
+class SheetsTest(unittest.TestCase):
+	def setUp(self):
+		self.workdir = tempfile.mkdtemp(prefix = "pymrox-test-")
+		self.config = prepare_fixtures(self.workdir, SHEET_CARDS, 1).copy(sheets = self.workdir + "/sheets", write_workers = 3)
+
+	def tearDown(self):
+		self.config.close()
+		shutil.rmtree(self.workdir, ignore_errors = True)
+
+	# the cards go on the sheets in deck order, however the write threads finish them
+	def test_deck_order(self):
+		cards = [self.config.db.find_printings(fixture_card(n)[5])[0] for n in range(SHEET_CARDS)]
+		compositor = SheetCompositor(self.config, dict((card.name, 1) for card in cards))
+		placed = []
+		place, cut = compositor.place, compositor.cut
+		def place_card(card, tile):
+			placed.append(card.name)
+			return place(card, tile)
+		# the first card is the last one out of the write threads
+		def cut_card(img):
+			if cut_card.first:
+				cut_card.first = False
+				time.sleep(1)
+			return cut(img)
+		cut_card.first = True
+		compositor.place, compositor.cut = place_card, cut_card
+
+		messages = list(CardStream(self.config, overwrite = True, compositor = compositor).run(cards))
+		self.assertEqual("Sheets - 12 cards on 2 sheets @ " + self.config.sheets, compositor.close())
+		self.assertEqual([card.name for card in cards], placed)
+		self.assertEqual(["Placed 1 x {:s} on sheet {:d}".format(card.name, n // 9 + 1) for n, card in enumerate(cards)], [message.split(" (set=")[0] for message in messages])
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,37 @@
+# use unicode literals
+from __future__ import unicode_literals
+
+# the fast path against the reference path (what --verify does) on the benchmark
+# fixtures, one card for each region handler
+import io
+import shutil
+import tempfile
+import unittest
+from PIL import Image
+
+from pymrox.bench import BENCH_FIXTURES, fixture_card, fixture_image, prepare_fixtures
+from pymrox.conditioning import fix_card, select_frame, verify_card
+
+class VerifyTest(unittest.TestCase):
+	@classmethod
+	def setUpClass(cls):
+		cls.workdir = tempfile.mkdtemp(prefix = "pymrox-test-")
+		cls.config = prepare_fixtures(cls.workdir, len(BENCH_FIXTURES), 1)
+
+	@classmethod
+	def tearDownClass(cls):
+		cls.config.close()
+		shutil.rmtree(cls.workdir, ignore_errors = True)
+
+	def test_handlers_match_reference_path(self):
+		for n in range(len(BENCH_FIXTURES)):
+			label, handler, code, fields, boxes, name, number = fixture_card(n)
+			card = self.config.db.find_printings(name)[0]
+			self.assertEqual(handler, select_frame(card, self.config)[0].__name__)
+			img = Image.open(io.BytesIO(fixture_image(n)))
+			img.load()
+			report = verify_card(card, img, fix_card(card, img, self.config), self.config)
+			self.assertFalse(report.startswith("[ERROR]"), report)
+
+if __name__ == "__main__":
+	unittest.main()